@@ -0,0 +1,247 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+SAMPLE_RE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})?\s+(\S+)")
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RECORDS_PER_PACKET = 30  # NetFlow v5 packets the generators send by default
+
+
+def load_config(config_file):
+    """Loads configuration from a JSON file."""
+    with open(config_file, "r") as f:
+        return json.load(f)
+
+
+def scrape_metrics(url, timeout=10):
+    """Fetches a Prometheus text endpoint; returns ({metric_name: summed value}, scrape seconds)."""
+    start = time.monotonic()
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        body = response.read().decode("utf-8", errors="replace")
+    elapsed = time.monotonic() - start
+
+    totals = {}
+    for line in body.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = SAMPLE_RE.match(line)
+        if not match:
+            continue
+        try:
+            value = float(match.group(3))
+        except ValueError:
+            continue
+        totals[match.group(1)] = totals.get(match.group(1), 0.0) + value
+    return totals, elapsed
+
+
+def sum_metrics(metrics, names):
+    """Sums the named metrics, ignoring names the endpoint does not expose."""
+    return sum(metrics.get(name, 0.0) for name in names)
+
+
+def scrape_sent(url):
+    """Returns the (datagrams, records) the generator reports sent so far, or None if its endpoint is unreachable."""
+    try:
+        metrics, _ = scrape_metrics(url)
+    except OSError:
+        return None
+    return metrics.get("flow_generator_packets_sent_total", 0.0), metrics.get("flow_generator_records_sent_total", 0.0)
+
+
+class GeneratorRun:
+    """Runs one of the flow generators in a scratch directory with flows_per_second overridden.
+
+    The generators read config.json from the working directory and import
+    their helper modules from the script directory, so the script runs in
+    place while its config is a patched copy. A relative generator_dir is
+    taken from this script's directory. The generator serves its own metrics
+    on generator_metrics_port unless its config already sets a metrics_port.
+    """
+
+    def __init__(self, config, fps):
+        generator_dir = os.path.join(SCRIPT_DIR, config["generator_dir"])
+        self.script = os.path.join(generator_dir, config["generator_script"])
+        self.workdir = tempfile.mkdtemp(prefix="flow_benchmark_")
+
+        generator_config = load_config(os.path.join(generator_dir, "config.json"))
+        generator_config.update(config.get("generator_config", {}))
+        generator_config["flows_per_second"] = fps
+        if not generator_config.get("metrics_port"):
+            generator_config["metrics_port"] = config.get("generator_metrics_port", 9109)
+        self.metrics_url = f"http://127.0.0.1:{generator_config['metrics_port']}/metrics"
+        self.records_per_packet = generator_config.get("records_per_packet", DEFAULT_RECORDS_PER_PACKET)
+        with open(os.path.join(self.workdir, "config.json"), "w") as f:
+            json.dump(generator_config, f, indent=2)
+
+        self.log = open(os.path.join(self.workdir, "generator.log"), "w")
+        self.process = subprocess.Popen([sys.executable, self.script], cwd=self.workdir,
+                                        stdout=self.log, stderr=subprocess.STDOUT, start_new_session=True)
+
+    def stop(self):
+        """Interrupts the generator's process group and removes the scratch directory."""
+        if self.process.poll() is None:
+            os.killpg(self.process.pid, signal.SIGINT)
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                os.killpg(self.process.pid, signal.SIGKILL)
+                self.process.wait()
+        self.log.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def run_step(config, fps):
+    """Drives the generator at fps for one step and returns the measured collector behaviour.
+
+    The drop ratio compares drop_metrics with what the generator sent in the same unit: datagrams, or flow
+    records with drop_unit "records". If the generator's own metrics cannot be scraped, the sent amount is
+    estimated from fps.
+    """
+    url = config["metrics_url"]
+    received_metrics = config.get("received_metrics", [])
+    drop_metrics = config.get("drop_metrics", [])
+    queue_metrics = config.get("queue_metrics", [])
+    latency_metrics = config.get("latency_metrics", [])
+    duration = config.get("step_duration", 60)
+    drop_unit = config.get("drop_unit", "datagrams")
+    if drop_unit not in ("datagrams", "records"):
+        raise ValueError(f"Unknown drop_unit: {drop_unit}")
+
+    print(f"[*] Step at {fps} FPS: warming up for {config.get('warmup', 15)}s")
+    run = GeneratorRun(config, fps)
+    try:
+        time.sleep(config.get("warmup", 15))
+        before, _ = scrape_metrics(url)
+        sent_before = scrape_sent(run.metrics_url)
+        start = time.monotonic()
+        time.sleep(duration)
+        after, scrape_latency = scrape_metrics(url)
+        sent_after = scrape_sent(run.metrics_url)
+        elapsed = time.monotonic() - start
+        generator_alive = run.process.poll() is None
+    finally:
+        run.stop()
+
+    if sent_before and sent_after:
+        sent_datagrams, sent_records = (now - then for then, now in zip(sent_before, sent_after))
+    else:
+        sent_records = fps * elapsed
+        sent_datagrams = sent_records / run.records_per_packet
+    sent = sent_datagrams if drop_unit == "datagrams" else sent_records
+    received = sum_metrics(after, received_metrics) - sum_metrics(before, received_metrics)
+    drops = sum_metrics(after, drop_metrics) - sum_metrics(before, drop_metrics)
+    step = {
+        "target_fps": fps,
+        "duration": round(elapsed, 3),
+        "sent_datagrams": sent_datagrams,
+        "sent_records": sent_records,
+        "received_fps": round(received / elapsed, 1) if received_metrics else None,
+        "drops": drops,
+        "drop_ratio": drops / sent if sent else 0.0,
+        "queue": sum_metrics(after, queue_metrics) if queue_metrics else None,
+        "latency": sum_metrics(after, latency_metrics) if latency_metrics else None,
+        "scrape_latency": round(scrape_latency, 4),
+        "generator_alive": generator_alive,
+    }
+    step["saturated"] = is_saturated(config, step)
+    print(f"[+] {fps} FPS: received {step['received_fps']} FPS, drops {drops:.0f} {drop_unit} "
+          f"({step['drop_ratio']:.4%}), queue {step['queue']}, saturated={step['saturated']}")
+    return step
+
+
+def is_saturated(config, step):
+    """Applies the configured thresholds to one step's measurements."""
+    thresholds = config.get("saturation", {})
+    if not step["generator_alive"]:
+        return True
+    if step["drop_ratio"] > thresholds.get("max_drop_ratio", 0.001):
+        return True
+    if step["received_fps"] is not None:
+        if step["received_fps"] < step["target_fps"] * (1 - thresholds.get("max_receive_deficit", 0.02)):
+            return True
+    if step["queue"] is not None and "max_queue" in thresholds:
+        if step["queue"] > thresholds["max_queue"]:
+            return True
+    return False
+
+
+def stepped_schedule(config, schedule):
+    """Raises the rate by step_fps until the collector saturates or max_fps is reached."""
+    steps = []
+    max_sustained = None
+    fps = schedule["start_fps"]
+    while fps <= schedule["max_fps"]:
+        step = run_step(config, fps)
+        steps.append(step)
+        if step["saturated"]:
+            break
+        max_sustained = fps
+        fps += schedule["step_fps"]
+    return max_sustained, steps
+
+
+def binary_schedule(config, schedule):
+    """Binary-searches the highest unsaturated rate between low_fps and high_fps.
+
+    Both bounds are measured first: a saturated low_fps ends the search with no
+    sustained rate, and an unsaturated high_fps is itself the answer.
+    """
+    low, high = schedule["low_fps"], schedule["high_fps"]
+    steps = [run_step(config, low)]
+    if steps[-1]["saturated"]:
+        return None, steps
+    steps.append(run_step(config, high))
+    if not steps[-1]["saturated"]:
+        return high, steps
+    max_sustained = low
+    while high - low > schedule.get("resolution_fps", 1000):
+        fps = (low + high) // 2
+        step = run_step(config, fps)
+        steps.append(step)
+        if step["saturated"]:
+            high = fps
+        else:
+            low = max_sustained = fps
+    return max_sustained, steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the highest flow rate a collector sustains")
+    parser.add_argument("-c", "--config", default="benchmark.json", help="Benchmark configuration file")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    schedule = config["schedule"]
+    started = time.time()
+
+    if schedule.get("mode", "step") == "binary":
+        max_sustained, steps = binary_schedule(config, schedule)
+    else:
+        max_sustained, steps = stepped_schedule(config, schedule)
+
+    report = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(started)),
+        "label": config.get("label", ""),
+        "generator": config["generator_script"],
+        "metrics_url": config["metrics_url"],
+        "schedule": schedule,
+        "max_sustained_fps": max_sustained,
+        "steps": steps,
+    }
+    report_file = config.get("report_file", "benchmark_report.json")
+    with open(report_file, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[+] Max sustained rate: {max_sustained} FPS. Report written to {report_file}")
+
+
+if __name__ == "__main__":
+    main()
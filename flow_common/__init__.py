@@ -0,0 +1,4 @@
+"""Code shared by the flow generators (netflow_generator, netflowv5_generator_2) and the packet exporters
+(packet_to_netflow, packet_to_ipfix). Their scripts put the repository root on sys.path to import it, so this
+directory has to be copied along with any of theirs. Only the standard library is used here, because
+netflow_generator and the packet exporters run without NumPy."""
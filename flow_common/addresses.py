@@ -0,0 +1,50 @@
+import ipaddress
+import zlib
+
+MASK64 = (1 << 64) - 1
+
+
+def subnet_host_range(subnet):
+    """Returns (first_host, host_count) of a subnet as integers, matching IPv4Network.hosts()."""
+    network = ipaddress.IPv4Network(subnet, strict=False)
+    if network.prefixlen >= 31:
+        return int(network.network_address), network.num_addresses
+    return int(network.network_address) + 1, network.num_addresses - 2
+
+
+def collector_endpoints(config):
+    """Returns the (ip, port) of every configured collector: the "collectors" list, or collector_ip/collector_port.
+
+    List entries are "ip" or "ip:port" strings; entries without a port use collector_port.
+    """
+    collectors = config.get("collectors")
+    if not collectors:
+        return [(config["collector_ip"], config["collector_port"])]
+    endpoints = []
+    for entry in collectors:
+        ip, _, port = entry.partition(":")
+        endpoints.append((ip, int(port) if port else config["collector_port"]))
+    return endpoints
+
+
+def _mix64(value):
+    """splitmix64 finalizer: a cheap hash of a 64-bit integer with well spread output bits."""
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+    return value ^ (value >> 31)
+
+
+def rendezvous_seeds(endpoints):
+    """Returns the rendezvous hashing seed of each collector (ip, port), derived from its "ip:port" label."""
+    labels = [f"{ip}:{port}" for ip, port in endpoints]
+    return [zlib.crc32(label.encode()) << 32 | zlib.crc32(label[::-1].encode()) for label in labels]
+
+
+def rendezvous_index(key, seeds):
+    """Returns the index of the collector an exporter sticks to, by rendezvous (highest random weight) hashing.
+
+    key is the exporter's source identity as an integer, seeds come from
+    rendezvous_seeds(). Adding or removing a collector only moves the
+    exporters of that collector. Both generators assign collectors with it.
+    """
+    return max(range(len(seeds)), key=lambda i: _mix64(key ^ seeds[i]))
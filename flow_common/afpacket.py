@@ -0,0 +1,280 @@
+import ctypes
+import mmap
+import select
+import socket
+import struct
+import sys
+import time
+
+ETH_P_ALL = 0x0003
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+VLAN_ETHERTYPES = (0x8100, 0x88A8)
+SO_ATTACH_FILTER = 26
+SO_RCVBUFFORCE = 33
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+SNAPLEN = 256  # bytes of each frame copied to user space; enough for stacked VLAN tags and IPv6 extension headers
+RECEIVE_TIMEOUT = 0.2  # seconds a receive blocks before the capture loop checks its deadline
+RING_BLOCK_SIZE = 1 << 20
+RING_FRAME_SIZE = 2048  # only used to validate the ring: TPACKET_V3 packs frames of any size into its blocks
+RING_BLOCK_TIMEOUT_MS = 100  # the kernel hands over a partly filled block after this long, so quiet links are not stuck
+
+IPV6_EXTENSION_HEADERS = (0, 43, 60)  # hop-by-hop, routing and destination options: (length + 1) * 8 bytes
+IPV6_FRAGMENT = 44
+IPV6_AUTH = 51
+
+U16 = struct.Struct("!H")
+VLAN_TYPE = struct.Struct("!2xH")
+IPV4_ADDRESSES = struct.Struct("!II")
+IPV6_ADDRESSES = struct.Struct("!QQQQ")
+PORTS = struct.Struct("!HH")
+SOCK_FILTER = struct.Struct("HBBI")
+TIMEVAL = struct.Struct("ll")
+TPACKET_REQ3 = struct.Struct("7I")
+TPACKET_STATS = struct.Struct("II")  # tp_packets and tp_drops, the start of tpacket_stats and tpacket_stats_v3
+BLOCK_HEADER = struct.Struct("8xIII")  # block_status, num_pkts and offset_to_first_pkt of a tpacket_block_desc
+FRAME_HEADER = struct.Struct("I8xII4xH")  # tp_next_offset, tp_snaplen, tp_len and tp_mac of a tpacket3_hdr
+BLOCK_STATUS = struct.Struct("I")
+
+
+def bpf_program(ipv6=False, snaplen=0x40000):
+    """Returns the classic BPF instructions (code, jt, jf, k) accepting IPv4 frames, untagged or behind one VLAN tag,
+    and with ipv6 IPv6 frames too. Everything else is dropped in the kernel before it is copied; accepted frames are
+    cut to snaplen bytes."""
+    accepted = [ETH_P_IP, ETH_P_IPV6] if ipv6 else [ETH_P_IP]
+
+    def match(offset):
+        # ldh [offset]; one jeq per accepted ethertype jumping to the final accept.
+        return [(0x28, 0, 0, offset)] + [(0x15, None, 0, ethertype) for ethertype in accepted]
+
+    program = match(12)
+    program += [(0x15, 1, 0, VLAN_ETHERTYPES[0]), (0x15, 0, None, VLAN_ETHERTYPES[1])]
+    program += match(16)
+    program += [(0x06, 0, 0, 0), (0x06, 0, 0, snaplen)]  # ret #0 (drop); ret #snaplen (accept)
+    accept, drop = len(program) - 1, len(program) - 2
+    # Resolve the jump placeholders: jt None jumps to accept, jf None to drop.
+    return [(code, accept - i - 1 if jt is None else jt, drop - i - 1 if jf is None else jf, k)
+            for i, (code, jt, jf, k) in enumerate(program)]
+
+
+def attach_filter(sock, ipv6=False, snaplen=0x40000):
+    """Attaches the BPF program to sock and returns the buffer holding its instructions, which must outlive the call."""
+    instructions = bpf_program(ipv6, snaplen)
+    buffer = ctypes.create_string_buffer(b"".join(SOCK_FILTER.pack(*insn) for insn in instructions))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, struct.pack("HL", len(instructions), ctypes.addressof(buffer)))
+    return buffer
+
+
+def parse_frame(frame):
+    """Returns (ip_version, src, dst, src_port, dst_port, proto, tcp_flags, payload_offset) of an Ethernet frame, or
+    None if it is not IP.
+
+    Addresses are ints (128-bit for IPv6). Ports are 0 for protocols other than TCP and UDP and for non-first
+    fragments, and payload_offset is then 0 too; otherwise it is where the TCP or UDP payload starts in frame. frame
+    is a bytes-like object holding at least the headers, e.g. a memoryview of a receive buffer; a frame cut off inside
+    its headers raises struct.error or IndexError.
+    """
+    ethertype = U16.unpack_from(frame, 12)[0]
+    offset = 14
+    while ethertype in VLAN_ETHERTYPES:
+        ethertype = VLAN_TYPE.unpack_from(frame, offset)[0]
+        offset += 4
+    if ethertype == ETH_P_IP:
+        header_length = (frame[offset] & 0x0F) * 4
+        proto = frame[offset + 9]
+        src, dst = IPV4_ADDRESSES.unpack_from(frame, offset + 12)
+        if U16.unpack_from(frame, offset + 6)[0] & 0x1FFF:
+            return 4, src, dst, 0, 0, proto, 0, 0
+        version, offset = 4, offset + header_length
+    elif ethertype == ETH_P_IPV6:
+        proto = frame[offset + 6]
+        src_hi, src_lo, dst_hi, dst_lo = IPV6_ADDRESSES.unpack_from(frame, offset + 8)
+        src, dst = src_hi << 64 | src_lo, dst_hi << 64 | dst_lo
+        offset += 40
+        while proto in IPV6_EXTENSION_HEADERS or proto == IPV6_AUTH or proto == IPV6_FRAGMENT:
+            if proto == IPV6_FRAGMENT:
+                if U16.unpack_from(frame, offset + 2)[0] & 0xFFF8:
+                    return 6, src, dst, 0, 0, frame[offset], 0, 0
+                proto, offset = frame[offset], offset + 8
+            elif proto == IPV6_AUTH:
+                proto, offset = frame[offset], offset + (frame[offset + 1] + 2) * 4
+            else:
+                proto, offset = frame[offset], offset + (frame[offset + 1] + 1) * 8
+        version = 6
+    else:
+        return None
+    if proto == 6:
+        src_port, dst_port = PORTS.unpack_from(frame, offset)
+        return version, src, dst, src_port, dst_port, proto, frame[offset + 13], offset + (frame[offset + 12] >> 4) * 4
+    if proto == 17:
+        src_port, dst_port = PORTS.unpack_from(frame, offset)
+        return version, src, dst, src_port, dst_port, proto, 0, offset + 8
+    return version, src, dst, 0, 0, proto, 0, 0
+
+
+class PacketSocket:
+    """An AF_PACKET socket on one interface, with a BPF filter attached before it is bound.
+
+    Attaching the filter to a socket that is not bound to a protocol yet means
+    no unfiltered frame can be queued in between. receive_buffer sizes the
+    kernel queue that absorbs bursts while Python is busy. Each receive
+    copies at most snaplen bytes into a reused buffer and returns the frame's
+    full length. The socket stays blocking with a kernel receive timeout
+    (SO_RCVTIMEO), so a frame costs one system call rather than a poll and a
+    receive.
+    """
+
+    def __init__(self, interface, ipv6=False, receive_buffer=8 << 20, snaplen=SNAPLEN):
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+        self.filter = attach_filter(self.sock, ipv6)
+        try:
+            # Capturing needs CAP_NET_RAW, which usually comes with root and so with the right to exceed rmem_max.
+            self.sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, receive_buffer)
+        except PermissionError:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+        self.sock.bind((interface, ETH_P_ALL))
+        seconds = int(RECEIVE_TIMEOUT)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO,
+                             TIMEVAL.pack(seconds, int((RECEIVE_TIMEOUT - seconds) * 1e6)))
+        self.snaplen = snaplen
+        self.view = memoryview(bytearray(snaplen))
+        self.packets = self.drops = 0
+
+    def capture(self, handler, timeout):
+        """Calls handler(frame, frame_length) for every frame received in the next timeout seconds. frame is a
+        memoryview of the captured bytes, valid until handler returns."""
+        view, snaplen = self.view, self.snaplen
+        recv_into = self.sock.recv_into
+        monotonic = time.monotonic
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            try:
+                # MSG_TRUNC makes the kernel return the frame's real length although only snaplen bytes are copied.
+                length = recv_into(view, snaplen, socket.MSG_TRUNC)
+            except BlockingIOError:
+                continue  # the receive timeout expired without a frame
+            handler(view[:length] if length < snaplen else view, length)
+
+    def statistics(self):
+        """Returns the frames that passed the filter and how many of them the kernel dropped because the queue was
+        full, both since the socket was opened."""
+        packets, drops = TPACKET_STATS.unpack(self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, TPACKET_STATS.size))
+        # The kernel resets its counters on every read.
+        self.packets += packets
+        self.drops += drops
+        return self.packets, self.drops
+
+    def close(self):
+        self.sock.close()
+
+
+class PacketRing:
+    """A TPACKET_V3 receive ring on one interface, memory-mapped so frames need no system call to be read.
+
+    The ring is ring_bytes of RING_BLOCK_SIZE blocks. The kernel fills a block
+    with variable-length frames, each cut to snaplen by the BPF filter, and
+    hands it over when it is full or RING_BLOCK_TIMEOUT_MS after its first
+    frame, so a busy link delivers thousands of frames per wakeup. capture()
+    walks the frames of each handed-over block in place and then returns the
+    block to the kernel. Frames that arrive while no block is free are
+    dropped by the kernel and counted in statistics().
+    """
+
+    def __init__(self, interface, ipv6=False, ring_bytes=64 << 20, snaplen=SNAPLEN):
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+        self.filter = attach_filter(self.sock, ipv6, snaplen)
+        self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+        self.block_nr = max(1, ring_bytes // RING_BLOCK_SIZE)
+        frames_per_block = RING_BLOCK_SIZE // RING_FRAME_SIZE
+        self.sock.setsockopt(SOL_PACKET, PACKET_RX_RING, TPACKET_REQ3.pack(
+            RING_BLOCK_SIZE, self.block_nr, RING_FRAME_SIZE, frames_per_block * self.block_nr, RING_BLOCK_TIMEOUT_MS,
+            0, 0))
+        self.map = mmap.mmap(self.sock.fileno(), RING_BLOCK_SIZE * self.block_nr, mmap.MAP_SHARED,
+                             mmap.PROT_READ | mmap.PROT_WRITE)
+        self.sock.bind((interface, ETH_P_ALL))
+        self.view = memoryview(self.map)
+        self.poller = select.poll()
+        self.poller.register(self.sock.fileno(), select.POLLIN | select.POLLERR)
+        self.block = 0
+        self.packets = self.drops = 0
+
+    def capture(self, handler, timeout):
+        """Calls handler(frame, frame_length) for every frame received in the next timeout seconds. frame is a
+        memoryview into the ring, valid until handler returns."""
+        view = self.view
+        monotonic = time.monotonic
+        deadline = monotonic() + timeout
+        while True:
+            # Checked before every block: on a link busier than Python, a handed-over block is always waiting.
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return
+            start = self.block * RING_BLOCK_SIZE
+            status, count, position = BLOCK_HEADER.unpack_from(view, start)
+            if not status & TP_STATUS_USER:
+                self.poller.poll(remaining * 1000)
+                continue
+            position += start
+            for _ in range(count):
+                next_offset, snaplen, length, mac = FRAME_HEADER.unpack_from(view, position)
+                handler(view[position + mac:position + mac + snaplen], length)
+                position += next_offset
+            BLOCK_STATUS.pack_into(view, start + 8, TP_STATUS_KERNEL)
+            self.block = (self.block + 1) % self.block_nr
+
+    def statistics(self):
+        """Returns the frames that passed the filter and how many of them the kernel dropped because no block was
+        free, both since the ring was opened."""
+        stats = self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, TPACKET_STATS.size + 4)
+        packets, drops = TPACKET_STATS.unpack_from(stats)
+        # The kernel resets its counters on every read.
+        self.packets += packets
+        self.drops += drops
+        return self.packets, self.drops
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+        self.sock.close()
+
+
+def open_packet_capture(backend, interface, ipv6=False, receive_buffer=64 << 20, snaplen=SNAPLEN):
+    """Returns the PacketRing ("ring") or PacketSocket ("socket") capturing on interface. receive_buffer is the size of
+    the ring or of the socket's receive queue."""
+    if backend == "ring":
+        return PacketRing(interface, ipv6, receive_buffer, snaplen)
+    if backend == "socket":
+        return PacketSocket(interface, ipv6, receive_buffer, snaplen)
+    raise ValueError(f"Unknown AF_PACKET capture backend: {backend}")
+
+
+def open_capture(backend, interface, frame_handler, scapy_capture, ipv6=False, receive_buffer=64 << 20,
+                 snaplen=SNAPLEN):
+    """Returns the capture(timeout) function of a capture backend and its kernel statistics() function, if it has one.
+
+    "ring" reads frames from a TPACKET_V3 memory-mapped ring and "socket" from an AF_PACKET socket (both Linux only);
+    both pass every frame to frame_handler(frame, frame_length). "scapy" returns scapy_capture(), which sniffs with
+    scapy (Npcap on Windows), so scapy is only imported when it is used. "auto" picks ring on Linux and scapy
+    elsewhere.
+    """
+    if backend == "auto":
+        backend = "ring" if sys.platform.startswith("linux") else "scapy"
+    if backend == "scapy":
+        return scapy_capture(), None
+    capture = open_packet_capture(backend, interface, ipv6, receive_buffer, snaplen)
+    return lambda timeout: capture.capture(frame_handler, timeout), capture.statistics
+
+
+def report_capture(statistics, last, prefix=""):
+    """Prints the frames that passed the kernel filter since the last report and how many of them were dropped because
+    the capture could not keep up; returns the totals so far, to pass as last next time."""
+    packets, drops = statistics()
+    matched, dropped = packets - last[0], drops - last[1]
+    print(f"{prefix}Kernel matched {matched} frames, dropped {dropped} ({dropped / max(matched, 1):.2%})")
+    return packets, drops
@@ -0,0 +1,79 @@
+import time
+from datetime import datetime, timezone
+
+
+def parse_time(value):
+    """Parses epoch seconds or an ISO 8601 timestamp (UTC unless it carries an offset)."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def format_time(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class BackfillClock:
+    """Synthetic wall clock that advances with the flows sent rather than with real time.
+
+    Starting at `start`, every flow moves the clock on by 1 / flows_per_second,
+    so the records cover [start, end) at the configured flow density however
+    fast they are actually sent. Calling the clock returns the current
+    synthetic time in epoch seconds, like time.time().
+    """
+
+    def __init__(self, start, end, flows_per_second):
+        if end <= start:
+            raise ValueError("backfill end must be after start")
+        self.start = start
+        self.end = end
+        self.rate = float(flows_per_second)
+        self.flows = 0
+        self.window_start = time.monotonic()
+        self.window_flows = 0
+
+    def __call__(self):
+        return self.start + self.flows / self.rate
+
+    def advance(self, flows):
+        self.flows += flows
+
+    @property
+    def total_flows(self):
+        return int((self.end - self.start) * self.rate)
+
+    @property
+    def remaining(self):
+        return max(0, self.total_flows - self.flows)
+
+    @property
+    def done(self):
+        return self.flows >= self.total_flows
+
+    def poll_stats(self, interval):
+        """Returns (synthetic_time, fraction_done, achieved_fps) once every `interval` seconds, otherwise None."""
+        now = time.monotonic()
+        elapsed = now - self.window_start
+        if elapsed < interval:
+            return None
+        achieved = (self.flows - self.window_flows) / elapsed
+        self.window_start = now
+        self.window_flows = self.flows
+        return self(), (self() - self.start) / (self.end - self.start), achieved
+
+
+def backfill_clock(config, flows_per_second):
+    """Returns a BackfillClock for the "backfill" config object, or None when backfill is not configured."""
+    backfill = config.get("backfill")
+    if not backfill:
+        return None
+    return BackfillClock(parse_time(backfill["start"]), parse_time(backfill["end"]), flows_per_second)
+
+
+def backfill_send_rate(config, flows_per_second):
+    """Returns the real send rate for backfill "speed" (a multiple of real time), or None for as fast as possible."""
+    speed = config.get("backfill", {}).get("speed", 0)
+    return flows_per_second * speed if speed else None
@@ -0,0 +1,133 @@
+import ipaddress
+import math
+import multiprocessing
+import os
+
+from flow_common.addresses import collector_endpoints
+from flow_common.worker_metrics import WorkerMetrics
+
+
+def available_cpus():
+    """Returns the CPUs this process is allowed to run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def pin_to_cpu(cpu):
+    """Pins the calling process to one CPU where the platform supports it."""
+    if cpu is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {cpu})
+
+
+def calibration_endpoint(config):
+    """Returns the (ip, port) the calibration traffic is sent to: calibration_collector_ip and
+    calibration_collector_port (default 9, the discard port).
+
+    The calibration worker is an exporter of its own, so a collector that received its burst would also see every
+    exporter's sequence and sys_uptime restart when the real workers take over. Calibration therefore never defaults
+    to a collector: without a sink on the collector's path, set flows_per_process instead. A loopback sink only
+    measures the CPU cost of sending, which can be many times what the path to a remote collector sustains, so that
+    is warned about.
+    """
+    ip = config.get("calibration_collector_ip")
+    if not ip:
+        raise ValueError("Calibration needs a discard sink: set calibration_collector_ip to a host on the collector's "
+                         "path (e.g. a flow_sink), or set flows_per_process to skip calibration")
+    endpoint = (ip, config.get("calibration_collector_port") or 9)
+    collectors = collector_endpoints(config)
+    if endpoint in collectors:
+        print(f"[WARN] Calibrating against collector {ip}:{endpoint[1]}: it will see the calibration burst and every "
+              f"exporter's sequence and sys_uptime restart.")
+    elif ipaddress.ip_address(ip).is_loopback and not ipaddress.ip_address(collectors[0][0]).is_loopback:
+        print(f"[WARN] Calibrating against {ip} measures only the CPU cost of sending; the capacity towards "
+              f"{collectors[0][0]} may be much lower.")
+    return endpoint
+
+
+def measure_capacity(target, build_args):
+    """Runs one worker unpaced in a child process and returns the flows per second it achieved.
+
+    build_args(worker_metrics) returns the worker's arguments; the worker must
+    publish its achieved rate to slot 0 of worker_metrics before it exits.
+    """
+    worker_metrics = WorkerMetrics.create(1)
+    try:
+        p = multiprocessing.Process(target=target, args=build_args(worker_metrics))
+        p.start()
+        p.join()
+        return worker_metrics.achieved(0)
+    finally:
+        worker_metrics.close()
+
+
+def plan_workers(flows_per_second, capacity, cpus, headroom):
+    """Returns the flows per second of each worker: enough workers to stay within headroom of the calibrated
+    per-process capacity, at most one per CPU, with the rate split evenly."""
+    usable = max(1.0, capacity * headroom)
+    workers = max(1, min(len(cpus), math.ceil(flows_per_second / usable)))
+    if flows_per_second > usable * workers:
+        print(f"[WARN] {flows_per_second} FPS exceeds the calibrated capacity of {workers} CPUs "
+              f"({usable * workers:.0f} FPS at {headroom:.0%} headroom); workers will fall behind.")
+    return [flows_per_second / workers] * workers
+
+
+class Rebalancer:
+    """Moves rate from workers that fall behind to workers with spare capacity.
+
+    Each step compares every worker's achieved FPS with the target it had
+    over the same stats window. The shortfall of workers more than
+    `tolerance` behind (or no longer sending) is taken off them and spread
+    over the other workers in proportion to their headroom below `capacity`,
+    so the assigned rates still add up to the requested flows_per_second.
+    Windows in which a worker's target moved more than `tolerance` away from
+    its assignment (because the assignment changed part way through) are
+    not judged.
+    """
+
+    def __init__(self, worker_metrics, capacity, tolerance=0.05):
+        self.metrics = worker_metrics
+        self.capacity = capacity
+        self.tolerance = tolerance
+
+    def step(self):
+        """Rebalances once; returns the FPS that could not be placed on any worker."""
+        metrics = self.metrics
+        workers = range(metrics.workers)
+        assigned = [metrics.assigned(i) for i in workers]
+        # Wait until every live worker has reported a full stats window at (about) its current assignment.
+        if any(metrics.is_up(i) and (not metrics.achieved(i) or
+                                     abs(metrics.target(i) - assigned[i]) > max(1.0, assigned[i] * self.tolerance))
+               for i in workers):
+            return 0.0
+
+        behind = {}
+        for i in workers:
+            if not metrics.is_up(i):
+                behind[i] = assigned[i]
+            elif metrics.achieved(i) < metrics.target(i) * (1 - self.tolerance):
+                behind[i] = assigned[i] * (1 - metrics.achieved(i) / metrics.target(i))
+
+        deficit = sum(behind.values())
+        if not deficit:
+            return 0.0
+        headroom = {j: max(0.0, self.capacity - assigned[j]) for j in workers if j not in behind}
+        total_headroom = sum(headroom.values())
+        moved = min(deficit, total_headroom)
+        if not moved:
+            return deficit
+
+        for i, shortfall in behind.items():
+            metrics.assign(i, assigned[i] - shortfall * moved / deficit)
+        for j, room in headroom.items():
+            metrics.assign(j, assigned[j] + moved * room / total_headroom)
+        print(f"[INFO] Rebalanced {moved:.0f} FPS away from workers {sorted(behind)}.")
+        return deficit - moved
+
+
+def assign_total(worker_metrics, total):
+    """Scales every worker's assigned FPS so they add up to total, keeping the split the Rebalancer arrived at."""
+    assigned = [worker_metrics.assigned(i) for i in range(worker_metrics.workers)]
+    current = sum(assigned)
+    for i, rate in enumerate(assigned):
+        worker_metrics.assign(i, total * rate / current if current else total / len(assigned))
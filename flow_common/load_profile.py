@@ -0,0 +1,175 @@
+import bisect
+import csv
+import math
+
+PROFILE_TYPES = ("constant", "ramp", "diurnal")  # csv timelines are read into ramp points
+
+
+class LoadProfile:
+    """The total flows per second a run should send at each point of its timeline.
+
+    The base shape is one of:
+    - constant: flows_per_second throughout;
+    - ramp: piecewise linear through (seconds, fps) points, holding the last
+      rate afterwards or, with repeat, starting over from the first point;
+    - diurnal: a sine between min_fps and max_fps over period_seconds,
+      peaking peak_seconds into each period (by default half way through).
+    Spikes then raise the rate for a few seconds each: to fps, or to the base
+    rate times multiplier, once at `at` or every `every` seconds from then on.
+    speed plays the timeline faster than real time (e.g. 24 fits a day into an
+    hour) and scale multiplies every rate, which is how a cluster agent takes
+    its share of the cluster's profile.
+    """
+
+    def __init__(self, profile_type="constant", fps=None, points=(), repeat=False, min_fps=None, max_fps=None,
+                 period_seconds=86400, peak_seconds=None, spikes=(), speed=1.0, scale=1.0, update_seconds=1.0):
+        if profile_type not in PROFILE_TYPES:
+            raise ValueError(f"Unknown load_profile type: {profile_type}")
+        self.profile_type = profile_type
+        self.fps = fps
+        self.points = [(float(t), float(rate)) for t, rate in points]
+        self.repeat = repeat
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self.period_seconds = period_seconds
+        self.peak_seconds = period_seconds / 2 if peak_seconds is None else peak_seconds
+        self.spikes = [dict(spike) for spike in spikes]
+        self.speed = speed
+        self.scale = scale
+        self.update_seconds = update_seconds
+
+        if profile_type == "ramp":
+            self.times = [t for t, _ in self.points]
+            if not self.points or self.times[0] != 0 or self.times != sorted(self.times):
+                raise ValueError("load_profile ramp needs [seconds, fps] points in time order, starting at 0 seconds")
+            if min(rate for _, rate in self.points) <= 0:
+                raise ValueError("load_profile ramp rates must be positive")
+        elif profile_type == "diurnal":
+            if not min_fps or not max_fps or not 0 < min_fps <= max_fps or period_seconds <= 0:
+                raise ValueError("load_profile diurnal needs 0 < min_fps <= max_fps and a positive period_seconds")
+        elif not fps or fps <= 0:
+            raise ValueError("load_profile constant needs a positive fps")
+        for spike in self.spikes:
+            if "at" not in spike or spike.get("seconds", 0) <= 0 or ("fps" in spike) == ("multiplier" in spike) \
+                    or spike.get("fps", spike.get("multiplier")) <= 0:
+                raise ValueError(f"load_profile spike {spike} needs at, a positive seconds and a positive fps or "
+                                 f"multiplier")
+        if speed <= 0 or scale <= 0 or update_seconds <= 0:
+            raise ValueError("load_profile speed, scale and update_seconds must be positive")
+
+    def base_rate(self, t):
+        """Returns the rate of the base shape t seconds into the (unscaled) timeline."""
+        if self.profile_type == "constant":
+            return self.fps
+        if self.profile_type == "diurnal":
+            phase = 2 * math.pi * (t - self.peak_seconds) / self.period_seconds
+            return self.min_fps + (self.max_fps - self.min_fps) * (1 + math.cos(phase)) / 2
+        last = self.times[-1]
+        if self.repeat and last > 0:
+            t %= last
+        i = bisect.bisect_right(self.times, t)
+        if i == len(self.points):
+            return self.points[-1][1]
+        (t0, rate0), (t1, rate1) = self.points[i - 1], self.points[i]
+        return rate0 + (rate1 - rate0) * (t - t0) / (t1 - t0)
+
+    def _spike_active(self, spike, t):
+        since = t - spike["at"]
+        if since < 0:
+            return False
+        if spike.get("every"):
+            since %= spike["every"]
+        return since < spike["seconds"]
+
+    def rate(self, elapsed):
+        """Returns the target FPS elapsed seconds of real time into the run."""
+        t = elapsed * self.speed
+        rate = self.base_rate(t)
+        for spike in self.spikes:
+            if self._spike_active(spike, t):
+                rate = max(rate, spike["fps"] if "fps" in spike else rate * spike["multiplier"])
+        return rate * self.scale
+
+    def average(self, start, end):
+        """Returns the average target FPS between start and end seconds into the run, as the workers follow it in
+        steps of update_seconds."""
+        steps = max(1, math.ceil((end - start) / self.update_seconds))
+        return sum(self.rate(start + (end - start) * (i + 0.5) / steps) for i in range(steps)) / steps
+
+    def peak(self):
+        """Returns the highest rate the profile asks for, which the generator plans its processes for."""
+        if self.profile_type == "constant":
+            base = self.fps
+        elif self.profile_type == "diurnal":
+            base = self.max_fps
+        else:
+            base = max(rate for _, rate in self.points)
+        spikes = [spike["fps"] if "fps" in spike else base * spike["multiplier"] for spike in self.spikes]
+        return max([base] + spikes) * self.scale
+
+    def describe(self):
+        if self.profile_type == "diurnal":
+            shape = f"diurnal {self.min_fps:.0f}-{self.max_fps:.0f} FPS over {self.period_seconds:g}s"
+        elif self.profile_type == "constant":
+            shape = f"constant {self.fps:.0f} FPS"
+        else:
+            shape = (f"{len(self.points)}-point ramp over {self.times[-1]:g}s"
+                     + (", repeating" if self.repeat else ""))
+        details = [shape]
+        if self.spikes:
+            details.append(f"{len(self.spikes)} spike{'s' if len(self.spikes) > 1 else ''}")
+        if self.speed != 1:
+            details.append(f"{self.speed:g}x speed")
+        if self.scale != 1:
+            details.append(f"scaled by {self.scale:.3g}")
+        return ", ".join(details) + f", peak {self.peak():.0f} FPS"
+
+
+def read_profile_csv(path):
+    """Returns the (seconds, fps) rows of a CSV timeline, skipping a header row if there is one.
+
+    The times are shifted to start at 0, so a timeline exported from monitoring with epoch timestamps can be used as is.
+    """
+    points = []
+    with open(path, newline="") as file:
+        for row in csv.reader(file):
+            if not row or row[0].startswith("#"):
+                continue
+            try:
+                points.append((float(row[0]), float(row[1])))
+            except ValueError:
+                if points:
+                    raise
+    if not points:
+        raise ValueError(f"load_profile file {path} has no [seconds, fps] rows")
+    return [(t - points[0][0], rate) for t, rate in points]
+
+
+def resolve_profile(config):
+    """Returns the load_profile config object with a csv timeline read into ramp points and a constant profile's fps
+    filled in from flows_per_second, so the cluster controller can send it to agents as is (see netflowv5_generator_2/cluster.py)."""
+    profile = config.get("load_profile")
+    if not profile:
+        return profile
+    resolved = {key: value for key, value in profile.items() if key != "file"}
+    if profile.get("type") == "csv":
+        resolved.update(type="ramp", points=read_profile_csv(profile["file"]))
+    elif profile.get("type", "constant") == "constant":
+        resolved.setdefault("fps", config["flows_per_second"])
+    return resolved
+
+
+def load_profile(config):
+    """Returns the LoadProfile of the "load_profile" config object, or None when it is not configured.
+
+    A profile without a type runs at a constant fps, by default flows_per_second, plus any spikes. A cluster agent
+    scales the profile by its agent_share.
+    """
+    profile = resolve_profile(config)
+    if not profile:
+        return None
+    return LoadProfile(profile.get("type", "constant"), profile.get("fps"), profile.get("points", ()),
+                       profile.get("repeat", False), profile.get("min_fps"), profile.get("max_fps"),
+                       profile.get("period_seconds", 86400), profile.get("peak_seconds"), profile.get("spikes", ()),
+                       profile.get("speed", 1.0), profile.get("scale", 1.0) * config.get("agent_share", 1.0),
+                       profile.get("update_seconds", 1.0))
@@ -0,0 +1,113 @@
+import time
+
+
+class TokenBucket:
+    """Token bucket pacer that spreads sends evenly instead of bursting once per second.
+
+    Tokens accrue continuously at `rate` per second up to `burst`, and callers
+    sleep in multiples of `tick` seconds until enough tokens are available.
+    The achieved rate is measured over each stats window and fed back into a
+    correction factor, so sleep overshoot and tokens lost at the burst cap do
+    not leave the sender drifting below its target. The target of a window is
+    the average of the rates it ran at, so it stays comparable with the
+    achieved rate when set_rate() is called part way through.
+    """
+
+    def __init__(self, rate, burst, tick=0.001):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.tick = tick
+        self.correction = 1.0
+        self.tokens = 0.0
+        self.last = time.monotonic()
+        self.window_start = self.last
+        self.window_sent = 0
+        self.window_target = 0.0  # flows the window should have sent at the rates it ran at
+        self.lag = 0.0  # how late the last sleep in acquire() woke up, in seconds
+
+    def set_rate(self, rate):
+        """Changes the target rate without resetting the accumulated tokens."""
+        self._refill()
+        self.rate = float(rate)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate * self.correction)
+        self.window_target += (now - self.last) * self.rate
+        self.last = now
+
+    def delay(self, needed=1):
+        """Returns how many seconds to sleep before `needed` tokens are available, or 0 if they already are.
+
+        Lets event-loop callers wait with their own sleep instead of blocking.
+        """
+        self._refill()
+        if self.tokens >= needed:
+            return 0.0
+        effective_rate = self.rate * self.correction
+        if effective_rate <= 0:
+            return self.tick
+        wait = (needed - self.tokens) / effective_rate
+        return max(self.tick, self.tick * round(wait / self.tick))
+
+    def _wait_for(self, needed, timeout=None):
+        """Sleeps until `needed` tokens are available; returns False if `timeout` seconds pass first."""
+        self.lag = 0.0
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.delay(needed)
+            if not wait:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            woke_at = time.monotonic() + wait
+            time.sleep(wait)
+            self.lag = max(self.lag, time.monotonic() - woke_at)
+
+    def acquire(self, n, timeout=None):
+        """Blocks until n tokens are available and consumes them.
+
+        With a timeout, gives up after that many seconds and returns False without consuming anything, so a
+        slowly paced caller still gets control back regularly.
+        """
+        if not self._wait_for(min(n, self.burst), timeout):
+            return False
+        self.tokens -= n
+        self.window_sent += n
+        return True
+
+    def acquire_up_to(self, n, timeout=None):
+        """Blocks until at least one token is available; consumes and returns up to n whole tokens.
+
+        With a timeout, returns 0 if no token became available within that many seconds.
+        """
+        if not self._wait_for(1, timeout):
+            return 0
+        granted = int(min(n, self.tokens))
+        self.tokens -= granted
+        self.window_sent += granted
+        return granted
+
+    def poll_stats(self, interval):
+        """Returns (target_rate, achieved_rate) once every `interval` seconds, otherwise None.
+
+        Each completed window also updates the closed-loop correction factor.
+        """
+        now = time.monotonic()
+        elapsed = now - self.window_start
+        if elapsed < interval:
+            return None
+
+        self._refill()
+        target = self.window_target / elapsed
+        achieved = self.window_sent / elapsed
+        if achieved > 0 and target > 0:
+            # Damped, bounded adjustment so a CPU-bound sender cannot wind the correction up indefinitely.
+            self.correction = min(1.5, max(0.5, self.correction * (target / achieved) ** 0.5))
+        self.window_start = self.last
+        self.window_sent = 0
+        self.window_target = 0.0
+        return target, achieved
@@ -0,0 +1,201 @@
+import bisect
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import shared_memory
+
+# Histogram bucket upper bounds in seconds.
+LAG_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 1.0)
+
+PACKETS, RECORDS, ERRORS, TARGET_FPS, ACHIEVED_FPS, HEARTBEAT, PID, ASSIGNED_FPS = range(8)
+LAG_START = 8  # per-bucket counts (last one is +Inf), then the sum
+LATENCY_START = LAG_START + len(LAG_BUCKETS) + 2
+SLOT_SIZE = LATENCY_START + len(LATENCY_BUCKETS) + 2  # followed by one records counter per destination, if any
+
+HEARTBEAT_TIMEOUT = 5  # seconds without a heartbeat before a worker is reported down
+HEARTBEAT_INTERVAL = 1  # longest a worker loop may wait for its pacer before it beats again
+
+
+class WorkerSlot:
+    """One worker's counters, gauges and histograms in the shared metrics table. Only that worker writes it."""
+
+    def __init__(self, values, offset):
+        self.values = values
+        self.offset = offset
+        values[offset + PID] = os.getpid()
+        self.heartbeat()
+
+    def heartbeat(self):
+        """Marks the worker alive; its loop calls this every iteration, whether or not it sent anything."""
+        self.values[self.offset + HEARTBEAT] = time.time()
+
+    def add_sent(self, packets, records):
+        self.values[self.offset + PACKETS] += packets
+        self.values[self.offset + RECORDS] += records
+
+    def records_sent(self):
+        return self.values[self.offset + RECORDS]
+
+    def add_errors(self, count=1):
+        self.values[self.offset + ERRORS] += count
+
+    def add_destination_records(self, destination, records):
+        """Counts records sent to one of the destinations the metrics table was created with."""
+        self.values[self.offset + SLOT_SIZE + destination] += records
+
+    def set_rates(self, target, achieved):
+        self.values[self.offset + TARGET_FPS] = target
+        self.values[self.offset + ACHIEVED_FPS] = achieved
+
+    def assigned_rate(self):
+        """Returns the flows per second the parent currently assigns to this worker (see WorkerMetrics.assign)."""
+        return self.values[self.offset + ASSIGNED_FPS]
+
+    def _observe(self, start, buckets, seconds):
+        base = self.offset + start
+        self.values[base + bisect.bisect_left(buckets, seconds)] += 1
+        self.values[base + len(buckets) + 1] += seconds
+
+    def observe_lag(self, seconds):
+        """Records how late the worker woke up relative to when its pacer scheduled it."""
+        self._observe(LAG_START, LAG_BUCKETS, seconds)
+
+    def observe_latency(self, seconds):
+        """Records the duration of one generate-and-send loop iteration."""
+        self._observe(LATENCY_START, LATENCY_BUCKETS, seconds)
+
+
+class WorkerMetrics:
+    """Per-worker metrics stored as float64 slots in one shared memory segment.
+
+    The parent creates the table and serves it; each worker receives it
+    (pickled as just the segment name) and writes only its own slot, so no
+    locks or queues are needed on the send path. With more than one
+    destination (collector), each slot also counts the records sent to each.
+    """
+
+    def __init__(self, shm, workers, owner, destinations=()):
+        self.shm = shm
+        self.workers = workers
+        self.owner = owner
+        self.destinations = list(destinations)
+        self.slot_size = SLOT_SIZE + len(self.destinations)
+        self.values = shm.buf.cast("d")
+
+    @classmethod
+    def create(cls, workers, destinations=()):
+        shm = shared_memory.SharedMemory(create=True, size=workers * (SLOT_SIZE + len(destinations)) * 8)
+        table = cls(shm, workers, owner=True, destinations=destinations)
+        for i in range(len(table.values)):
+            table.values[i] = 0.0
+        return table
+
+    def __getstate__(self):
+        return {"name": self.shm.name, "workers": self.workers, "destinations": self.destinations}
+
+    def __setstate__(self, state):
+        # Workers share the parent's resource tracker, so attaching does not add a second owner of the segment.
+        self.__init__(shared_memory.SharedMemory(name=state["name"]), state["workers"], owner=False,
+                      destinations=state["destinations"])
+
+    def slot(self, worker_index):
+        return WorkerSlot(self.values, worker_index * self.slot_size)
+
+    def assign(self, worker_index, rate):
+        """Sets the flows per second a worker should send; workers pick it up at their next stats interval."""
+        self.values[worker_index * self.slot_size + ASSIGNED_FPS] = rate
+
+    def assigned(self, worker_index):
+        return self.values[worker_index * self.slot_size + ASSIGNED_FPS]
+
+    def target(self, worker_index):
+        return self.values[worker_index * self.slot_size + TARGET_FPS]
+
+    def achieved(self, worker_index):
+        return self.values[worker_index * self.slot_size + ACHIEVED_FPS]
+
+    def is_up(self, worker_index):
+        return time.time() - self.values[worker_index * self.slot_size + HEARTBEAT] < HEARTBEAT_TIMEOUT
+
+    def destination_records(self):
+        """Returns the records all workers have sent to each destination so far."""
+        return [sum(self.values[worker * self.slot_size + SLOT_SIZE + i] for worker in range(self.workers))
+                for i in range(len(self.destinations))]
+
+    def totals(self):
+        """Returns the packets, records and send errors of all workers so far and their total assigned FPS."""
+        columns = (PACKETS, RECORDS, ERRORS, ASSIGNED_FPS)
+        return tuple(sum(self.values[worker * self.slot_size + column] for worker in range(self.workers)) for column in columns)
+
+    def _histogram(self, lines, name, start, buckets):
+        lines.append(f"# TYPE {name} histogram")
+        for worker in range(self.workers):
+            base = worker * self.slot_size + start
+            cumulative = 0
+            for i, bound in enumerate(buckets + (float("inf"),)):
+                cumulative += self.values[base + i]
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{name}_bucket{{worker="{worker}",le="{le}"}} {cumulative:.0f}')
+            lines.append(f'{name}_sum{{worker="{worker}"}} {self.values[base + len(buckets) + 1]}')
+            lines.append(f'{name}_count{{worker="{worker}"}} {cumulative:.0f}')
+
+    def render(self):
+        """Returns all workers' metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, kind, index in (("flow_generator_packets_sent_total", "counter", PACKETS),
+                                  ("flow_generator_records_sent_total", "counter", RECORDS),
+                                  ("flow_generator_send_errors_total", "counter", ERRORS),
+                                  ("flow_generator_target_fps", "gauge", TARGET_FPS),
+                                  ("flow_generator_achieved_fps", "gauge", ACHIEVED_FPS),
+                                  ("flow_generator_assigned_fps", "gauge", ASSIGNED_FPS)):
+            lines.append(f"# TYPE {name} {kind}")
+            for worker in range(self.workers):
+                lines.append(f'{name}{{worker="{worker}"}} {self.values[worker * self.slot_size + index]:.0f}')
+
+        if self.destinations:
+            lines.append("# TYPE flow_generator_destination_records_sent_total counter")
+            for worker in range(self.workers):
+                for i, destination in enumerate(self.destinations):
+                    lines.append(f'flow_generator_destination_records_sent_total{{worker="{worker}",'
+                                 f'destination="{destination}"}} {self.values[worker * self.slot_size + SLOT_SIZE + i]:.0f}')
+
+        lines.append("# TYPE flow_generator_worker_up gauge")
+        for worker in range(self.workers):
+            lines.append(f'flow_generator_worker_up{{worker="{worker}",pid="{self.values[worker * self.slot_size + PID]:.0f}"}} '
+                         f'{int(self.is_up(worker))}')
+
+        self._histogram(lines, "flow_generator_scheduling_lag_seconds", LAG_START, LAG_BUCKETS)
+        self._histogram(lines, "flow_generator_loop_latency_seconds", LATENCY_START, LATENCY_BUCKETS)
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port):
+        """Serves render() on http://0.0.0.0:port/metrics from a daemon thread."""
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving generator metrics on http://0.0.0.0:{port}/metrics")
+        return server
+
+    def close(self):
+        self.values.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,363 @@
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+V5_HEADER = struct.Struct("!HHIIIIBBH")
+V9_HEADER = struct.Struct("!HHIIII")
+IPFIX_HEADER = struct.Struct("!HHIII")
+SET_HEADER = struct.Struct("!HH")
+SFLOW_HEADER = struct.Struct("!II")  # version, agent address type
+SFLOW_AGENT = struct.Struct("!IIII")  # sub-agent id, datagram sequence, uptime, samples; after the agent address
+SFLOW_SAMPLE = struct.Struct("!II")  # data format, length
+SFLOW_FLOW_SAMPLE_FORMATS = (1, 3)  # flow sample and expanded flow sample, enterprise 0
+V5_RECORD_SIZE = 48
+
+# Counters each reader keeps per exporter: records, packets, sequence gaps, records lost to gaps.
+RECORDS, PACKETS, GAPS, LOST = range(4)
+
+
+def load_config(config_file):
+    """Loads configuration from a JSON file."""
+    with open(config_file, "r") as f:
+        return json.load(f)
+
+
+def socket_drops(sock):
+    """Returns the kernel's receive-buffer drop counter for a UDP socket from /proc/net/udp, or 0."""
+    inode = str(os.fstat(sock.fileno()).st_ino)
+    try:
+        with open("/proc/net/udp", "r") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 12 and fields[9] == inode:
+                    return int(fields[-1])
+    except OSError:
+        pass
+    return 0
+
+
+class Decoder:
+    """Decodes NetFlow v5/v9, IPFIX and sFlow v5 headers and tracks sequence numbers per exporter stream.
+
+    Template sets are parsed only far enough to learn each template's record
+    length, so data sets can be turned into record counts; sFlow flow
+    samples count as records and counter samples are skipped. Counters are kept
+    per exporter address; sequences are tracked per address and, when
+    sequence_by_port is set, per source port as well.
+    """
+
+    def __init__(self, sequence_by_port=True):
+        self.sequence_by_port = sequence_by_port
+        self.exporters = {}
+        self.sequences = {}
+        self.templates = {}
+        self.template_ids = set()
+        self.malformed = 0
+
+    def _account(self, exporter, records, stream, sequence, next_sequence):
+        stats = self.exporters.get(exporter)
+        if stats is None:
+            stats = self.exporters[exporter] = [0, 0, 0, 0]
+        stats[RECORDS] += records
+        stats[PACKETS] += 1
+
+        expected = self.sequences.get(stream)
+        if expected is not None and expected != sequence:
+            stats[GAPS] += 1
+            missing = (sequence - expected) & 0xFFFFFFFF
+            # Ignore reordering and exporter restarts, which start again from sequence 0.
+            if missing < 0x80000000 and sequence != 0:
+                stats[LOST] += missing
+        self.sequences[stream] = next_sequence & 0xFFFFFFFF
+
+    def decode(self, data, length, address):
+        """Decodes one datagram of the given length received from address (ip, port)."""
+        if length < 4:
+            self.malformed += 1
+            return
+        exporter = address[0]
+        stream = address if self.sequence_by_port else exporter
+        version = (data[0] << 8) | data[1]
+        try:
+            if version == 5:
+                self._decode_v5(data, length, exporter, stream)
+            elif version == 9:
+                self._decode_v9(data, length, exporter, stream)
+            elif version == 10:
+                self._decode_ipfix(data, length, exporter, stream)
+            elif version == 0 and data[2] == 0 and data[3] == 5:
+                self._decode_sflow(data, length, exporter, stream)
+            else:
+                self.malformed += 1
+        except (struct.error, ValueError, ZeroDivisionError):
+            self.malformed += 1
+
+    def _decode_v5(self, data, length, exporter, stream):
+        _, count, _, _, _, sequence, engine_type, engine_id, _ = V5_HEADER.unpack_from(data)
+        if length != V5_HEADER.size + count * V5_RECORD_SIZE:
+            raise ValueError("record count does not match packet length")
+        self._account(exporter, count, (stream, 5, engine_type, engine_id), sequence, sequence + count)
+
+    def _template_lengths(self, data, offset, end, template_key, ipfix, options):
+        """Parses a template or options template set, recording each template's data record length."""
+        while offset + 4 <= end:
+            if options and not ipfix:
+                template_id, scope_length, option_length = struct.unpack_from("!HHH", data, offset)
+                offset += 6
+                specs = (scope_length + option_length) // 4
+            elif options:
+                template_id, specs, _ = struct.unpack_from("!HHH", data, offset)
+                offset += 6
+            else:
+                template_id, specs = struct.unpack_from("!HH", data, offset)
+                offset += 4
+            if template_id < 256:
+                break  # padding
+
+            record_length = 0
+            for _ in range(specs):
+                field_id, field_length = struct.unpack_from("!HH", data, offset)
+                offset += 8 if ipfix and field_id & 0x8000 else 4
+                if field_length == 65535:
+                    record_length = None  # variable length: records cannot be counted from the set length
+                elif record_length is not None:
+                    record_length += field_length
+            if offset > end:
+                raise ValueError("template runs past its set")
+            self.templates[template_key + (template_id,)] = record_length
+            self.template_ids.add(template_id)
+
+    def _walk_sets(self, data, offset, end, template_key, ipfix):
+        """Walks the flow sets of a v9/IPFIX packet; returns the number of data records found."""
+        template_set, options_set = (2, 3) if ipfix else (0, 1)
+        records = 0
+        while offset + SET_HEADER.size <= end:
+            set_id, set_length = SET_HEADER.unpack_from(data, offset)
+            if set_length < SET_HEADER.size or offset + set_length > end:
+                raise ValueError("set length out of bounds")
+            body = offset + SET_HEADER.size
+            if set_id in (template_set, options_set):
+                self._template_lengths(data, body, offset + set_length, template_key, ipfix, set_id == options_set)
+            elif set_id >= 256:
+                record_length = self.templates.get(template_key + (set_id,))
+                if record_length:
+                    records += (set_length - SET_HEADER.size) // record_length
+            offset += set_length
+        return records
+
+    def _decode_v9(self, data, length, exporter, stream):
+        _, _, _, _, sequence, source_id = V9_HEADER.unpack_from(data)
+        key = (stream, 9, source_id)
+        records = self._walk_sets(data, V9_HEADER.size, length, key, False)
+        self._account(exporter, records, key, sequence, sequence + 1)
+
+    def _decode_ipfix(self, data, length, exporter, stream):
+        _, message_length, _, sequence, domain = IPFIX_HEADER.unpack_from(data)
+        if message_length != length:
+            raise ValueError("IPFIX length does not match datagram length")
+        key = (stream, 10, domain)
+        records = self._walk_sets(data, IPFIX_HEADER.size, length, key, True)
+        self._account(exporter, records, key, sequence, sequence + records)
+
+    def _decode_sflow(self, data, length, exporter, stream):
+        _, address_type = SFLOW_HEADER.unpack_from(data)
+        offset = SFLOW_HEADER.size + (4 if address_type == 1 else 16)
+        sub_agent, sequence, _, samples = SFLOW_AGENT.unpack_from(data, offset)
+        agent = bytes(data[SFLOW_HEADER.size:offset])
+        offset += SFLOW_AGENT.size
+        records = 0
+        for _ in range(samples):
+            data_format, sample_length = SFLOW_SAMPLE.unpack_from(data, offset)
+            if data_format in SFLOW_FLOW_SAMPLE_FORMATS:
+                records += 1
+            offset += SFLOW_SAMPLE.size + sample_length
+        if offset != length:
+            raise ValueError("sFlow samples do not match datagram length")
+        key = (stream, "sflow", agent, sub_agent)
+        self._account(exporter, records, key, sequence, sequence + 1)
+
+    def take_stats(self):
+        """Returns and resets the per-exporter counters and malformed count since the last call."""
+        exporters, malformed = self.exporters, self.malformed
+        self.exporters, self.malformed = {}, 0
+        return exporters, malformed
+
+
+def reader(config, reader_id, stats_queue):
+    """Receives on one SO_REUSEPORT socket and reports decoded counters every report interval."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, config.get("receive_buffer_bytes", 33554432))
+    sock.bind((config.get("listen_ip", "0.0.0.0"), config.get("listen_port", 2055)))
+    sock.settimeout(0.2)
+
+    decoder = Decoder(config.get("sequence_key", "address_port") == "address_port")
+    buffer = bytearray(65535)
+    interval = config.get("report_interval", 1)
+    next_report = time.monotonic() + interval
+    last_drops = socket_drops(sock)
+    recv_into = sock.recvfrom_into
+
+    while True:
+        try:
+            length, address = recv_into(buffer)
+            decoder.decode(buffer, length, address)
+        except socket.timeout:
+            pass
+
+        if time.monotonic() >= next_report:
+            next_report += interval
+            drops = socket_drops(sock)
+            exporters, malformed = decoder.take_stats()
+            stats_queue.put((reader_id, exporters, malformed, drops - last_drops, sorted(decoder.template_ids)))
+            last_drops = drops
+
+
+class SinkStats:
+    """Aggregates reader reports into running totals served as Prometheus metrics."""
+
+    def __init__(self, readers):
+        self.lock = threading.Lock()
+        self.totals = {"records": 0, "packets": 0, "gaps": 0, "lost": 0, "malformed": 0, "drops": 0}
+        self.reader_packets = [0] * readers
+        self.exporters = set()
+
+    def add(self, reader_id, exporters, malformed, drops):
+        with self.lock:
+            self.reader_packets[reader_id] += sum(stats[PACKETS] for stats in exporters.values())
+            for exporter, stats in exporters.items():
+                self.totals["records"] += stats[RECORDS]
+                self.totals["packets"] += stats[PACKETS]
+                self.totals["gaps"] += stats[GAPS]
+                self.totals["lost"] += stats[LOST]
+                self.exporters.add(exporter)
+            self.totals["malformed"] += malformed
+            self.totals["drops"] += drops
+
+    def render(self):
+        with self.lock:
+            t = dict(self.totals)
+            exporters = len(self.exporters)
+            reader_packets = list(self.reader_packets)
+        return (
+            "# TYPE flow_records_received_total counter\n"
+            f"flow_records_received_total {t['records']}\n"
+            "# TYPE flow_packets_received_total counter\n"
+            f"flow_packets_received_total {t['packets']}\n"
+            "# TYPE flow_sequence_gaps_total counter\n"
+            f"flow_sequence_gaps_total {t['gaps']}\n"
+            "# TYPE flow_sequence_lost_records_total counter\n"
+            f"flow_sequence_lost_records_total {t['lost']}\n"
+            "# TYPE flow_malformed_packets_total counter\n"
+            f"flow_malformed_packets_total {t['malformed']}\n"
+            "# TYPE flow_receive_buffer_drops_total counter\n"
+            f"flow_receive_buffer_drops_total {t['drops']}\n"
+            "# TYPE flow_exporters gauge\n"
+            f"flow_exporters {exporters}\n"
+            "# TYPE flow_reader_packets_received_total counter\n"
+            + "".join(f'flow_reader_packets_received_total{{reader="{i}"}} {packets}\n'
+                      for i, packets in enumerate(reader_packets))
+        )
+
+
+def serve_metrics(stats, port):
+    """Serves SinkStats on http://0.0.0.0:port/metrics from a background thread."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = stats.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"[+] Serving metrics on http://0.0.0.0:{port}/metrics")
+
+
+def main():
+    config = load_config("config.json")
+    readers = config.get("readers", os.cpu_count() or 1)
+    interval = config.get("report_interval", 1)
+    top_exporters = config.get("top_exporters", 5)
+
+    stats = SinkStats(readers)
+    if config.get("metrics_port"):
+        serve_metrics(stats, config["metrics_port"])
+
+    stats_queue = multiprocessing.Queue()
+    processes = []
+    for reader_id in range(readers):
+        p = multiprocessing.Process(target=reader, args=(config, reader_id, stats_queue), daemon=True)
+        p.start()
+        processes.append(p)
+    print(f"[+] Listening on {config.get('listen_ip', '0.0.0.0')}:{config.get('listen_port', 2055)} "
+          f"with {readers} SO_REUSEPORT readers")
+
+    window = {}
+    window_malformed = window_drops = reports = 0
+    reader_packets = [0] * readers
+    template_ids = set()
+    try:
+        while True:
+            try:
+                reader_id, exporters, malformed, drops, templates = stats_queue.get(timeout=interval)
+            except queue.Empty:
+                continue
+            stats.add(reader_id, exporters, malformed, drops)
+            reader_packets[reader_id] += sum(c[PACKETS] for c in exporters.values())
+            template_ids.update(templates)
+            for exporter, counters in exporters.items():
+                totals = window.setdefault(exporter, [0, 0, 0, 0])
+                for i, value in enumerate(counters):
+                    totals[i] += value
+            window_malformed += malformed
+            window_drops += drops
+            reports += 1
+
+            if reports < readers:
+                continue
+
+            records = sum(c[RECORDS] for c in window.values())
+            packets = sum(c[PACKETS] for c in window.values())
+            gaps = sum(c[GAPS] for c in window.values())
+            lost = sum(c[LOST] for c in window.values())
+            print(f"[i] {records / interval:.0f} records/s, {packets / interval:.0f} packets/s, "
+                  f"{len(window)} exporters, {gaps} sequence gaps ({lost} records lost), "
+                  f"{window_malformed} malformed, {window_drops} receive-buffer drops, "
+                  f"{len(template_ids)} template ids")
+            if readers > 1 and packets:
+                # How evenly SO_REUSEPORT spread this window's packets over the readers.
+                shares = " ".join(f"{count / packets:.0%}" for count in reader_packets)
+                print(f"    readers: {shares} of packets, busiest {max(reader_packets) * readers / packets:.2f}x "
+                      f"an even share")
+            busiest = sorted(window.items(), key=lambda item: item[1][RECORDS], reverse=True)[:top_exporters]
+            for exporter, c in busiest:
+                print(f"    {exporter}: {c[RECORDS] / interval:.0f} records/s, {c[GAPS]} gaps")
+            window = {}
+            window_malformed = window_drops = reports = 0
+            reader_packets = [0] * readers
+    except KeyboardInterrupt:
+        print("[!] Stopping flow sink.")
+        for p in processes:
+            p.terminate()
+
+
+if __name__ == "__main__":
+    main()
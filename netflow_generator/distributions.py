@@ -0,0 +1,112 @@
+import random
+
+
+class AliasTable:
+    """Walker/Vose alias table: O(1) sampling of indices from an arbitrary discrete distribution."""
+
+    def __init__(self, weights):
+        n = len(weights)
+        total = float(sum(weights))
+        scaled = [w * n / total for w in weights]
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+
+        small = [i for i in range(n) if scaled[i] < 1.0]
+        large = [i for i in range(n) if scaled[i] >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+
+    def sample(self):
+        i = random.randrange(len(self.prob))
+        return i if random.random() < self.prob[i] else self.alias[i]
+
+
+def distinct_keys(draw, cardinality, rounds=10):
+    """Returns up to `cardinality` distinct values from `draw`; fewer if `rounds` passes in a row add none."""
+    keys = set()
+    stalled = 0
+    while len(keys) < cardinality and stalled < rounds:
+        before = len(keys)
+        for _ in range(cardinality):
+            keys.add(draw())
+            if len(keys) == cardinality:
+                break
+        stalled = stalled + 1 if len(keys) == before else 0
+    return list(keys)
+
+
+class KeySampler:
+    """Draws keys from a fixed universe of `cardinality` distinct keys with uniform or Zipf popularity."""
+
+    def __init__(self, draw, spec):
+        cardinality = spec.get("cardinality", 1000)
+        self.keys = distinct_keys(draw, cardinality)
+        random.shuffle(self.keys)
+        if len(self.keys) < cardinality:
+            print(f"[WARN] Only {len(self.keys)} distinct values are available for a cardinality of {cardinality}.")
+            cardinality = len(self.keys)
+        if spec.get("model", "uniform") == "zipf":
+            exponent = spec.get("exponent", 1.0)
+            weights = [1.0 / rank ** exponent for rank in range(1, cardinality + 1)]
+        else:
+            weights = [1.0] * cardinality
+        self.table = AliasTable(weights)
+
+    def sample(self):
+        return self.keys[self.table.sample()]
+
+
+def key_sampler(draw, spec):
+    """Returns a zero-argument sampler for a field, applying the configured cardinality/popularity model."""
+    if not spec or (spec.get("model", "uniform") == "uniform" and "cardinality" not in spec):
+        return draw
+    return KeySampler(draw, spec).sample
+
+
+def count_sampler(spec, default):
+    """Returns a sampler for a count field: "lognormal" (mu, sigma) or "pareto" (shape, minimum), else `default`."""
+    if not spec or spec.get("model", "uniform") == "uniform":
+        return default
+    minimum = spec.get("minimum", 1)
+    maximum = spec.get("maximum", 2**32 - 1)
+    if spec["model"] == "lognormal":
+        mu, sigma = spec.get("mu", 1.0), spec.get("sigma", 1.5)
+        return lambda: min(maximum, max(minimum, int(random.lognormvariate(mu, sigma))))
+    if spec["model"] == "pareto":
+        shape = spec.get("shape", 1.2)
+        return lambda: min(maximum, int(minimum * random.paretovariate(shape)))
+    raise ValueError(f"Unknown heavy-tailed model: {spec['model']}")
+
+
+class FlowModel:
+    """Per-field samplers for generated flows, built once from config.
+
+    The optional "distributions" object uses the same schema as
+    netflowv5_generator_2: source_ip, destination_ip, source_port,
+    destination_port, src_as and dst_as take {"model": "uniform" | "zipf",
+    "exponent", "cardinality"}; packets takes a heavy-tailed model; and
+    packet_size {"sizes", "weights"} makes bytes the packet count times a
+    sampled packet size.
+    """
+
+    def __init__(self, config, src_range, dst_range):
+        dist = config.get("distributions", {})
+        self.src_addr = key_sampler(lambda: src_range[0] + random.randrange(src_range[1]), dist.get("source_ip"))
+        self.dst_addr = key_sampler(lambda: dst_range[0] + random.randrange(dst_range[1]), dist.get("destination_ip"))
+        self.src_port = key_sampler(lambda: random.randint(1024, 65535), dist.get("source_port"))
+        self.dst_port = key_sampler(lambda: random.randint(1024, 65535), dist.get("destination_port"))
+        self.src_as = key_sampler(lambda: random.randint(0, 65535), dist.get("src_as"))
+        self.dst_as = key_sampler(lambda: random.randint(0, 65535), dist.get("dst_as"))
+        self.packets = count_sampler(dist.get("packets"), lambda: random.randint(1, 1000))
+
+        packet_size = dist.get("packet_size")
+        if packet_size:
+            sizes = packet_size["sizes"]
+            table = AliasTable(packet_size.get("weights") or [1] * len(sizes))
+            self.bytes = lambda packets: min(0xFFFFFFFF, packets * sizes[table.sample()])
+        else:
+            self.bytes = lambda packets: random.randint(1, 100000)
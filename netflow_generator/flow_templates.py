@@ -0,0 +1,343 @@
+import os
+import random
+import struct
+import time
+
+V9_HEADER = struct.Struct("!HHIIII")  # version, count, sys_uptime, unix_secs, sequence, source_id
+IPFIX_HEADER = struct.Struct("!HHIII")  # version, length, export_time, sequence, observation domain
+SET_HEADER = struct.Struct("!HH")
+FIELD_SPEC = struct.Struct("!HH")
+
+V9_TEMPLATE_SET_ID = 0
+V9_OPTIONS_TEMPLATE_SET_ID = 1
+IPFIX_TEMPLATE_SET_ID = 2
+IPFIX_OPTIONS_TEMPLATE_SET_ID = 3
+
+# NetFlow v9 option scope types; interface fields are scoped to the interface, everything else to the system.
+V9_SCOPE_SYSTEM = 1
+V9_SCOPE_INTERFACE = 2
+
+PROTOCOLS = (6, 17, 1)
+MAX_FLOW_DURATION_MS = 1000  # flows start up to this long before they are exported
+
+
+def _ipv6_addr(ctx):
+    return b"\xfd\x00" + os.urandom(14)
+
+
+# Information elements by NetFlow v9 name: (element id, default length, value function).
+# The element ids below 128 are shared by NetFlow v9 and IPFIX.
+FIELD_TYPES = {
+    "IN_BYTES": (1, 8, lambda ctx: ctx.model.bytes(ctx.packets)),
+    "IN_PKTS": (2, 8, lambda ctx: ctx.packets),
+    "PROTOCOL": (4, 1, lambda ctx: random.choice(PROTOCOLS)),
+    "SRC_TOS": (5, 1, lambda ctx: random.randint(0, 255)),
+    "TCP_FLAGS": (6, 1, lambda ctx: random.randint(0, 255)),
+    "L4_SRC_PORT": (7, 2, lambda ctx: ctx.model.src_port()),
+    "IPV4_SRC_ADDR": (8, 4, lambda ctx: ctx.model.src_addr()),
+    "SRC_MASK": (9, 1, lambda ctx: random.randint(0, 32)),
+    "INPUT_SNMP": (10, 4, lambda ctx: random.randint(1, 1000)),
+    "L4_DST_PORT": (11, 2, lambda ctx: ctx.model.dst_port()),
+    "IPV4_DST_ADDR": (12, 4, lambda ctx: ctx.model.dst_addr()),
+    "DST_MASK": (13, 1, lambda ctx: random.randint(0, 32)),
+    "OUTPUT_SNMP": (14, 4, lambda ctx: random.randint(1, 1000)),
+    "IPV4_NEXT_HOP": (15, 4, lambda ctx: 0),
+    "SRC_AS": (16, 4, lambda ctx: ctx.model.src_as()),
+    "DST_AS": (17, 4, lambda ctx: ctx.model.dst_as()),
+    "LAST_SWITCHED": (21, 4, lambda ctx: ctx.uptime_ms),
+    "FIRST_SWITCHED": (22, 4, lambda ctx: ctx.uptime_ms - random.randint(1, MAX_FLOW_DURATION_MS)),
+    "IPV6_SRC_ADDR": (27, 16, _ipv6_addr),
+    "IPV6_DST_ADDR": (28, 16, _ipv6_addr),
+    "SAMPLING_INTERVAL": (34, 4, lambda ctx: 1),
+    "SAMPLING_ALGORITHM": (35, 1, lambda ctx: 1),
+    "SRC_VLAN": (58, 2, lambda ctx: random.randint(1, 4094)),
+    "DST_VLAN": (59, 2, lambda ctx: random.randint(1, 4094)),
+    "IP_PROTOCOL_VERSION": (60, 1, lambda ctx: 4),
+    "DIRECTION": (61, 1, lambda ctx: random.randint(0, 1)),
+    "flowStartMilliseconds": (152, 8, lambda ctx: ctx.now_ms - random.randint(1, MAX_FLOW_DURATION_MS)),
+    "flowEndMilliseconds": (153, 8, lambda ctx: ctx.now_ms),
+}
+FIELD_NAMES_BY_ID = {spec[0]: name for name, spec in FIELD_TYPES.items()}
+
+DEFAULT_TEMPLATE_FIELDS = [
+    "IPV4_SRC_ADDR", "IPV4_DST_ADDR", "L4_SRC_PORT", "L4_DST_PORT", "PROTOCOL", "TCP_FLAGS",
+    "SRC_TOS", "INPUT_SNMP", "OUTPUT_SNMP", "IN_PKTS", "IN_BYTES", "FIRST_SWITCHED", "LAST_SWITCHED",
+    "SRC_AS", "DST_AS", "SRC_MASK", "DST_MASK",
+]
+DEFAULT_OPTIONS_TEMPLATE = {
+    "template_id": 4096,
+    "scope_fields": ["INPUT_SNMP"],
+    "fields": ["SAMPLING_INTERVAL", "SAMPLING_ALGORITHM"],
+}
+
+
+def resolve_field(field):
+    """Turns a config field ("NAME", ["NAME", length] or [id, length]) into (id, length, value function)."""
+    if isinstance(field, (list, tuple)):
+        key, length = field
+    else:
+        key, length = field, None
+
+    if isinstance(key, int):
+        name = FIELD_NAMES_BY_ID.get(key)
+        if name is None:
+            if length is None:
+                raise ValueError(f"Unknown field id {key} needs an explicit length")
+            return key, length, None
+    else:
+        name = key
+    if name not in FIELD_TYPES:
+        raise ValueError(f"Unknown field {name}")
+
+    field_id, default_length, value = FIELD_TYPES[name]
+    length = length or default_length
+    if length == 65535:
+        raise ValueError(f"Variable-length field {name} is not supported")
+    return field_id, length, value
+
+
+INT_CODES = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
+
+def _int_value(value, mask):
+    return lambda ctx: (int.from_bytes(v, "big") if isinstance(v := value(ctx), bytes) else v) & mask
+
+
+def _bytes_value(value, length):
+    def fit(ctx):
+        v = value(ctx)
+        if isinstance(v, bytes):
+            return v[:length].ljust(length, b"\x00")
+        return (v & ((1 << (8 * length)) - 1)).to_bytes(length, "big")
+    return fit
+
+
+class Template:
+    """A compiled (options) template: field specs plus a precompiled record struct."""
+
+    def __init__(self, template_id, fields, scope_fields=()):
+        self.template_id = template_id
+        self.scope_fields = [resolve_field(f) for f in scope_fields]
+        self.fields = [resolve_field(f) for f in fields]
+
+        codes = []
+        self.values = []
+        for field_id, length, value in self.scope_fields + self.fields:
+            if length in INT_CODES:
+                codes.append(INT_CODES[length])
+                mask = (1 << (8 * length)) - 1
+                if value is None:
+                    self.values.append(lambda ctx, mask=mask: random.randint(0, mask))
+                else:
+                    self.values.append(_int_value(value, mask))
+            else:
+                codes.append(f"{length}s")
+                if value is None:
+                    self.values.append(lambda ctx, length=length: os.urandom(length))
+                else:
+                    self.values.append(_bytes_value(value, length))
+        self.record = struct.Struct("!" + "".join(codes))
+        self.record_size = self.record.size
+
+    def pack_record(self, buffer, offset, ctx):
+        ctx.packets = ctx.model.packets()
+        self.record.pack_into(buffer, offset, *[value(ctx) for value in self.values])
+
+    def template_record(self, version):
+        """Returns the template (or options template) record announcing this layout."""
+        specs = b"".join(FIELD_SPEC.pack(field_id, length) for field_id, length, _ in self.scope_fields + self.fields)
+        if not self.scope_fields:
+            return struct.pack("!HH", self.template_id, len(self.fields)) + specs
+        if version == 10:
+            return struct.pack("!HHH", self.template_id, len(self.scope_fields) + len(self.fields),
+                               len(self.scope_fields)) + specs
+
+        # NetFlow v9 options templates describe scope fields with scope types and lengths in bytes.
+        scope = b"".join(
+            FIELD_SPEC.pack(V9_SCOPE_INTERFACE if field_id in (10, 14) else V9_SCOPE_SYSTEM, length)
+            for field_id, length, _ in self.scope_fields)
+        options = b"".join(FIELD_SPEC.pack(field_id, length) for field_id, length, _ in self.fields)
+        return struct.pack("!HHH", self.template_id, len(scope), len(options)) + scope + options
+
+
+class RecordContext:
+    """Per-packet values shared by the field value functions; packets is drawn once per record."""
+
+    def __init__(self, model):
+        self.model = model
+        self.packets = 0
+        self.uptime_ms = 0
+        self.now_ms = 0
+
+
+def load_templates(config, rotation=0):
+    """Builds the data templates from config: each entry may be copied to many consecutive ids.
+
+    A non-zero rotation rotates every template's field list by that many fields, giving the same
+    template ids a different record layout.
+    """
+    templates = []
+    for entry in config.get("templates", [{"template_id": 256, "fields": DEFAULT_TEMPLATE_FIELDS}]):
+        fields = entry["fields"]
+        shift = rotation % len(fields)
+        fields = fields[shift:] + fields[:shift]
+        for copy in range(entry.get("copies", 1)):
+            templates.append(Template(entry["template_id"] + copy, fields))
+    return templates
+
+
+class TemplateExporter:
+    """Emits NetFlow v9 or IPFIX packets for one exporter with many templates and observation domains.
+
+    Packets are packed into one reusable buffer, so each yielded packet is only
+    valid until the next one is requested. Every observation domain keeps its
+    own sequence number; templates and options data are re-sent to all domains
+    every template_refresh_seconds. With template_id_reuse every domain
+    announces the same template ids with its own field order, so a collector
+    must key its template cache by domain to decode the records. `clock`
+    supplies the export time, so a synthetic backfill clock can stand in for
+    time.time.
+    """
+
+    def __init__(self, config, model, clock=time.time):
+        self.version = config.get("netflow_version", 9)
+        if self.version not in (9, 10):
+            raise ValueError(f"Unsupported NetFlow version {self.version}")
+
+        options = config.get("options_template", DEFAULT_OPTIONS_TEMPLATE)
+        self.options_template = Template(options["template_id"], options["fields"], options.get("scope_fields", ())) if options else None
+
+        first_domain = config.get("observation_domain_id", 1)
+        self.domains = list(range(first_domain, first_domain + config.get("observation_domains", 1)))
+        self.sequences = {domain: random.randint(0, 2**32 - 1) for domain in self.domains}
+        templates = load_templates(config)
+        self.templates = {domain: load_templates(config, rotation) if config.get("template_id_reuse") and rotation
+                          else templates
+                          for rotation, domain in enumerate(self.domains)}
+        self.refresh_interval = config.get("template_refresh_seconds", 60)
+        self.last_refresh = None
+        self.max_packet_size = config.get("max_packet_size", 1400)
+
+        self.header = V9_HEADER if self.version == 9 else IPFIX_HEADER
+        self.buffer = memoryview(bytearray(max(self.max_packet_size, 65535)))
+        self.ctx = RecordContext(model)
+        self.clock = clock
+        # Boot the exporter one flow duration before the first export, so FIRST_SWITCHED never precedes it.
+        self.boot_ms = int(clock() * 1000) - MAX_FLOW_DURATION_MS
+        self.next_template = 0
+        self.next_domain = 0
+
+    def _start_packet(self):
+        now = self.clock()
+        self.ctx.now_ms = int(now * 1000)
+        self.ctx.uptime_ms = (self.ctx.now_ms - self.boot_ms) & 0xFFFFFFFF
+        return now
+
+    def _finish_packet(self, now, domain, length, record_count, data_records):
+        sequence = self.sequences[domain]
+        if self.version == 9:
+            V9_HEADER.pack_into(self.buffer, 0, 9, record_count, self.ctx.uptime_ms, int(now), sequence, domain)
+            self.sequences[domain] = (sequence + 1) & 0xFFFFFFFF
+        else:
+            IPFIX_HEADER.pack_into(self.buffer, 0, 10, length, int(now), sequence, domain)
+            self.sequences[domain] = (sequence + data_records) & 0xFFFFFFFF
+        return self.buffer[:length]
+
+    def _pack_set(self, offset, set_id, records):
+        """Packs a set of already encoded records at offset, padded to 4 bytes; returns the new offset."""
+        start = offset
+        offset += SET_HEADER.size
+        for record in records:
+            self.buffer[offset:offset + len(record)] = record
+            offset += len(record)
+        padding = -(offset - start) % 4
+        self.buffer[offset:offset + padding] = bytes(padding)
+        offset += padding
+        SET_HEADER.pack_into(self.buffer, start, set_id, offset - start)
+        return offset
+
+    def _options_size(self):
+        """Returns the bytes the options template set and the options data set add to a packet."""
+        if self.options_template is None:
+            return 0
+        template_set = SET_HEADER.size + len(self.options_template.template_record(self.version))
+        data_set = SET_HEADER.size + self.options_template.record_size
+        return template_set + -template_set % 4 + data_set + -data_set % 4
+
+    def template_packets(self):
+        """Yields packets announcing every template to every observation domain.
+
+        Templates are split over as many packets as max_packet_size requires;
+        the last packet per domain also carries the options template and one
+        options data record, or they follow in a packet of their own if they
+        would push it past max_packet_size.
+        """
+        template_set, options_set = (
+            (V9_TEMPLATE_SET_ID, V9_OPTIONS_TEMPLATE_SET_ID) if self.version == 9
+            else (IPFIX_TEMPLATE_SET_ID, IPFIX_OPTIONS_TEMPLATE_SET_ID))
+        options_size = self._options_size()
+        for domain in self.domains:
+            pending = [t.template_record(self.version) for t in self.templates[domain]]
+            while pending:
+                now = self._start_packet()
+                chunk = [pending.pop(0)]
+                size = self.header.size + SET_HEADER.size + len(chunk[0])
+                while pending and size + len(pending[0]) <= self.max_packet_size:
+                    size += len(pending[0])
+                    chunk.append(pending.pop(0))
+                offset = self._pack_set(self.header.size, template_set, chunk)
+                record_count = len(chunk)
+                if not pending and offset + options_size <= self.max_packet_size:
+                    break
+                yield self._finish_packet(now, domain, offset, record_count, 0), 0
+            else:
+                now = self._start_packet()
+                offset = self.header.size
+                record_count = 0
+
+            data_records = 0
+            if self.options_template is not None:
+                option = self.options_template
+                offset = self._pack_set(offset, options_set, [option.template_record(self.version)])
+                set_start = offset
+                offset += SET_HEADER.size
+                option.pack_record(self.buffer, offset, self.ctx)
+                offset += option.record_size
+                padding = -(offset - set_start) % 4
+                self.buffer[offset:offset + padding] = bytes(padding)
+                offset += padding
+                SET_HEADER.pack_into(self.buffer, set_start, option.template_id, offset - set_start)
+                record_count += 2
+                data_records = 1
+            yield self._finish_packet(now, domain, offset, record_count, data_records), 0
+
+    def packets(self, flow_count):
+        """Yields (packet, flows_in_packet) for flow_count flows, refreshing templates when due."""
+        if self.last_refresh is None or self.clock() - self.last_refresh >= self.refresh_interval:
+            self.last_refresh = self.clock()
+            yield from self.template_packets()
+
+        remaining = flow_count
+        while remaining > 0:
+            domain = self.domains[self.next_domain]
+            self.next_domain = (self.next_domain + 1) % len(self.domains)
+            templates = self.templates[domain]
+            template = templates[self.next_template]
+            self.next_template = (self.next_template + 1) % len(templates)
+
+            capacity = (self.max_packet_size - self.header.size - SET_HEADER.size) // template.record_size
+            count = max(1, min(remaining, capacity))
+
+            now = self._start_packet()
+            set_start = self.header.size
+            offset = set_start + SET_HEADER.size
+            for _ in range(count):
+                template.pack_record(self.buffer, offset, self.ctx)
+                offset += template.record_size
+            padding = -(offset - set_start) % 4
+            self.buffer[offset:offset + padding] = bytes(padding)
+            offset += padding
+            SET_HEADER.pack_into(self.buffer, set_start, template.template_id, offset - set_start)
+
+            remaining -= count
+            yield self._finish_packet(now, domain, offset, count, count), count
@@ -1,11 +1,37 @@
+import argparse
+import itertools
+import os
 import random
 import socket
 import struct
+import sys
 import time
 import json
 import ipaddress
 import multiprocessing
+import multiprocessing.connection
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))  # for flow_common
+
+from flow_common.addresses import collector_endpoints, rendezvous_index, rendezvous_seeds, subnet_host_range
+from flow_common.backfill import BackfillClock, backfill_clock, backfill_send_rate, format_time
+from flow_common.calibration import (Rebalancer, assign_total, available_cpus, calibration_endpoint, measure_capacity,
+                                     pin_to_cpu, plan_workers)
+from flow_common.load_profile import load_profile
+from flow_common.pacing import TokenBucket
+from flow_common.worker_metrics import HEARTBEAT_INTERVAL, WorkerMetrics
+from distributions import FlowModel
+from flow_templates import TemplateExporter
+from pcap import PcapWriter, read_pcap_payloads
+
+# Precompiled NetFlow v5 header and record layouts; addresses are packed as integers.
+V5_HEADER = struct.Struct("!HHIIIIBBH")
+V5_RECORD = struct.Struct("!IIIHHIIIIHHxBBBHHBBxx")
+MAX_RECORDS_PER_PACKET = 30  # NetFlow v5 allows at most 30 records per packet
+PROTOCOLS = (6, 17, 1)  # TCP, UDP, or ICMP
+FORMAT_NAMES = {5: "NetFlow v5", 9: "NetFlow v9", 10: "IPFIX"}
+V5_REPLAY_PATCH = struct.Struct("!III")  # unix_secs, unix_nsecs, flow_sequence at header offset 8
+EXPORT_SOURCE_PORT = 20000  # Source port of worker 0's shard; worker i uses EXPORT_SOURCE_PORT + i
 
 def load_config(config_file):
     """Loads configuration from a JSON file."""
@@ -13,141 +39,508 @@ def load_config(config_file):
         return json.load(f)
 
 
-def generate_random_ip(subnet):
-    """Generates a random IP address within the given subnet."""
-    network = ipaddress.IPv4Network(subnet, strict=False)
-    return str(random.choice(list(network.hosts())))
-
-
-def generate_netflow_v5_record(base_time_ms, src_subnet, dst_subnet):
-    """Generates a single NetFlow v5 record with realistic timestamps."""
-    src_ip = socket.inet_aton(generate_random_ip(src_subnet))
-    dst_ip = socket.inet_aton(generate_random_ip(dst_subnet))
-    next_hop = socket.inet_aton("0.0.0.0")
-
-    input_iface = random.randint(0, 65535)
-    output_iface = random.randint(0, 65535)
-    packets = random.randint(1, 1000)
-    bytes_count = random.randint(1, 100000)
-    
+def pack_netflow_v5_record(buffer, offset, base_time_ms, model):
+    """Packs a single NetFlow v5 record with realistic timestamps into buffer at offset."""
     # Start time is based on base_time_ms (system uptime in ms)
     start_time = base_time_ms & 0xFFFFFFFF
     # End time is a small increment from start_time
     end_time = (start_time + random.randint(1, 1000)) & 0xFFFFFFFF
 
-    src_port = random.randint(1024, 65535)
-    dst_port = random.randint(1024, 65535)
-    tcp_flags = random.randint(0, 255)
-    protocol = random.choice([6, 17, 1])  # TCP, UDP, or ICMP
-    tos = random.randint(0, 255)
-    src_as = random.randint(0, 65535)
-    dst_as = random.randint(0, 65535)
-    src_mask = random.randint(0, 32)
-    dst_mask = random.randint(0, 32)
-
-    record = struct.pack(
-        "!4s4s4sHHHIIIHHBBBHHBBxxxxx",
-        src_ip, dst_ip, next_hop, input_iface, output_iface, packets, bytes_count,
-        start_time, end_time, src_port, dst_port, tcp_flags, protocol, tos,
-        src_as, dst_as, src_mask, dst_mask
+    packets = model.packets()
+
+    V5_RECORD.pack_into(
+        buffer, offset,
+        model.src_addr(),
+        model.dst_addr(),
+        0,  # next hop
+        random.randint(0, 65535),  # input interface
+        random.randint(0, 65535),  # output interface
+        packets,
+        model.bytes(packets),
+        start_time, end_time,
+        model.src_port(),
+        model.dst_port(),
+        random.randint(0, 255),  # TCP flags
+        random.choice(PROTOCOLS),
+        random.randint(0, 255),  # ToS
+        model.src_as(),
+        model.dst_as(),
+        random.randint(0, 32),  # source mask
+        random.randint(0, 32),  # destination mask
     )
-    return record
 
 
-def generate_netflow_v5_packets(flow_count, src_subnet, dst_subnet):
-    """Generates NetFlow v5 packets with realistic timing and record count."""
-    max_flows_per_packet = (65535 - 24) // 48  # Maximum flows per packet
-    packets = []
-    flow_sequence = random.randint(0, 2**32 - 1)
-    base_time_ms = int(time.time() * 1000)  # System uptime in milliseconds
-
-    for start in range(0, flow_count, max_flows_per_packet):
-        flows_in_packet = flow_count - start
-        if flows_in_packet > max_flows_per_packet:
-            flows_in_packet = max_flows_per_packet
-
-        sys_uptime = base_time_ms & 0xFFFFFFFF
-        unix_secs = int(time.time())
-        unix_nsecs = int((time.time() % 1) * 1e9) & 0xFFFFFFFF
-        engine_type = 0
-        engine_id = 0
-        sampling_interval = 0
-
-        header = struct.pack(
-            "!HHIIIIBBH",
-            5,  # Version
-            flows_in_packet,
-            sys_uptime,
-            unix_secs,
-            unix_nsecs,
-            flow_sequence,
-            engine_type,
-            engine_id,
-            sampling_interval,
-        )
-        flow_sequence += flows_in_packet
-
-        records = b"".join(generate_netflow_v5_record(base_time_ms, src_subnet, dst_subnet) for _ in range(flows_in_packet))
-        packets.append(header + records)
-
-    return packets
-
-
-def worker(config, flows_per_process):
-    """Worker function to generate and send NetFlow packets."""
-    collector_ip = config["collector_ip"]
-    collector_port = config["collector_port"]
-    export_to_file = config["export_to_file"]
-    output_file = config["output_file"]
-    source_ip_subnet = config["source_ip_subnet"]
-    destination_ip_subnet = config["destination_ip_subnet"]
-
-    if export_to_file:
-        with open(output_file, "wb") as f:
-            print(f"Worker writing NetFlow v5 records to {output_file}")
-            while True:
-                start_time = time.time()
-                packets = generate_netflow_v5_packets(flows_per_process, source_ip_subnet, destination_ip_subnet)
-                for packet in packets:
-                    f.write(packet)
-                elapsed_time = time.time() - start_time
-                sleep_time = max(0, 1 - elapsed_time)
-                time.sleep(sleep_time)
+def packet_views(records_per_packet):
+    """Preallocates one packet buffer and returns views of it sized for 0..records_per_packet records."""
+    buffer = memoryview(bytearray(V5_HEADER.size + records_per_packet * V5_RECORD.size))
+    return [buffer[:V5_HEADER.size + n * V5_RECORD.size] for n in range(records_per_packet + 1)]
+
+
+class V5Exporter:
+    """Emits NetFlow v5 packets for one exporter, which owns the flow_sequence counter.
+
+    Every packet is packed into the same preallocated buffer, so each yielded
+    view is only valid until the next packet is requested. Packets are stamped
+    with the time returned by clock.
+    """
+
+    def __init__(self, config, model, clock=time.time):
+        self.views = packet_views(config.get("records_per_packet", MAX_RECORDS_PER_PACKET))
+        self.model = model
+        self.clock = clock
+        self.flow_sequence = random.randint(0, 2**32 - 1)
+
+    def packets(self, flow_count):
+        """Generates NetFlow v5 packets for flow_count flows, yielding (packet, flows_in_packet)."""
+        views = self.views
+        max_flows_per_packet = len(views) - 1
+        buffer = views[-1]
+
+        for start in range(0, flow_count, max_flows_per_packet):
+            flows_in_packet = min(flow_count - start, max_flows_per_packet)
+
+            now = self.clock()
+            base_time_ms = int(now * 1000)  # System uptime in milliseconds
+            V5_HEADER.pack_into(
+                buffer, 0,
+                5,  # Version
+                flows_in_packet,
+                base_time_ms & 0xFFFFFFFF,  # sys_uptime
+                int(now),  # unix_secs
+                int((now % 1) * 1e9) & 0xFFFFFFFF,  # unix_nsecs
+                self.flow_sequence,
+                0,  # engine_type
+                0,  # engine_id
+                0,  # sampling_interval
+            )
+            self.flow_sequence = (self.flow_sequence + flows_in_packet) & 0xFFFFFFFF
+
+            offset = V5_HEADER.size
+            for _ in range(flows_in_packet):
+                pack_netflow_v5_record(buffer, offset, base_time_ms, self.model)
+                offset += V5_RECORD.size
+
+            yield views[flows_in_packet], flows_in_packet
+
+
+def packet_source(config, clock=time.time):
+    """Returns a function yielding (packet, flows_in_packet) for a number of flows.
+
+    netflow_version selects NetFlow v5 or the template-driven NetFlow v9 /
+    IPFIX (10) exporter; in both cases the packets are views of a buffer that
+    is reused for the next packet, stamped with the time returned by clock.
+    """
+    model = FlowModel(config, subnet_host_range(config["source_ip_subnet"]),
+                      subnet_host_range(config["destination_ip_subnet"]))
+    if config.get("netflow_version", 5) in (9, 10):
+        return TemplateExporter(config, model, clock).packets
+    return V5Exporter(config, model, clock).packets
+
+
+def source_sockets(config, worker_index):
+    """Returns the UDP sockets a worker sends from, following the "export_source_port" strategy.
+
+    per_exporter (the default) gives each worker, which is one exporter, its own
+    socket: port base + worker_index, or an ephemeral port when base is 0.
+    fixed binds every worker to port base with SO_REUSEPORT, so the whole
+    generator is one source address and port. round_robin opens pool_size
+    sockets per worker (ports base + worker_index * pool_size onwards, or
+    ephemeral ones) and sends each packet from the next one, so the collector's
+    SO_REUSEPORT hash spreads one exporter over several readers.
+    """
+    ports = config.get("export_source_port") or {}
+    strategy = ports.get("strategy", "per_exporter")
+    base = ports.get("base", 0)
+    if strategy == "per_exporter":
+        bind_ports = [base + worker_index if base else 0]
+    elif strategy == "fixed":
+        if not base:
+            raise ValueError("export_source_port strategy fixed needs a base port")
+        bind_ports = [base]
+    elif strategy == "round_robin":
+        pool_size = ports.get("pool_size", 16)
+        bind_ports = [base + worker_index * pool_size + i if base else 0 for i in range(pool_size)]
     else:
+        raise ValueError(f"Unknown export_source_port strategy: {strategy}")
+
+    sockets = []
+    for port in bind_ports:
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        print(f"Worker sending NetFlow v5 records to {collector_ip}:{collector_port}")
-        while True:
-            start_time = time.time()
-            packets = generate_netflow_v5_packets(flows_per_process, source_ip_subnet, destination_ip_subnet)
-            for packet in packets:
-                sock.sendto(packet, (collector_ip, collector_port))
-            elapsed_time = time.time() - start_time
-            sleep_time = max(0, 1 - elapsed_time)
-            time.sleep(sleep_time)
+        if strategy == "fixed":
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(("0.0.0.0", port))
+        sockets.append(sock)
+    return sockets
+
+
+def worker_collector(config, worker_index, sockets):
+    """Returns the collector (ip, port) a worker sends to and its index in the collectors list.
+
+    Each worker is one exporter with one sequence counter, so all of its
+    source sockets stick to the same collector. With collector_distribution
+    "hash" (the default) the collector is picked by rendezvous hashing of the
+    address and port of its first source socket, which is what tells the
+    exporter apart, the same way netflowv5_generator_2 hashes exporter
+    addresses (flow_common/addresses.py); adding or removing a collector only
+    moves that collector's exporters. With "round_robin" workers are dealt
+    out in turn.
+    """
+    endpoints = collector_endpoints(config)
+    distribution = config.get("collector_distribution", "hash")
+    if distribution == "round_robin":
+        index = worker_index % len(endpoints)
+    elif distribution == "hash":
+        ip, port = sockets[0].getsockname()
+        index = rendezvous_index(int(ipaddress.IPv4Address(ip)) << 16 | port, rendezvous_seeds(endpoints))
+    else:
+        raise ValueError(f"Unknown collector_distribution: {distribution}")
+    return endpoints[index], index
+
+
+def shard_path(output_file, worker_index):
+    """Returns the per-worker pcap shard name, e.g. netflowv5_records.3.pcap."""
+    root, ext = os.path.splitext(output_file)
+    if ext != ".pcap":
+        root, ext = output_file, ".pcap"
+    return f"{root}.{worker_index}{ext}"
+
+
+def export_worker(config, flows_per_process, worker_index):
+    """Writes export_seconds worth of flows (or the backfill window) to this worker's pcap shard as fast as possible.
+
+    Packet and record timestamps follow a synthetic timeline at flows_per_process
+    FPS, so the shard can later be replayed at the rate it was generated for.
+    """
+    clock = backfill_clock(config, flows_per_process)
+    if clock is None:
+        start = time.time()
+        clock = BackfillClock(start, start + config.get("export_seconds", 60), flows_per_process)
+    packets = packet_source(config, clock)
+    total_flows = clock.total_flows
+    path = shard_path(config["output_file"], worker_index)
+
+    writer = PcapWriter(path, config.get("export_source_ip", "127.0.0.1"), EXPORT_SOURCE_PORT + worker_index,
+                        config["collector_ip"], config["collector_port"])
+    print(f"Worker writing {total_flows} flow records to {path}")
+    start_time = time.time()
+    try:
+        for packet, flows_in_packet in packets(total_flows):
+            writer.write(packet, clock())
+            clock.advance(flows_in_packet)
+    finally:
+        writer.close()
+    print(f"Worker finished {path} in {time.time() - start_time:.1f}s")
+
+
+def worker(config, flows_per_process, worker_metrics, worker_index, cpu=None, run_seconds=None):
+    """Worker function to generate and send NetFlow packets.
+
+    Counters are published to slot worker_index of worker_metrics. In backfill mode records are stamped by a synthetic clock covering the
+    backfill window, sent at backfill "speed" times real time (or unpaced),
+    and the worker exits at the end of the window. The worker is pinned to cpu if one is given. With
+    flows_per_process None it sends unpaced; with run_seconds it stops after that long and publishes the
+    FPS it achieved, which is how startup calibration measures capacity.
+    """
+    pin_to_cpu(cpu)
+    clock = backfill_clock(config, flows_per_process)
+    packets = packet_source(config, clock or time.time)
+    stats_interval = config.get("stats_interval", 10)
+
+    # Flows are generated and released in chunks of at most pacing_burst flows.
+    burst = config.get("pacing_burst", 300)
+    send_rate = backfill_send_rate(config, flows_per_process) if clock else flows_per_process
+    pacer = TokenBucket(send_rate, burst, config.get("pacing_tick_ms", 1) / 1000) if send_rate else None
+    chunk = max(1, min(burst, int(send_rate or burst)))
+    pid = multiprocessing.current_process().pid
+    metrics = worker_metrics.slot(worker_index)
+    metrics.set_rates(send_rate or 0, 0)
+
+    sockets = source_sockets(config, worker_index)
+    next_socket = itertools.cycle(sockets).__next__
+    destination, destination_index = worker_collector(config, worker_index, sockets)
+    count_destinations = len(worker_metrics.destinations) > 1
+    print(f"Worker sending {FORMAT_NAMES[config.get('netflow_version', 5)]} records "
+          f"to {destination[0]}:{destination[1]} "
+          f"from source port{'s' if len(sockets) > 1 else ''} {', '.join(str(s.getsockname()[1]) for s in sockets)}")
+    if clock:
+        print(f"Worker backfilling {format_time(clock.start)} to {format_time(clock.end)} ({clock.total_flows} flows)")
+    started = time.monotonic()
+    while clock is None or not clock.done:
+        metrics.heartbeat()
+        if pacer:
+            if not pacer.acquire(chunk, HEARTBEAT_INTERVAL):
+                # Idle: beat again and pick up a new assigned rate without waiting for the whole chunk.
+                report_pacing(pid, pacer, stats_interval, metrics, follow_assignment=clock is None)
+                continue
+            if pacer.lag:
+                metrics.observe_lag(pacer.lag)
+        batch_started = time.perf_counter()
+        for packet, flows_in_packet in packets(chunk if clock is None else min(chunk, clock.remaining)):
+            try:
+                next_socket().sendto(packet, destination)
+                metrics.add_sent(1, flows_in_packet)
+                if count_destinations:
+                    metrics.add_destination_records(destination_index, flows_in_packet)
+            except OSError as e:
+                metrics.add_errors()
+                print(f"Worker {pid}: error sending packet: {e}")
+            if clock:
+                clock.advance(flows_in_packet)
+        metrics.observe_latency(time.perf_counter() - batch_started)
+        if pacer:
+            report_pacing(pid, pacer, stats_interval, metrics, follow_assignment=clock is None)
+        if clock:
+            report_backfill(pid, clock, stats_interval, metrics if not pacer else None)
+        elapsed = time.monotonic() - started
+        if run_seconds and elapsed >= run_seconds:
+            metrics.set_rates(0, metrics.records_sent() / elapsed)
+            return
+    print(f"Worker {pid}: backfill complete")
+
+
+def replay_worker(config, path, flows_per_second, loop, worker_metrics, worker_index):
+    """Streams the UDP payloads of a pcap file to the collector at flows_per_second.
+
+    NetFlow v5 headers get the current export time and a continuous sequence
+    number; sys_uptime and record times are kept, so flow times stay relative
+    to the replay time. NetFlow v9 and IPFIX headers only get a new export time.
+    Counters are published to slot worker_index of worker_metrics.
+    """
+    pacer = TokenBucket(flows_per_second, config.get("pacing_burst", 300), config.get("pacing_tick_ms", 1) / 1000)
+    stats_interval = config.get("stats_interval", 10)
+    flow_sequence = random.randint(0, 2**32 - 1)
+    pid = multiprocessing.current_process().pid
+    metrics = worker_metrics.slot(worker_index)
+    metrics.set_rates(flows_per_second, 0)
+    sockets = source_sockets(config, worker_index)
+    next_socket = itertools.cycle(sockets).__next__
+    destination, destination_index = worker_collector(config, worker_index, sockets)
+    count_destinations = len(worker_metrics.destinations) > 1
+
+    def acquire(flows):
+        while not pacer.acquire(flows, HEARTBEAT_INTERVAL):
+            metrics.heartbeat()
+
+    print(f"Worker replaying {path} to {destination[0]}:{destination[1]} at {flows_per_second} FPS")
+    while True:
+        for _, payload in read_pcap_payloads(path):
+            metrics.heartbeat()
+            flows = 1
+            version = payload[1] if len(payload) >= 20 and payload[0] == 0 else None
+            if version == 5 and len(payload) >= V5_HEADER.size:
+                count = flows = V5_HEADER.unpack_from(payload)[1]
+                acquire(count)
+                now = time.time()
+                V5_REPLAY_PATCH.pack_into(payload, 8, int(now), int((now % 1) * 1e9) & 0xFFFFFFFF, flow_sequence)
+                flow_sequence = (flow_sequence + count) & 0xFFFFFFFF
+            elif version == 9:
+                # The v9 count includes template records; sequence numbers are kept per source id as written.
+                flows = max(1, struct.unpack_from("!H", payload, 2)[0])
+                acquire(flows)
+                struct.pack_into("!I", payload, 8, int(time.time()))
+            elif version == 10:
+                acquire(1)
+                struct.pack_into("!I", payload, 4, int(time.time()))
+            else:
+                acquire(1)
+            if pacer.lag:
+                metrics.observe_lag(pacer.lag)
+            try:
+                next_socket().sendto(payload, destination)
+                metrics.add_sent(1, flows)
+                if count_destinations:
+                    metrics.add_destination_records(destination_index, flows)
+            except OSError as e:
+                metrics.add_errors()
+                print(f"Worker {pid}: error sending packet: {e}")
+            report_pacing(pid, pacer, stats_interval, metrics)
+        if not loop:
+            break
+
+
+def report_pacing(pid, pacer, stats_interval, metrics, follow_assignment=False):
+    """Prints and publishes target vs achieved FPS once per stats interval.
+
+    With follow_assignment the pacer adopts the rate the parent assigned to this worker as soon as it changes, so it
+    follows the load profile and the rebalancer.
+    """
+    if follow_assignment:
+        assigned = metrics.assigned_rate()
+        if assigned and abs(assigned - pacer.rate) > 1:
+            pacer.set_rate(assigned)
+    stats = pacer.poll_stats(stats_interval)
+    if stats:
+        target, achieved = stats
+        metrics.set_rates(target, achieved)
+        print(f"Worker {pid}: target {target:.0f} FPS, achieved {achieved:.0f} FPS")
+
+
+def report_backfill(pid, clock, stats_interval, metrics=None):
+    """Prints the synthetic time reached and the achieved FPS once per stats interval; publishes the FPS to metrics if given."""
+    stats = clock.poll_stats(stats_interval)
+    if stats:
+        synthetic_time, done, achieved = stats
+        if metrics:
+            metrics.set_rates(0, achieved)
+        print(f"Worker {pid}: backfilled to {format_time(synthetic_time)} ({done:.1%}), {achieved:.0f} FPS")
+
+
+def start_metrics(config, workers):
+    """Creates the shared per-worker metrics table and serves it on metrics_port if one is configured.
+
+    With several collectors the table also counts the records sent to each.
+    """
+    endpoints = collector_endpoints(config)
+    labels = [f"{ip}:{port}" for ip, port in endpoints] if len(endpoints) > 1 else ()
+    worker_metrics = WorkerMetrics.create(workers, labels)
+    if config.get("metrics_port"):
+        worker_metrics.serve(config["metrics_port"])
+    return worker_metrics
+
+
+def report_destinations(worker_metrics, last_records, elapsed):
+    """Prints the FPS sent to each collector since the last report and returns the current per-collector totals."""
+    records = worker_metrics.destination_records()
+    rates = ", ".join(f"{label} {(now - before) / elapsed:.0f} FPS"
+                      for label, now, before in zip(worker_metrics.destinations, records, last_records))
+    print(f"[Collectors] {rates}")
+    return records
+
+
+def report_profile(worker_metrics, profile, start, end, last_records):
+    """Prints the load profile's average target between start and end seconds into the run next to the FPS all
+    workers sent over that stats interval, and returns the records sent so far."""
+    records = worker_metrics.totals()[1]
+    print(f"[Profile] {end:.0f}s: target {profile.average(start, end):.0f} FPS (now {profile.rate(end):.0f} FPS), "
+          f"sent {(records - last_records) / (end - start):.0f} FPS")
+    return records
+
+
+def calibrate(config, cpu):
+    """Measures the FPS one pinned, unpaced worker reaches in calibration_seconds.
+
+    The calibration traffic goes to calibration_collector_ip/port, a discard sink, never to the collectors: the
+    calibration worker is an exporter of its own, so a collector would see the sequence and sys_uptime restart
+    when the workers take over (see calibration_endpoint).
+    """
+    seconds = config.get("calibration_seconds", 2)
+    ip, port = calibration_endpoint(config)
+    print(f"Calibrating per-process capacity for {seconds}s on CPU {cpu} against {ip}:{port}...")
+    calibration_config = dict(config, backfill={}, collectors=None, collector_ip=ip, collector_port=port)
+    capacity = measure_capacity(worker, lambda worker_metrics: (calibration_config, None, worker_metrics, 0, cpu, seconds))
+    if not capacity:
+        raise RuntimeError("Calibration worker did not send any flows; check calibration_collector_ip")
+    print(f"Calibrated {capacity:.0f} FPS per process.")
+    return capacity
+
+
+def replay(config, files, flows_per_second, loop):
+    """Replays pcap shards in parallel, one process per file, splitting the target rate evenly."""
+    flows_per_file = max(1, flows_per_second // len(files))
+    print(f"Replaying {len(files)} files at {flows_per_second} FPS.")
+    worker_metrics = start_metrics(config, len(files))
+
+    processes = []
+    try:
+        for i, path in enumerate(files):
+            p = multiprocessing.Process(target=replay_worker, args=(config, path, flows_per_file, loop, worker_metrics, i))
+            p.start()
+            processes.append(p)
+
+        for p in processes:
+            p.join()
+    finally:
+        worker_metrics.close()
 
 
 def main():
+    parser = argparse.ArgumentParser(description="NetFlow v5 flow generator")
+    subparsers = parser.add_subparsers(dest="command")
+    replay_parser = subparsers.add_parser("replay", help="Replay pcap shards written with export_to_file")
+    replay_parser.add_argument("files", nargs="+", help="pcap files to replay")
+    replay_parser.add_argument("--fps", type=int, help="Total flows per second (defaults to flows_per_second)")
+    replay_parser.add_argument("--loop", action="store_true", help="Replay the files until interrupted")
+    args = parser.parse_args()
+
     config = load_config("config.json")
     flows_per_second = config["flows_per_second"]
-    max_flows_per_process = 4500
 
-    # Calculate the number of processes needed
-    num_processes = (flows_per_second + max_flows_per_process - 1) // max_flows_per_process
-    flows_per_process = flows_per_second // num_processes
+    if args.command == "replay":
+        replay(config, args.files, args.fps or flows_per_second, args.loop)
+        return
+
+    profile = load_profile(config)
+    if profile and (config["export_to_file"] or config.get("backfill")):
+        print("[WARN] load_profile is ignored with export_to_file and backfill; flows_per_second sets the density "
+              "of the generated data.")
+        profile = None
+
+    # A load profile is planned for its peak.
+    cpus = available_cpus()
+    capacity = config.get("flows_per_process")
+    if config["export_to_file"] and not capacity:
+        # Pcap shards are written as fast as possible and nothing is sent, so there is no send path to calibrate:
+        # one shard per CPU, each replayable by one process at its share of flows_per_second.
+        rates = [flows_per_second / len(cpus)] * len(cpus)
+    else:
+        capacity = capacity or calibrate(config, cpus[0])
+        rates = plan_workers(profile.peak() if profile else flows_per_second, capacity, cpus,
+                             config.get("calibration_headroom", 0.8))
+    num_processes = len(rates)
 
     # Log message
-    print(f"Spawning {num_processes} processes because FPS setting is {flows_per_second}.")
+    if profile:
+        profile_start = time.time()
+        rates = [profile.rate(0) / num_processes] * num_processes
+        print(f"Spawning {num_processes} processes to follow the load profile: {profile.describe()}.")
+    else:
+        print(f"Spawning {num_processes} processes because FPS setting is {flows_per_second}.")
 
+    worker_metrics = start_metrics(config, num_processes)
+    rebalancer = None
+    if config.get("rebalance", True) and not config["export_to_file"] and not config.get("backfill"):
+        rebalancer = Rebalancer(worker_metrics, capacity)
     processes = []
-    for _ in range(num_processes):
-        p = multiprocessing.Process(target=worker, args=(config, flows_per_process))
-        p.start()
-        processes.append(p)
-
-    # Ensure all processes run indefinitely
-    for p in processes:
-        p.join()
+    try:
+        for i, rate in enumerate(rates):
+            worker_metrics.assign(i, rate)
+            cpu = cpus[i % len(cpus)] if config.get("cpu_pinning", True) else None
+            if config["export_to_file"]:
+                p = multiprocessing.Process(target=export_worker, args=(config, rate, i))
+            else:
+                p = multiprocessing.Process(target=worker, args=(config, rate, worker_metrics, i, cpu))
+            p.start()
+            processes.append(p)
 
+        # Ensure all processes run indefinitely, moving rate off workers that fall behind
+        stats_interval = config.get("stats_interval", 10)
+        last_stats = time.monotonic()
+        destination_records = worker_metrics.destination_records()
+        sent_records = 0
+        profile_stats = 0.0
+        while any(p.is_alive() for p in processes):
+            timeout = min(stats_interval, profile.update_seconds) if profile else stats_interval
+            multiprocessing.connection.wait([p.sentinel for p in processes], timeout=timeout)
+            if profile:
+                assign_total(worker_metrics, profile.rate(time.time() - profile_start))
+            if time.monotonic() - last_stats < stats_interval:
+                continue
+            if worker_metrics.destinations and not config["export_to_file"]:
+                destination_records = report_destinations(worker_metrics, destination_records,
+                                                          time.monotonic() - last_stats)
+            if profile:
+                now = time.time() - profile_start
+                sent_records = report_profile(worker_metrics, profile, profile_stats, now, sent_records)
+                profile_stats = now
+            last_stats = time.monotonic()
+            if rebalancer:
+                unplaced = rebalancer.step()
+                if unplaced:
+                    print(f"[WARN] {unplaced:.0f} FPS could not be placed on any worker.")
+        for p in processes:
+            p.join()
+    finally:
+        worker_metrics.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,117 @@
+import mmap
+import os
+import socket
+import struct
+
+PCAP_MAGIC_NSEC = 0xA1B23C4D
+PCAP_MAGIC_USEC = 0xA1B2C3D4
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101  # Packets begin with the IPv4 header
+
+PCAP_GLOBAL_HEADER = struct.Struct("<IHHiIII")
+PCAP_RECORD_HEADER = struct.Struct("<IIII")
+IPV4_HEADER = struct.Struct("!BBHHHBBH4s4s")
+UDP_HEADER = struct.Struct("!HHHH")
+FRAME_OVERHEAD = PCAP_RECORD_HEADER.size + IPV4_HEADER.size + UDP_HEADER.size
+
+GROW_SIZE = 64 * 1024 * 1024
+
+
+def ipv4_checksum(header):
+    """Returns the one's complement checksum of an IPv4 header."""
+    total = sum(struct.unpack("!10H", header))
+    total = (total & 0xFFFF) + (total >> 16)
+    total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+class PcapWriter:
+    """Writes UDP datagrams to a nanosecond pcap file through a growing memory map.
+
+    Each payload is framed with IPv4 and UDP headers (LINKTYPE_RAW) so the
+    capture opens in Wireshark and can be replayed with replay_pcap().
+    """
+
+    def __init__(self, path, src_ip, src_port, dst_ip, dst_port):
+        self.path = path
+        self.src_ip = socket.inet_aton(src_ip)
+        self.dst_ip = socket.inet_aton(dst_ip)
+        self.src_port = src_port
+        self.dst_port = dst_port
+        self.ip_id = 0
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.ftruncate(self.fd, GROW_SIZE)
+        self.map = mmap.mmap(self.fd, GROW_SIZE)
+        PCAP_GLOBAL_HEADER.pack_into(self.map, 0, PCAP_MAGIC_NSEC, 2, 4, 0, 0, 65535, LINKTYPE_RAW)
+        self.offset = PCAP_GLOBAL_HEADER.size
+
+    def write(self, payload, timestamp):
+        """Appends one UDP datagram captured at timestamp (seconds since the epoch)."""
+        length = len(payload)
+        frame_length = IPV4_HEADER.size + UDP_HEADER.size + length
+        end = self.offset + PCAP_RECORD_HEADER.size + frame_length
+        if end > len(self.map):
+            self.map.resize(len(self.map) + max(GROW_SIZE, frame_length))
+
+        secs = int(timestamp)
+        PCAP_RECORD_HEADER.pack_into(self.map, self.offset, secs, int((timestamp - secs) * 1e9),
+                                     frame_length, frame_length)
+        ip_offset = self.offset + PCAP_RECORD_HEADER.size
+        IPV4_HEADER.pack_into(self.map, ip_offset, 0x45, 0, frame_length, self.ip_id, 0, 64,
+                              socket.IPPROTO_UDP, 0, self.src_ip, self.dst_ip)
+        struct.pack_into("!H", self.map, ip_offset + 10,
+                         ipv4_checksum(self.map[ip_offset:ip_offset + IPV4_HEADER.size]))
+        UDP_HEADER.pack_into(self.map, ip_offset + IPV4_HEADER.size, self.src_port, self.dst_port,
+                             UDP_HEADER.size + length, 0)
+        self.map[end - length:end] = payload
+
+        self.ip_id = (self.ip_id + 1) & 0xFFFF
+        self.offset = end
+
+    def close(self):
+        """Flushes the map and truncates the file to the bytes actually written."""
+        self.map.flush()
+        self.map.close()
+        os.ftruncate(self.fd, self.offset)
+        os.close(self.fd)
+
+
+def read_pcap_payloads(path):
+    """Memory-maps a pcap file and yields (timestamp, udp_payload) for every IPv4/UDP packet.
+
+    Payloads are writable views into a private copy-on-write mapping, so a
+    caller may patch them in place before sending without touching the file.
+    """
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    magic = struct.unpack_from("<I", data, 0)[0]
+    if magic not in (PCAP_MAGIC_NSEC, PCAP_MAGIC_USEC):
+        raise ValueError(f"{path} is not a little-endian pcap file")
+    fraction = 1e-9 if magic == PCAP_MAGIC_NSEC else 1e-6
+    linktype = PCAP_GLOBAL_HEADER.unpack_from(data, 0)[6]
+    if linktype == LINKTYPE_RAW:
+        link_offset = 0
+    elif linktype == LINKTYPE_ETHERNET:
+        link_offset = 14
+    else:
+        raise ValueError(f"{path} has unsupported link type {linktype}")
+
+    view = memoryview(data)
+    offset = PCAP_GLOBAL_HEADER.size
+    size = len(data)
+    while offset + PCAP_RECORD_HEADER.size <= size:
+        secs, frac, captured, _ = PCAP_RECORD_HEADER.unpack_from(data, offset)
+        frame = offset + PCAP_RECORD_HEADER.size
+        offset = frame + captured
+        if offset > size:
+            break
+
+        ip = frame + link_offset
+        if link_offset and data[frame + 12:frame + 14] != b"\x08\x00":
+            continue
+        if data[ip] >> 4 != 4 or data[ip + 9] != socket.IPPROTO_UDP:
+            continue
+        payload = ip + (data[ip] & 0x0F) * 4 + UDP_HEADER.size
+        yield secs + frac * fraction, view[payload:offset]
@@ -0,0 +1,91 @@
+import collections
+import math
+
+from flow_common.addresses import subnet_host_range
+
+CHURN_CHECK_INTERVAL = 0.1  # seconds of (synthetic) time between drawing churn events
+
+
+class ExporterChurn:
+    """Adds, reboots and retires one worker's exporters at the configured fleet-wide rates.
+
+    The "churn" rates are events per minute for the whole generator; each of
+    num_processes workers applies its share, drawing Poisson event counts
+    every CHURN_CHECK_INTERVAL. A rebooted exporter restarts its flow
+    sequence and sys_uptime from zero. A departed exporter stops sending. An
+    arriving exporter takes the next unused address of source_packet_subnet
+    after the first number_of_exporters (every num_processes-th one, so
+    workers never share an exporter) and, once the subnet is used up, the
+    worker's longest-retired address. A generator that is one of
+    partitions agents of a cluster (see cluster.py) applies its own share of
+    the rates and interleaves its arrivals with the other agents' the same way.
+    """
+
+    def __init__(self, churn, source_packet_subnet, number_of_exporters, worker_index, num_processes, rng, now,
+                 partition=0, partitions=1, share=1.0):
+        first_host, host_count = subnet_host_range(source_packet_subnet)
+        self.next_address = first_host + number_of_exporters + partition + partitions * worker_index
+        self.last_address = first_host + host_count - 1
+        self.stride = partitions * num_processes
+        self.retired = collections.deque()
+        self.rng = rng
+
+        # This worker's fraction of a fleet-wide per-minute rate, per second.
+        per_second = share / (60 * num_processes)
+        self.arrival_rate = churn.get("arrivals_per_minute", 0) * per_second
+        self.reboot_rate = churn.get("reboots_per_minute", 0) * per_second
+        self.departure_rate = churn.get("departures_per_minute", 0) * per_second
+        workers = num_processes / share  # workers across the whole cluster
+        self.min_exporters = max(1, math.ceil(churn.get("min_exporters", 1) / workers))
+        self.max_exporters = math.ceil(churn["max_exporters"] / workers) if churn.get("max_exporters") else None
+
+        self.last_check = now
+        self.arrived = self.rebooted = self.departed = 0
+
+    def step(self, exporters, now):
+        """Applies the churn events due since the last step to an ExporterState at (possibly synthetic) time now."""
+        elapsed = now - self.last_check
+        if elapsed < CHURN_CHECK_INTERVAL:
+            return
+        self.last_check = now
+        rng = self.rng
+        now_ms = int(now * 1000)
+
+        reboots = min(rng.poisson(self.reboot_rate * elapsed), len(exporters))
+        if reboots:
+            exporters.reboot(rng.choice(len(exporters), reboots, replace=False), now_ms)
+            self.rebooted += reboots
+
+        departures = min(rng.poisson(self.departure_rate * elapsed), len(exporters) - self.min_exporters)
+        if departures > 0:
+            self.retired.extend(exporters.remove(rng.choice(len(exporters), departures, replace=False)).tolist())
+            self.departed += departures
+
+        arrivals = rng.poisson(self.arrival_rate * elapsed)
+        if self.max_exporters is not None:
+            arrivals = min(arrivals, self.max_exporters - len(exporters))
+        addresses = [address for address in (self._new_address() for _ in range(max(0, arrivals))) if address is not None]
+        if addresses:
+            exporters.add(addresses, rng, now_ms)
+            self.arrived += len(addresses)
+
+    def _new_address(self):
+        if self.next_address <= self.last_address:
+            address = self.next_address
+            self.next_address += self.stride
+            return address
+        return self.retired.popleft() if self.retired else None
+
+    def describe(self, exporters):
+        return (f", {len(exporters)} exporters (+{self.arrived} arrived, {self.rebooted} rebooted, "
+                f"-{self.departed} departed)")
+
+
+def exporter_churn(config, worker_index, num_processes, rng, now):
+    """Returns an ExporterChurn for the "churn" config object, or None when churn is not configured."""
+    churn = config.get("churn")
+    if not churn:
+        return None
+    return ExporterChurn(churn, config["source_packet_subnet"], config.get("number_of_exporters", 10000),
+                         worker_index, num_processes, rng, now, config.get("agent_index", 0),
+                         config.get("agent_count", 1), config.get("agent_share", 1.0))
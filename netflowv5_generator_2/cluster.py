@@ -0,0 +1,336 @@
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))  # for flow_common
+
+from flow_common.calibration import available_cpus
+from flow_common.load_profile import load_profile, resolve_profile
+from exporter_table import ExporterTable
+from netflowv5_gen2 import calibrate, load_config, run
+
+DEFAULT_CONTROLLER = "127.0.0.1:7070"
+CALIBRATION_EXPORTERS = 1024  # agents calibrate before they know their exporters, on the first addresses of the subnet
+STOP_TIMEOUT = 10  # seconds to wait for agents to report they have stopped
+
+
+def parse_address(address):
+    """Splits "host:port" (or just "host", on the default port) into a (host, port) tuple."""
+    host, _, port = address.rpartition(":") if ":" in address else (address, "", "")
+    return host or "0.0.0.0", int(port or DEFAULT_CONTROLLER.rpartition(":")[2])
+
+
+async def wait_any(*events, timeout=None):
+    """Waits until one of the asyncio events is set or timeout seconds have passed."""
+    waiters = [asyncio.ensure_future(event.wait()) for event in events]
+    await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    for waiter in waiters:
+        waiter.cancel()
+
+
+def plan_agents(config, registrations, seed):
+    """Returns the config overrides of each registered agent.
+
+    The flows_per_second of the cluster is split in proportion to what each agent
+    can send (its CPUs times its calibrated capacity), and the exporters into
+    contiguous ranges of the same proportions, so that every exporter is owned by
+    exactly one agent and its sequence numbers stay gap-free. A load profile is
+    split the same way: every agent follows it scaled by its share.
+    """
+    flows_per_second = config["flows_per_second"]
+    profile = load_profile(config)
+    peak = profile.peak() if profile else flows_per_second
+    number_of_exporters = config.get("number_of_exporters", 10000)
+    headroom = config.get("calibration_headroom", 0.8)
+    usable = [registration["cpus"] * registration["capacity"] * headroom for registration in registrations]
+    if peak > sum(usable):
+        print(f"[WARN] {peak:.0f} FPS exceeds the calibrated capacity of the cluster ({sum(usable):.0f} FPS "
+              f"at {headroom:.0%} headroom); agents will fall behind.")
+
+    plans = []
+    bounds = [round(number_of_exporters * sum(usable[:i]) / sum(usable)) for i in range(len(usable) + 1)]
+    for i, registration in enumerate(registrations):
+        share = usable[i] / sum(usable)
+        if bounds[i + 1] == bounds[i]:
+            raise ValueError(f"number_of_exporters ({number_of_exporters}) is too small to give agent "
+                             f"{registration['host']} an exporter")
+        plans.append({
+            "flows_per_second": flows_per_second * share,
+            "exporter_offset": bounds[i],
+            "exporter_count": bounds[i + 1] - bounds[i],
+            "seed": [seed, i],
+            "agent_index": i,
+            "agent_count": len(registrations),
+            "agent_share": share,
+        })
+    return plans
+
+
+class AgentLink:
+    """The controller's side of one agent connection and the stats the agent has streamed back."""
+
+    def __init__(self, reader, writer, registration):
+        self.reader = reader
+        self.writer = writer
+        self.host = registration["host"]
+        self.cpus = registration["cpus"]
+        self.capacity = registration["capacity"]
+        self.assigned = 0.0
+        self.records = self.errors = 0
+        self.done = False
+
+    async def send(self, message):
+        self.writer.write((json.dumps(message) + "\n").encode())
+        await self.writer.drain()
+
+    def observe(self, stats, timeline):
+        """Adds the records sent since the agent's previous stats to the second they were reported in."""
+        timeline[int(stats["time"])] += stats["records"] - self.records
+        self.records = stats["records"]
+        self.errors = stats["errors"]
+        self.assigned = stats["assigned"]
+
+
+class Controller:
+    """Registers the expected number of agents, gives each its share of the run and aggregates their stats.
+
+    Agents connect over TCP and exchange JSON lines: the controller sends its
+    config, the agent calibrates and registers with its CPU count and capacity,
+    and once all agents are in, each is assigned its rate, exporter range, seed
+    and a common start_at time a few seconds ahead. Agents then stream their
+    cumulative counters every second until they finish or the controller sends
+    stop (on Ctrl+C).
+    """
+
+    def __init__(self, config, agents, listen, start_delay):
+        self.config = config
+        self.agents = agents
+        self.listen = listen
+        self.start_delay = start_delay
+        self.links = []
+        self.connections = {}  # handler task -> writer of every open agent connection
+        self.registered = asyncio.Event()
+        self.finished = asyncio.Event()
+        self.timeline = collections.Counter()  # wall-clock second -> records sent by the whole cluster
+        self.started = None
+
+    async def handle(self, reader, writer):
+        self.connections[asyncio.current_task()] = writer
+        try:
+            writer.write((json.dumps({"type": "config", "config": self.config}) + "\n").encode())
+            await writer.drain()
+            line = await reader.readline()
+            if not line:
+                return
+            registration = json.loads(line)
+            if self.registered.is_set():
+                print(f"[Cluster] Rejecting agent {registration['host']}: all {self.agents} agents are registered.")
+                return
+            link = AgentLink(reader, writer, registration)
+            self.links.append(link)
+            print(f"[Cluster] Agent {len(self.links)}/{self.agents} registered: {link.host}, {link.cpus} CPUs at "
+                  f"{link.capacity:.0f} FPS per process.")
+            if len(self.links) == self.agents:
+                self.registered.set()
+
+            async for line in reader:
+                message = json.loads(line)
+                if message["type"] == "stats":
+                    link.observe(message, self.timeline)
+                elif message["type"] == "done":
+                    break
+            link.done = True
+            if all(other.done for other in self.links):
+                self.finished.set()
+        except (ConnectionError, json.JSONDecodeError) as e:
+            print(f"[Cluster] Agent connection lost: {e}")
+        finally:
+            del self.connections[asyncio.current_task()]
+            writer.close()
+
+    async def assign(self):
+        seed = self.config.get("seed")
+        if seed is None:
+            seed = random.randrange(2**32)
+        plans = plan_agents(self.config, [{"host": link.host, "cpus": link.cpus, "capacity": link.capacity}
+                                          for link in self.links], seed)
+        self.started = time.time() + self.start_delay
+        for link, plan in zip(self.links, plans):
+            link.assigned = plan["flows_per_second"]
+            await link.send({"type": "assign", "config": dict(plan, start_at=self.started)})
+            print(f"[Cluster] {link.host}: {plan['flows_per_second']:.0f} FPS, exporters {plan['exporter_offset']}-"
+                  f"{plan['exporter_offset'] + plan['exporter_count'] - 1}.")
+        print(f"[Cluster] Seed {seed}; starting {len(self.links)} agents in {self.start_delay}s.")
+
+    def report(self, since, records):
+        elapsed = max(1e-9, time.time() - since)
+        achieved = ", ".join(f"{link.host} {link.records - records.get(id(link), 0):.0f}" for link in self.links)
+        total = sum(link.records for link in self.links) - sum(records.values())
+        up = sum(not link.done for link in self.links)
+        print(f"[Cluster] {up}/{len(self.links)} agents: assigned {sum(link.assigned for link in self.links):.0f} FPS, "
+              f"achieved {total / elapsed:.0f} FPS, {sum(link.errors for link in self.links):.0f} send errors "
+              f"(records per agent: {achieved})")
+
+    def summary(self):
+        # The first second after start_at and the last one are partial, so the per-second range leaves them out.
+        seconds = [second for second in sorted(self.timeline) if second > self.started + 1][:-1]
+        per_second = [self.timeline[second] for second in seconds] or [0]
+        total = sum(self.timeline.values())
+        duration = max(1e-9, (max(self.timeline) + 1 if self.timeline else time.time()) - self.started)
+        print(f"[Cluster] {total} records in {duration:.0f}s from {len(self.links)} agents: average "
+              f"{total / duration:.0f} FPS, per second min {min(per_second)} / max {max(per_second)} FPS, "
+              f"{sum(link.errors for link in self.links):.0f} send errors.")
+        for link in self.links:
+            print(f"[Cluster]   {link.host}: {link.records} records, {link.errors:.0f} send errors")
+
+    async def serve(self):
+        stop = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGINT, stop.set)
+        host, port = self.listen
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"[Cluster] Waiting for {self.agents} agents on {host}:{port}...")
+        try:
+            await wait_any(self.registered, stop)
+            if stop.is_set():
+                return
+            await self.assign()
+
+            stats_interval = self.config.get("stats_interval", 10)
+            since, records = time.time(), {}
+            while not stop.is_set() and not self.finished.is_set():
+                await wait_any(stop, self.finished, timeout=stats_interval)
+                if time.time() > self.started and not stop.is_set() and not self.finished.is_set():
+                    self.report(max(since, self.started), records)
+                since, records = time.time(), {id(link): link.records for link in self.links}
+
+            if stop.is_set():
+                print("\n[Cluster] Stopping agents...")
+                for link in self.links:
+                    if not link.done:
+                        await link.send({"type": "stop"})
+                await wait_any(self.finished, timeout=STOP_TIMEOUT)
+                if not self.finished.is_set():
+                    print(f"[WARN] {sum(not link.done for link in self.links)} agents did not stop within {STOP_TIMEOUT}s.")
+            self.summary()
+        finally:
+            server.close()
+            # Closing the connections ends the handlers, so none is left to be cancelled when the loop exits.
+            for writer in self.connections.values():
+                writer.close()
+            if self.connections:
+                await asyncio.wait(list(self.connections), timeout=1)
+
+
+class AgentSession:
+    """An agent's connection to the controller: JSON lines in both directions over one TCP socket."""
+
+    def __init__(self, address):
+        self.sock = socket.create_connection(address)
+        self.reader = self.sock.makefile("r")
+        self.writer = self.sock.makefile("w")
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        with self.lock:
+            self.writer.write(json.dumps(message) + "\n")
+            self.writer.flush()
+
+    def receive(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("controller closed the connection")
+        return json.loads(line)
+
+    def close(self):
+        self.reader.close()
+        self.writer.close()
+        self.sock.close()
+
+
+def agent(address, metrics_port=0):
+    """Registers with the controller at address, runs the assigned share and streams stats until stopped."""
+    session = AgentSession(address)
+    try:
+        config = session.receive()["config"]
+        cpus = available_cpus()
+        capacity = config.get("flows_per_process")
+        if not capacity:
+            exporter_table = ExporterTable.create(config["source_packet_subnet"],
+                                                  min(config.get("number_of_exporters", 10000), CALIBRATION_EXPORTERS))
+            try:
+                capacity = calibrate(config, exporter_table, cpus[0])
+            finally:
+                exporter_table.close()
+        session.send({"type": "register", "host": f"{socket.gethostname()}/{os.getpid()}", "cpus": len(cpus), "capacity": capacity})
+        assignment = session.receive()["config"]
+        print(f"[Agent] Assigned {assignment['flows_per_second']:.0f} FPS and {assignment['exporter_count']} exporters, "
+              f"starting in {assignment['start_at'] - time.time():.1f}s.")
+
+        stop = threading.Event()
+
+        def listen():
+            try:
+                while session.receive()["type"] != "stop":
+                    pass
+            except (OSError, ValueError):
+                pass
+            stop.set()
+
+        def report(worker_metrics):
+            packets, records, errors, assigned = worker_metrics.totals()
+            try:
+                session.send({"type": "stats", "time": time.time(), "packets": int(packets), "records": int(records),
+                              "errors": int(errors), "assigned": assigned})
+            except OSError:
+                stop.set()
+
+        threading.Thread(target=listen, daemon=True).start()
+        run(dict(config, **assignment, flows_per_process=capacity, metrics_port=metrics_port), stop, report)
+        session.send({"type": "done"})
+    finally:
+        session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run netflowv5_gen2 as a cluster of agents driven by one controller")
+    subcommands = parser.add_subparsers(dest="role", required=True)
+    controller = subcommands.add_parser("controller", help="Wait for the agents, split the run between them and "
+                                                           "aggregate their stats")
+    controller.add_argument("--config", default="config.json", help="Generator config for the whole cluster")
+    controller.add_argument("--agents", type=int, help="Number of agents to wait for (default cluster.agents)")
+    controller.add_argument("--listen", help="host:port to accept agents on (default 0.0.0.0 and the port of "
+                                             "cluster.controller)")
+    agent_parser = subcommands.add_parser("agent", help="Generate this host's share of the controller's run")
+    agent_parser.add_argument("--config", default="config.json", help="Config to take cluster.controller from")
+    agent_parser.add_argument("--controller", help="host:port of the controller (default cluster.controller)")
+    agent_parser.add_argument("--metrics-port", type=int, default=0, help="Port serving this agent's Prometheus "
+                                                                          "metrics (default disabled)")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    cluster = config.get("cluster") or {}
+    default_address = cluster.get("controller", DEFAULT_CONTROLLER)
+    if args.role == "controller":
+        # Agents get the profile with a csv timeline already read, so the file only has to exist on the controller.
+        if config.get("load_profile"):
+            config["load_profile"] = resolve_profile(config)
+        listen = parse_address(args.listen or "0.0.0.0:" + default_address.rpartition(":")[2])
+        asyncio.run(Controller(config, args.agents or cluster.get("agents", 1), listen,
+                               cluster.get("start_delay_seconds", 5)).serve())
+    else:
+        try:
+            agent(parse_address(args.controller or default_address), args.metrics_port)
+        except ConnectionError as e:
+            print(f"[Agent] Lost the controller: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import ipaddress
+
+import numpy as np
+
+from flow_common.addresses import collector_endpoints, rendezvous_index, rendezvous_seeds
+
+DISTRIBUTIONS = ("hash", "round_robin")
+
+
+class Collectors:
+    """The collector endpoints packets are sent to, and which exporter sends to which.
+
+    Every exporter sticks to one collector, so each collector sees complete,
+    gap-free sequences. "hash" picks it by rendezvous (highest random weight)
+    hashing of the exporter address (flow_common/addresses.py, which
+    netflow_generator uses too), like ECMP in front of a collector tier:
+    adding or removing a collector only moves the exporters of that collector.
+    Each exporter is hashed once and its collector remembered.
+    "round_robin" deals the exporters out in address order, so every collector
+    gets the same number.
+    """
+
+    def __init__(self, endpoints, distribution="hash"):
+        if not endpoints:
+            raise ValueError("at least one collector is needed")
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown collector_distribution: {distribution}")
+        self.endpoints = [(ip, int(port)) for ip, port in endpoints]
+        self.distribution = distribution
+        self.addresses = np.array([int(ipaddress.IPv4Address(ip)) for ip, _ in self.endpoints], dtype=np.uint32)
+        self.ports = np.array([port for _, port in self.endpoints], dtype=np.uint16)
+        self.seeds = rendezvous_seeds(self.endpoints)
+        self.sticky = {}  # exporter address -> collector index
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def labels(self):
+        return [f"{ip}:{port}" for ip, port in self.endpoints]
+
+    def assign(self, addresses):
+        """Returns the index of the collector each exporter address sends to."""
+        addresses = np.asarray(addresses)
+        if len(self.endpoints) == 1:
+            return np.zeros(len(addresses), dtype=np.intp)
+        if self.distribution == "round_robin":
+            return (addresses % len(self.endpoints)).astype(np.intp)
+        sticky = self.sticky
+        indexes = []
+        for address in addresses.tolist():
+            index = sticky.get(address)
+            if index is None:
+                index = sticky[address] = rendezvous_index(address, self.seeds)
+            indexes.append(index)
+        return np.array(indexes, dtype=np.intp)
+
+
+def configured_collectors(config):
+    """Returns the Collectors of a config."""
+    return Collectors(collector_endpoints(config), config.get("collector_distribution", "hash"))
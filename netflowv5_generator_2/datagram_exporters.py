@@ -0,0 +1,99 @@
+import asyncio
+import ipaddress
+import resource
+import socket
+
+
+def exporter_bind_addresses(ip_list, bind_mode, source_ip, base_port, first_host):
+    """Returns the local (address, port) each exporter's socket binds to.
+
+    "address" binds every exporter to its own address on an ephemeral port;
+    "port" binds every exporter to source_ip and base_port plus its offset
+    from first_host, so exporters stay distinguishable by source port.
+    """
+    if bind_mode == "address":
+        return [(str(ipaddress.IPv4Address(ip)), 0) for ip in ip_list]
+    if bind_mode == "port":
+        ports = [base_port + int(ip) - first_host for ip in ip_list]
+        if ports and max(ports) > 65535:
+            raise ValueError(f"async_base_port {base_port} leaves no room for {max(ports) - base_port + 1} exporter ports")
+        return [(source_ip, port) for port in ports]
+    raise ValueError(f"Unknown async_bind mode: {bind_mode}")
+
+
+def raise_open_file_limit(needed):
+    """Raises the soft RLIMIT_NOFILE to the hard limit when `needed` descriptors would not fit."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        soft = hard if hard == resource.RLIM_INFINITY else max(soft, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        raise ValueError(f"{needed} exporter sockets exceed the open file limit ({soft}); raise ulimit -n or use more processes")
+
+
+class _ExporterProtocol(asyncio.DatagramProtocol):
+    def __init__(self, pool):
+        self.pool = pool
+
+    def error_received(self, exc):
+        # Connected UDP sockets surface ICMP errors (e.g. port unreachable) here.
+        self.pool.errors += 1
+
+    def pause_writing(self):
+        self.pool.paused += 1
+
+    def resume_writing(self):
+        self.pool.paused -= 1
+
+
+class DatagramExporters:
+    """One connected, non-blocking UDP datagram endpoint per emulated exporter on a single event loop.
+
+    This is the rootless counterpart of the raw-socket packet ring: the
+    kernel builds the IP/UDP headers, so an exporter's source address is the
+    local address its socket is bound to.
+    """
+
+    def __init__(self):
+        self.transports = []
+        self.errors = 0
+        self.paused = 0
+
+    @classmethod
+    async def open(cls, bind_addresses, collectors):
+        """Opens one endpoint per exporter, bound to bind_addresses and connected to the matching entry of collectors."""
+        pool = cls()
+        raise_open_file_limit(len(bind_addresses) + 64)
+        loop = asyncio.get_running_loop()
+        for address, collector in zip(bind_addresses, collectors):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                sock.setblocking(False)
+                sock.bind(address)
+                sock.connect(collector)
+            except OSError as e:
+                sock.close()
+                pool.close()
+                raise OSError(f"cannot bind exporter socket to {address[0]}:{address[1]}: {e}") from e
+            transport, _ = await loop.create_datagram_endpoint(lambda: _ExporterProtocol(pool), sock=sock)
+            pool.transports.append(transport)
+        return pool
+
+    def __len__(self):
+        return len(self.transports)
+
+    def send(self, ring, start, count, idx):
+        """Sends the UDP payloads of ring slots [start, start + count) through exporters idx."""
+        transports = self.transports
+        for slot, exporter in zip(range(start, start + count), idx.tolist()):
+            transports[exporter].sendto(ring.payload(slot))
+        return count
+
+    async def drain(self):
+        """Waits until no endpoint's send buffer is above its high-water mark."""
+        while self.paused:
+            await asyncio.sleep(0.001)
+
+    def close(self):
+        for transport in self.transports:
+            transport.close()
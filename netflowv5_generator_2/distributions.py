@@ -0,0 +1,128 @@
+import numpy as np
+
+
+class AliasTable:
+    """Walker/Vose alias table: O(1) sampling of indices from an arbitrary discrete distribution."""
+
+    def __init__(self, weights, rng):
+        self.rng = rng
+        weights = np.asarray(weights, dtype=np.float64)
+        n = len(weights)
+        scaled = weights * (n / weights.sum())
+        self.prob = np.ones(n, dtype=np.float64)
+        self.alias = np.arange(n, dtype=np.int64)
+
+        small = [i for i in range(n) if scaled[i] < 1.0]
+        large = [i for i in range(n) if scaled[i] >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+
+    def sample(self, n):
+        """Returns n indices drawn from the table's distribution."""
+        idx = self.rng.integers(0, len(self.prob), size=n)
+        return np.where(self.rng.random(n) < self.prob[idx], idx, self.alias[idx])
+
+
+def zipf_weights(cardinality, exponent):
+    """Returns Zipf popularity weights 1/rank**exponent for ranks 1..cardinality."""
+    return 1.0 / np.arange(1, cardinality + 1, dtype=np.float64) ** exponent
+
+
+class UniformSampler:
+    """Uniform integers in [low, high]."""
+
+    def __init__(self, low, high, rng, dtype=np.uint32):
+        self.low, self.high, self.rng, self.dtype = low, high, rng, dtype
+
+    def sample(self, n):
+        return self.rng.integers(self.low, self.high, size=n, endpoint=True).astype(self.dtype)
+
+
+def distinct_keys(base, cardinality, rounds=10):
+    """Returns up to `cardinality` distinct values drawn from `base`.
+
+    Duplicates are topped up with further draws of `cardinality` values; if
+    `rounds` draws in a row add nothing new, the field's range is taken to be
+    smaller than the cardinality and fewer keys are returned.
+    """
+    keys = np.unique(base.sample(cardinality))
+    stalled = 0
+    while len(keys) < cardinality and stalled < rounds:
+        more = np.union1d(keys, base.sample(cardinality))
+        stalled = stalled + 1 if len(more) == len(keys) else 0
+        keys = more
+    return keys
+
+
+class KeySampler:
+    """Draws keys from a fixed universe of `cardinality` keys with uniform or Zipf popularity.
+
+    The universe is drawn once from the field's base sampler and shuffled, so
+    the heavy hitters are random members of the configured subnet or range.
+    """
+
+    def __init__(self, base, spec, rng):
+        cardinality = spec.get("cardinality", 1000)
+        keys = distinct_keys(base, cardinality)
+        rng.shuffle(keys)
+        if len(keys) < cardinality:
+            print(f"[WARN] Only {len(keys)} distinct values are available for a cardinality of {cardinality}.")
+            cardinality = len(keys)
+        self.keys = keys[:cardinality]
+        if spec.get("model", "uniform") == "zipf":
+            weights = zipf_weights(cardinality, spec.get("exponent", 1.0))
+        else:
+            weights = np.ones(cardinality)
+        self.table = AliasTable(weights, rng)
+
+    def sample(self, n):
+        return self.keys[self.table.sample(n)]
+
+
+class HeavyTailSampler:
+    """Heavy-tailed positive integers: "lognormal" (mu, sigma) or "pareto" (shape, minimum), capped at maximum."""
+
+    def __init__(self, spec, rng):
+        self.model = spec["model"]
+        self.spec = spec
+        self.rng = rng
+        self.minimum = spec.get("minimum", 1)
+        self.maximum = spec.get("maximum", 2**32 - 1)
+        if self.model not in ("lognormal", "pareto"):
+            raise ValueError(f"Unknown heavy-tailed model: {self.model}")
+
+    def sample(self, n):
+        if self.model == "lognormal":
+            values = self.rng.lognormal(self.spec.get("mu", 1.0), self.spec.get("sigma", 1.5), size=n)
+        else:
+            values = self.minimum * (1.0 + self.rng.pareto(self.spec.get("shape", 1.2), size=n))
+        return np.clip(values, self.minimum, self.maximum).astype(np.uint32)
+
+
+class WeightedChoiceSampler:
+    """Draws from an explicit list of values with weights, e.g. packet sizes."""
+
+    def __init__(self, values, weights, rng):
+        self.values = np.asarray(values, dtype=np.uint32)
+        self.table = AliasTable(weights or [1] * len(values), rng)
+
+    def sample(self, n):
+        return self.values[self.table.sample(n)]
+
+
+def key_sampler(base, spec, rng):
+    """Wraps a field's base sampler with the configured cardinality/popularity model, if any."""
+    if not spec or (spec.get("model", "uniform") == "uniform" and "cardinality" not in spec):
+        return base
+    return KeySampler(base, spec, rng)
+
+
+def count_sampler(spec, default, rng):
+    """Returns the sampler for a count field (packets): heavy-tailed when configured, else `default`."""
+    if not spec or spec.get("model", "uniform") == "uniform":
+        return default
+    return HeavyTailSampler(spec, rng)
@@ -0,0 +1,113 @@
+import numpy as np
+
+from flow_common.addresses import subnet_host_range
+
+FIRST_IFINDEX = 17000
+
+
+class EnrichmentProfile:
+    """Controls which (exporter, ifIndex) keys the generated flows carry relative to the netif.yml metadata.
+
+    netif.py writes interfaces_per_exporter interfaces, starting at
+    first_ifindex, for every exporter. At any moment each exporter sends on a
+    window of active interfaces within them, sized so that the whole fleet
+    uses about active_keys distinct keys. active_keys is either a number or
+    [seconds, keys] points the working set size follows, linearly between
+    points and from the first stamped batch on, repeating with
+    active_keys_repeat. Every rotation_seconds the windows move on by their
+    own size, so the working set turns over completely. A hit_ratio fraction
+    of the records uses the working set, the rest use one of miss_interfaces
+    ifIndexes above the metadata range that the collector cannot enrich.
+    rng is the worker's generator, so a seeded run stamps the same
+    interfaces every time.
+    """
+
+    def __init__(self, profile, source_packet_subnet, number_of_exporters, rng=None):
+        self.first_host, _ = subnet_host_range(source_packet_subnet)
+        self.first_ifindex = profile.get("first_ifindex", FIRST_IFINDEX)
+        self.interfaces = profile.get("interfaces_per_exporter", 100)
+        self.hit_ratio = profile.get("hit_ratio", 1.0)
+        self.miss_interfaces = profile.get("miss_interfaces", 1000)
+        self.rotation_seconds = profile.get("rotation_seconds", 0)
+        self.number_of_exporters = number_of_exporters
+        active_keys = profile.get("active_keys") or number_of_exporters * self.interfaces
+        if isinstance(active_keys, list):
+            self.key_times = np.array([float(t) for t, _ in active_keys])
+            self.key_counts = np.array([float(keys) for _, keys in active_keys])
+            if self.key_times[0] != 0 or np.any(np.diff(self.key_times) < 0) \
+                    or np.any(self.key_counts <= 0):
+                raise ValueError("enrichment active_keys points need [seconds, keys] in time order, starting at 0 "
+                                 "seconds, with positive key counts")
+            self.key_repeat = profile.get("active_keys_repeat", False)
+            self.active = self._window_size(self.key_counts[0])
+        else:
+            self.key_times = self.key_counts = None
+            self.active = self._window_size(active_keys)
+        self.start = None
+        self.rng = np.random.default_rng() if rng is None else rng
+
+        if not 0 <= self.hit_ratio <= 1:
+            raise ValueError("enrichment hit_ratio must be between 0 and 1")
+        if self.hit_ratio < 1 and self.miss_interfaces < 1:
+            raise ValueError("enrichment miss_interfaces must be at least 1 when hit_ratio is below 1")
+        if self.first_ifindex + self.interfaces + self.miss_interfaces > 65536:
+            raise ValueError("enrichment ifIndexes do not fit in 16 bits; lower first_ifindex, interfaces_per_exporter "
+                             "or miss_interfaces")
+
+    def _window_size(self, keys):
+        return int(min(self.interfaces, max(1, round(keys / self.number_of_exporters))))
+
+    def active_at(self, elapsed):
+        """Returns the interfaces active per exporter elapsed seconds after the first stamped batch."""
+        if self.key_times is None:
+            return self.active
+        if self.key_repeat and self.key_times[-1] > 0:
+            elapsed %= self.key_times[-1]
+        return self._window_size(np.interp(elapsed, self.key_times, self.key_counts))
+
+    def describe(self):
+        rotation = f", rotating every {self.rotation_seconds}s" if self.rotation_seconds else ""
+        if self.key_times is None:
+            size = (f"{self.active} of {self.interfaces} interfaces active per exporter "
+                    f"({self.active * self.number_of_exporters} keys)")
+        else:
+            sizes = [self._window_size(keys) * self.number_of_exporters for keys in self.key_counts]
+            size = (f"{min(sizes)}-{max(sizes)} keys following {len(sizes)} points over {self.key_times[-1]:g}s"
+                    + (", repeating" if self.key_repeat else ""))
+        return f"{size}, hit ratio {self.hit_ratio:.0%}{rotation}"
+
+    def stamp(self, records, addresses, now):
+        """Sets the input and output ifIndex of records, shaped (packets, records_per_packet), sent by addresses at now."""
+        rng = self.rng
+        shape = records.shape
+        if self.key_times is not None:
+            if self.start is None:
+                self.start = now
+            self.active = self.active_at(now - self.start)
+        active = self.active
+        epoch = int(now // self.rotation_seconds) if self.rotation_seconds else 0
+        # Each exporter's window starts at its own phase so the fleet does not share one set of ifIndexes.
+        window = ((addresses.astype(np.int64) - self.first_host + epoch * active) % self.interfaces)[:, None]
+
+        input_offset = rng.integers(0, active, size=shape)
+        output_offset = (input_offset + rng.integers(1, active, size=shape)) % active if active > 1 \
+            else input_offset
+        input_index = self.first_ifindex + (window + input_offset) % self.interfaces
+        output_index = self.first_ifindex + (window + output_offset) % self.interfaces
+
+        if self.hit_ratio < 1:
+            miss_base = self.first_ifindex + self.interfaces
+            miss = rng.random(shape) >= self.hit_ratio
+            input_index[miss] = miss_base + rng.integers(0, self.miss_interfaces, size=miss.sum())
+            output_index[miss] = miss_base + rng.integers(0, self.miss_interfaces, size=miss.sum())
+        records["input"] = input_index
+        records["output"] = output_index
+
+
+def enrichment_profile(config, rng=None):
+    """Returns the EnrichmentProfile of the "enrichment" config object, drawing from rng, or None when it is not
+    configured."""
+    profile = config.get("enrichment")
+    if not profile:
+        return None
+    return EnrichmentProfile(profile, config["source_packet_subnet"], config.get("number_of_exporters", 10000), rng)
@@ -0,0 +1,93 @@
+import time
+
+import numpy as np
+
+MAX_INITIAL_UPTIME_MS = 30 * 24 * 3600 * 1000  # exporters start with up to 30 days of uptime
+
+
+class ExporterState:
+    """Per-exporter NetFlow v5 protocol state in compact arrays indexed by exporter.
+
+    Each emulated exporter has its own flow sequence (advanced by the number
+    of records it exported, as the v5 spec requires), boot time used to derive
+    sys_uptime, and engine id. A worker owns its exporters exclusively, so the
+    collector sees gap-free sequences per exporter. Boot times are relative to
+    now_ms, which is the start of the window in backfill mode.
+    """
+
+    def __init__(self, addresses, rng, now_ms=None):
+        n = len(addresses)
+        if now_ms is None:
+            now_ms = int(time.time() * 1000)
+        self.addresses = np.asarray(addresses, dtype=np.uint32)
+        self.flow_sequence = rng.integers(0, 2**32, size=n, dtype=np.uint32)
+        self.packet_sequence = rng.integers(0, 2**32, size=n, dtype=np.uint32)
+        self.boot_ms = now_ms - rng.integers(0, MAX_INITIAL_UPTIME_MS, size=n, dtype=np.int64)
+        self.engine_id = rng.integers(0, 256, size=n, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    @staticmethod
+    def _rank(idx):
+        """Returns how many earlier entries of idx name the same exporter."""
+        order = np.argsort(idx, kind="stable")
+        ordered = idx[order]
+        rank = np.empty(len(idx), dtype=np.uint64)
+        rank[order] = np.arange(len(idx)) - np.searchsorted(ordered, ordered, side="left")
+        return rank
+
+    def advance(self, idx, records_per_packet):
+        """Returns the flow sequence of each packet sent by exporters idx and advances their state.
+
+        An exporter may appear several times in idx; its packets get
+        consecutive sequence numbers in order of appearance.
+        """
+        sequences = (self.flow_sequence[idx].astype(np.uint64) + self._rank(idx) * records_per_packet) & 0xFFFFFFFF
+        np.add.at(self.flow_sequence, idx, np.uint32(records_per_packet))
+        return sequences
+
+    def advance_packets(self, idx):
+        """Like advance(), for formats that also number their packets (e.g. sFlow datagram sequences)."""
+        sequences = (self.packet_sequence[idx].astype(np.uint64) + self._rank(idx)) & 0xFFFFFFFF
+        np.add.at(self.packet_sequence, idx, np.uint32(1))
+        return sequences
+
+    def rewind(self, idx, records_per_packet, packets=False):
+        """Undoes advance() (and advance_packets(), with packets) for packets of exporters idx that were never sent.
+
+        idx must be the tail of the batch that was advanced, so every exporter
+        resumes right after the last packet it actually sent.
+        """
+        np.subtract.at(self.flow_sequence, idx, np.uint32(records_per_packet))
+        if packets:
+            np.subtract.at(self.packet_sequence, idx, np.uint32(1))
+
+    def uptime(self, idx, now_ms):
+        """Returns sys_uptime in milliseconds of exporters idx at wall-clock time now_ms."""
+        return (now_ms - self.boot_ms[idx]) & 0xFFFFFFFF
+
+    def add(self, addresses, rng, now_ms):
+        """Appends newly arrived exporters, which start with a fresh sequence and boot time."""
+        n = len(addresses)
+        self.addresses = np.concatenate([self.addresses, np.asarray(addresses, dtype=np.uint32)])
+        self.flow_sequence = np.concatenate([self.flow_sequence, np.zeros(n, dtype=np.uint32)])
+        self.packet_sequence = np.concatenate([self.packet_sequence, np.zeros(n, dtype=np.uint32)])
+        self.boot_ms = np.concatenate([self.boot_ms, np.full(n, now_ms, dtype=np.int64)])
+        self.engine_id = np.concatenate([self.engine_id, rng.integers(0, 256, size=n, dtype=np.uint8)])
+
+    def remove(self, idx):
+        """Drops exporters idx and returns their addresses."""
+        addresses = self.addresses[idx]
+        self.addresses = np.delete(self.addresses, idx)
+        self.flow_sequence = np.delete(self.flow_sequence, idx)
+        self.packet_sequence = np.delete(self.packet_sequence, idx)
+        self.boot_ms = np.delete(self.boot_ms, idx)
+        self.engine_id = np.delete(self.engine_id, idx)
+        return addresses
+
+    def reboot(self, idx, now_ms):
+        """Restarts exporters idx: their flow sequence and sys_uptime start again from zero."""
+        self.flow_sequence[idx] = 0
+        self.packet_sequence[idx] = 0
+        self.boot_ms[idx] = now_ms
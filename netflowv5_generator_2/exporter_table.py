@@ -0,0 +1,55 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from flow_common.addresses import subnet_host_range
+
+
+class ExporterTable:
+    """Exporter addresses stored once as a packed uint32 array in shared memory.
+
+    The parent creates the table; workers receive it as just the segment name
+    and size (see __getstate__) and map the same pages, so startup time and
+    per-worker memory do not grow with number_of_exporters.
+    """
+
+    def __init__(self, shm, count, owner):
+        self.shm = shm
+        self.count = count
+        self.owner = owner
+        self.addresses = np.ndarray((count,), dtype=np.uint32, buffer=shm.buf)
+
+    @classmethod
+    def create(cls, subnet, number_of_exporters, offset=0):
+        """Allocates the table with number_of_exporters host addresses of subnet, skipping the first offset."""
+        first_host, host_count = subnet_host_range(subnet)
+        first_host += offset
+        count = max(0, min(number_of_exporters, host_count - offset))
+        shm = shared_memory.SharedMemory(create=True, size=max(1, count * 4))
+        table = cls(shm, count, owner=True)
+        table.addresses[:] = np.arange(first_host, first_host + count, dtype=np.uint64)
+        return table
+
+    @classmethod
+    def attach(cls, name, count):
+        # Workers share the parent's resource tracker, so attaching does not add a second owner of the segment.
+        return cls(shared_memory.SharedMemory(name=name), count, owner=False)
+
+    def __getstate__(self):
+        return {"name": self.shm.name, "count": self.count}
+
+    def __setstate__(self, state):
+        self.__dict__.update(ExporterTable.attach(state["name"], state["count"]).__dict__)
+
+    def __len__(self):
+        return self.count
+
+    def share(self, worker_index, num_workers):
+        """Returns a view of the addresses owned by one worker: every num_workers-th exporter."""
+        return self.addresses[worker_index::num_workers]
+
+    def close(self):
+        self.addresses = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
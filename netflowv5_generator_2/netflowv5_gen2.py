@@ -1,14 +1,37 @@
-import random
+import asyncio
 import socket
-import struct
 import time
 import json
-import ipaddress
 import multiprocessing
+import multiprocessing.connection
+import os
 import signal
 import sys
 
-FLOWS_PER_PROCESS = 4000  
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))  # for flow_common
+
+from flow_common.addresses import subnet_host_range
+from flow_common.backfill import backfill_clock, backfill_send_rate, format_time
+from flow_common.calibration import (Rebalancer, assign_total, available_cpus, calibration_endpoint, measure_capacity,
+                                     pin_to_cpu, plan_workers)
+from flow_common.load_profile import load_profile
+from flow_common.pacing import TokenBucket
+from flow_common.worker_metrics import HEARTBEAT_INTERVAL, WorkerMetrics
+from churn import exporter_churn
+from collectors import configured_collectors
+from enrichment import enrichment_profile
+from datagram_exporters import DatagramExporters, exporter_bind_addresses
+from exporter_state import ExporterState
+from exporter_table import ExporterTable
+from packet_ring import PacketRing
+from sflow_ring import SflowRing
+from source_ports import export_source_ports, reuseport_report
+from record_engine import RecordEngine
+
+MAX_RECORDS_PER_PACKET = 30  # NetFlow v5 allows at most 30 records per packet
+SFLOW_SAMPLES_PER_DATAGRAM = 10  # 10 flow samples and a counter sample fill a 1372-byte datagram
 processes = []  
 
 def load_config(config_file):
@@ -16,177 +39,446 @@ def load_config(config_file):
     with open(config_file, "r") as f:
         return json.load(f)
 
-def generate_random_ip_from_subnet(subnet):
-    """Generates a random IP address from a given subnet as a string."""
-    network = ipaddress.IPv4Network(subnet, strict=False)
-    return str(random.choice(list(network.hosts())))  # ✅ Convert to string
-
-def parse_port_config(port_config):
-    """Parses port configuration from config.json."""
-    if port_config.lower() == "random":
-        return lambda: random.randint(1024, 65535)  # Random ephemeral port
-    elif "-" in port_config:  
-        start, end = map(int, port_config.split("-"))
-        return lambda: random.randint(start, end)
-    elif "," in port_config:  
-        ports = list(map(int, port_config.split(",")))
-        return lambda: random.choice(ports)
-    else:  
+def packet_record_count(config):
+    """Returns the flows each packet carries: NetFlow v5 records or sFlow flow samples."""
+    if config.get("export_format") == "sflow_v5":
+        return config.get("sflow_samples_per_datagram", SFLOW_SAMPLES_PER_DATAGRAM)
+    return config.get("records_per_packet", MAX_RECORDS_PER_PACKET)
+
+def build_ring(config, sock, collectors, records_per_packet, ring_size, transmit_mode):
+    """Returns the packet ring of the configured export_format."""
+    export_format = config.get("export_format", "netflow_v5")
+    source_ports = export_source_ports(config)
+    if export_format == "sflow_v5":
+        return SflowRing(sock, collectors, records_per_packet, ring_size, transmit_mode,
+                         config.get("sflow_sampling_rate", 1000), source_ports)
+    if export_format == "netflow_v5":
+        return PacketRing(sock, collectors, records_per_packet, ring_size, transmit_mode, source_ports)
+    raise ValueError(f"Unknown export_format: {export_format}")
+
+def build_pacer(config, send_rate, records_per_packet, batch_size):
+    """Returns a packet-rate TokenBucket for send_rate flows per second, or None to send unpaced."""
+    if not send_rate:
+        return None
+    # The pacer counts packets; burst and reporting are expressed in flows.
+    return TokenBucket(send_rate / records_per_packet,
+                       config.get("pacing_burst", batch_size * records_per_packet) / records_per_packet,
+                       config.get("pacing_tick_ms", 1) / 1000)
+
+def report_stats(pid, pacer, clock, stats_interval, records_per_packet, metrics, detail=""):
+    """Prints and publishes target vs achieved FPS and, in backfill mode, the synthetic time reached once per stats interval.
+
+    A paced real-time worker also adopts the rate the parent assigned to it as soon as it changes, so it follows the
+    load profile and the rebalancer.
+    """
+    if pacer and not clock:
+        assigned = metrics.assigned_rate()
+        if assigned and abs(assigned - pacer.rate * records_per_packet) > 1:
+            pacer.set_rate(assigned / records_per_packet)
+    stats = pacer.poll_stats(stats_interval) if pacer else None
+    if stats:
+        target, achieved = stats
+        metrics.set_rates(target * records_per_packet, achieved * records_per_packet)
+        print(f"[Worker] Process {pid}: target {target * records_per_packet:.0f} FPS, "
+              f"achieved {achieved * records_per_packet:.0f} FPS{detail}")
+    progress = clock.poll_stats(stats_interval) if clock else None
+    if progress:
+        synthetic_time, done, achieved = progress
+        if not pacer:
+            metrics.set_rates(0, achieved)
+        print(f"[Worker] Process {pid}: backfilled to {format_time(synthetic_time)} ({done:.1%}), {achieved:.0f} FPS{detail}")
+
+def count_destinations(metrics, ring, start, count, records_per_packet):
+    """Adds the records of ring slots [start, start + count) to their collectors' counters when there are several."""
+    if len(ring.collectors) > 1:
+        for destination, packets in enumerate(ring.destination_counts(start, count).tolist()):
+            if packets:
+                metrics.add_destination_records(destination, packets * records_per_packet)
+
+def run_finished(metrics, started, run_seconds):
+    """Returns True once a timed (calibration) run is over, after publishing the FPS it achieved."""
+    if not run_seconds:
+        return False
+    elapsed = time.monotonic() - started
+    if elapsed < run_seconds:
+        return False
+    metrics.set_rates(0, metrics.records_sent() / elapsed)
+    return True
+
+def worker_seed(config, worker_index):
+    """Returns the RecordEngine seed of one worker: the configured seed (an int, or a list as cluster.py assigns)
+    followed by the worker index, or None to seed from fresh entropy."""
+    seed = config.get("seed")
+    if seed is None:
+        return None
+    return (list(seed) if isinstance(seed, list) else [seed]) + [worker_index]
+
+def wait_for_start(config):
+    """Sleeps until the configured start_at wall-clock time, so workers on several hosts start sending in lockstep."""
+    delay = (config.get("start_at") or 0) - time.time()
+    if delay > 0:
+        time.sleep(delay)
+
+def next_batch(pacer, clock, limit, records_per_packet):
+    """Returns how many packets to send next: paced, and never past the end of the backfill window.
+
+    Returns 0 if the pacer had nothing to release for HEARTBEAT_INTERVAL, so a slowly paced worker still loops.
+    """
+    if clock:
+        limit = min(limit, -(-clock.remaining // records_per_packet))
+    return pacer.acquire_up_to(limit, HEARTBEAT_INTERVAL) if pacer else limit
+
+def worker(config, flows_per_process, exporter_table, worker_index, num_processes, worker_metrics,
+           cpu=None, run_seconds=None):
+    """Worker function to generate and send NetFlow packets.
+
+    The worker owns every num_processes-th exporter of the shared exporter table, starting at worker_index,
+    and publishes its counters to slot worker_index of worker_metrics. It is pinned to cpu if one is given.
+    It starts sending at start_at, if configured, and draws its records from worker_seed(config, worker_index).
+    In backfill mode packets are stamped by a synthetic clock and the worker exits at the end of the window.
+    With flows_per_process None it sends unpaced; with run_seconds it stops after that long and publishes
+    the FPS it achieved, which is how startup calibration measures capacity.
+    """
+    collectors = configured_collectors(config)
+    records_per_packet = packet_record_count(config)
+    batch_size = config.get("send_batch_size", 64)
+    ring_size = config.get("packet_ring_size", 4096)
+    ring_refresh_interval = config.get("ring_refresh_interval", 1)
+    transmit_mode = config.get("transmit_mode", "sendmmsg")
+    metrics = worker_metrics.slot(worker_index)
+    pin_to_cpu(cpu)
+
+    if transmit_mode == "asyncio":
         try:
-            single_port = int(port_config)
-            return lambda: single_port
-        except ValueError:
-            raise ValueError(f"Invalid port configuration: {port_config}")
-
-def generate_netflow_v5_packet(src_ip, dst_ip, flow_sequence):
-    """Generates a valid NetFlow v5 packet with multiple records."""
-    flow_count = 10  
-    netflow_header = struct.pack(
-        "!HHIIIIBBH",
-        5,  
-        flow_count,  
-        int(time.time() * 1000) & 0xFFFFFFFF,  
-        int(time.time()),  
-        int((time.time() % 1) * 1e9) & 0xFFFFFFFF,  
-        flow_sequence,
-        0,  
-        0,  
-        0   
-    )
-
-    flow_records = b""
-    for _ in range(flow_count):
-        new_record = generate_netflow_v5_record()
-        flow_records += new_record
-
-    udp_payload = netflow_header + flow_records  
-    udp_header = struct.pack("!HHHH", 2055, 2055, 8 + len(udp_payload), 0)  
-    ip_header = struct.pack("!BBHHHBBH4s4s",
-                            0x45, 0, 20 + len(udp_header) + len(udp_payload), 0,
-                            0, 64, socket.IPPROTO_UDP, 0,
-                            socket.inet_aton(src_ip), socket.inet_aton(dst_ip))
-
-    return ip_header + udp_header + udp_payload
-
-def worker(config, flows_per_process, ip_list):
-    """Worker function to generate and send NetFlow packets."""
-    collector_ip = config["collector_ip"]
-    collector_port = config["collector_port"]
+            asyncio.run(async_worker(config, flows_per_process, exporter_table.share(worker_index, num_processes), metrics,
+                                     run_seconds, worker_seed(config, worker_index)))
+        except KeyboardInterrupt:
+            print(f"\n[Worker] Process {multiprocessing.current_process().pid} exiting...")
+        sys.exit(0)
+
     sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_RAW)
     sock.setsockopt(socket.IPPROTO_IP, socket.IP_HDRINCL, 1)
-    flow_sequence = random.randint(0, 2**32 - 1)
+    clock = backfill_clock(config, flows_per_process)
+    engine = RecordEngine(config, worker_seed(config, worker_index))
+    enrichment = enrichment_profile(config, engine.rng)
+    exporters = ExporterState(exporter_table.share(worker_index, num_processes), engine.rng,
+                              int((clock or time.time)() * 1000))
+    churn = exporter_churn(config, worker_index, num_processes, engine.rng, (clock or time.time)())
+
+    ring = build_ring(config, sock, collectors, records_per_packet, ring_size, transmit_mode)
+    ring.refresh(engine, int(time.time() * 1000))
+    wait_for_start(config)
+    last_refresh = time.time()
+
+    send_rate = backfill_send_rate(config, flows_per_process) if clock else flows_per_process
+    pacer = build_pacer(config, send_rate, records_per_packet, batch_size)
+    metrics.set_rates(send_rate or 0, 0)
+    stats_interval = config.get("stats_interval", 10)
+    pid = multiprocessing.current_process().pid
+    slot = 0
+    started = time.monotonic()
 
     try:
         while True:
-            for _ in range(flows_per_process):
-                src_ip = str(random.choice(ip_list))  # ✅ Convert to string!
-                try:
-                    packet = generate_netflow_v5_packet(src_ip, collector_ip, flow_sequence)
-                    sock.sendto(packet, (collector_ip, collector_port))
-                    flow_sequence += 1
-                except Exception as e:
-                    if "test a child process" not in str(e):  
-                        print(f"Error sending packet from {src_ip}: {e}")
-            time.sleep(1)
+            metrics.heartbeat()
+            if slot == ring_size:
+                slot = 0
+                now = time.time()
+                if now - last_refresh >= ring_refresh_interval:
+                    ring.refresh(engine, int(now * 1000))
+                    last_refresh = now
+
+            count = next_batch(pacer, clock, min(batch_size, ring_size - slot), records_per_packet)
+            if pacer and pacer.lag:
+                metrics.observe_lag(pacer.lag)
+            if not count:
+                # Idle: beat again and pick up a new assigned rate without waiting for a token.
+                report_stats(pid, pacer, clock, stats_interval, records_per_packet, metrics)
+                continue
+            batch_started = time.perf_counter()
+            now = clock() if clock else time.time()
+            if churn:
+                churn.step(exporters, now)
+            idx = engine.rng.integers(0, len(exporters), size=count)
+            ring.patch(slot, count, exporters, idx, now)
+            if enrichment:
+                enrichment.stamp(ring.records(slot, count), exporters.addresses[idx], now)
+            try:
+                sent = ring.send(slot, count)
+                metrics.add_sent(sent, sent * records_per_packet)
+                count_destinations(metrics, ring, slot, sent, records_per_packet)
+                if sent < count:
+                    ring.rewind(exporters, idx[sent:])
+                    metrics.add_errors()
+            except Exception as e:
+                ring.rewind(exporters, idx)
+                metrics.add_errors()
+                if "test a child process" not in str(e):  
+                    print(f"Error sending packet batch: {e}")
+            metrics.observe_latency(time.perf_counter() - batch_started)
+            slot += count
+
+            report_stats(pid, pacer, clock, stats_interval, records_per_packet, metrics,
+                         churn.describe(exporters) if churn else "")
+            if run_finished(metrics, started, run_seconds):
+                break
+            if clock:
+                clock.advance(count * records_per_packet)
+                if clock.done:
+                    print(f"[Worker] Process {pid}: backfill complete")
+                    break
     except KeyboardInterrupt:
         print(f"\n[Worker] Process {multiprocessing.current_process().pid} exiting...")
     finally:
         sock.close()  
         sys.exit(0)
 
+async def async_worker(config, flows_per_process, addresses, metrics, run_seconds=None, seed=None):
+    """Rootless worker: sends each exporter's packets from its own bound UDP endpoint on one event loop."""
+    collectors = configured_collectors(config)
+    records_per_packet = packet_record_count(config)
+    batch_size = config.get("send_batch_size", 64)
+    ring_size = config.get("packet_ring_size", 4096)
+    ring_refresh_interval = config.get("ring_refresh_interval", 1)
+
+    first_host, _ = subnet_host_range(config["source_packet_subnet"])
+    bind_addresses = exporter_bind_addresses(addresses.tolist(), config.get("async_bind", "port"),
+                                             config.get("async_source_ip", "0.0.0.0"),
+                                             config.get("async_base_port", 20000), first_host)
+    endpoints = await DatagramExporters.open(bind_addresses,
+                                             [collectors.endpoints[i] for i in collectors.assign(addresses).tolist()])
+
+    clock = backfill_clock(config, flows_per_process)
+    engine = RecordEngine(config, seed)
+    enrichment = enrichment_profile(config, engine.rng)
+    exporters = ExporterState(addresses, engine.rng, int((clock or time.time)() * 1000))
+    ring = build_ring(config, None, collectors, records_per_packet, ring_size, "asyncio")
+    ring.refresh(engine, int(time.time() * 1000))
+    await asyncio.sleep(max(0.0, (config.get("start_at") or 0) - time.time()))
+    last_refresh = time.time()
+
+    send_rate = backfill_send_rate(config, flows_per_process) if clock else flows_per_process
+    pacer = build_pacer(config, send_rate, records_per_packet, batch_size)
+    metrics.set_rates(send_rate or 0, 0)
+    stats_interval = config.get("stats_interval", 10)
+    pid = multiprocessing.current_process().pid
+    slot = 0
+    reported_errors = 0
+    started = time.monotonic()
+
+    try:
+        while True:
+            metrics.heartbeat()
+            if slot == ring_size:
+                slot = 0
+                now = time.time()
+                if now - last_refresh >= ring_refresh_interval:
+                    ring.refresh(engine, int(now * 1000))
+                    last_refresh = now
+
+            # Sleep on the event loop so the transports can drain buffered datagrams meanwhile.
+            wait = min(pacer.delay(1), HEARTBEAT_INTERVAL) if pacer else 0
+            woke_at = time.monotonic() + wait
+            await asyncio.sleep(wait)
+            if wait:
+                metrics.observe_lag(max(0.0, time.monotonic() - woke_at))
+                continue
+            await endpoints.drain()
+
+            count = next_batch(pacer, clock, min(batch_size, ring_size - slot), records_per_packet)
+            batch_started = time.perf_counter()
+            idx = engine.rng.integers(0, len(exporters), size=count)
+            now = clock() if clock else time.time()
+            ring.patch(slot, count, exporters, idx, now)
+            if enrichment:
+                enrichment.stamp(ring.records(slot, count), exporters.addresses[idx], now)
+            endpoints.send(ring, slot, count, idx)
+            metrics.add_sent(count, count * records_per_packet)
+            count_destinations(metrics, ring, slot, count, records_per_packet)
+            if endpoints.errors != reported_errors:
+                metrics.add_errors(endpoints.errors - reported_errors)
+                reported_errors = endpoints.errors
+            metrics.observe_latency(time.perf_counter() - batch_started)
+            slot += count
+
+            report_stats(pid, pacer, clock, stats_interval, records_per_packet, metrics,
+                         f" across {len(endpoints)} endpoints, {endpoints.errors} send errors")
+            if run_finished(metrics, started, run_seconds):
+                break
+            if clock:
+                clock.advance(count * records_per_packet)
+                if clock.done:
+                    await endpoints.drain()
+                    print(f"[Worker] Process {pid}: backfill complete")
+                    break
+    finally:
+        endpoints.close()
+
+def report_destinations(labels, records, last_records, elapsed):
+    """Prints the FPS sent to each collector since the last report."""
+    rates = ", ".join(f"{label} {(now - before) / elapsed:.0f} FPS" for label, now, before in zip(labels, records, last_records))
+    print(f"[Collectors] {rates}")
+
+def report_profile(profile, start, end, records, last_records):
+    """Prints the load profile's average target between start and end seconds into the run next to the FPS all
+    workers sent over that stats interval."""
+    print(f"[Profile] {end:.0f}s: target {profile.average(start, end):.0f} FPS (now {profile.rate(end):.0f} FPS), "
+          f"sent {(records - last_records) / (end - start):.0f} FPS")
+
+def stop_processes():
+    """Terminates all worker processes and waits for them to exit."""
+    for p in processes:
+        if p and p.is_alive():  
+            p.terminate()
+    for p in processes:
+        p.join()
+
 def signal_handler(sig, frame):
     """Handle Ctrl+C (SIGINT) and cleanly terminate all processes."""
-    global processes
     print("\n[INFO] Stopping NetFlow generator...")
-
-    if processes:
-        for p in processes:
-            if p and p.is_alive():  
-                p.terminate()
-        for p in processes:
-            p.join()
-
+    stop_processes()
     sys.exit(0)
 
-def generate_netflow_v5_record():
-    """Generates a single NetFlow v5 flow record (48 bytes) with configurable ports."""
-    config = load_config("config.json")
-
-    source_subnet = config["source_ip_subnet"]
-    destination_subnet = config["destination_ip_subnet"]
-
-    # ✅ Define port selection functions inside this function
-    get_src_port = parse_port_config(config.get("source_ports", "random"))
-    get_dst_port = parse_port_config(config.get("destination_ports", "random"))
-
-    src_ip = generate_random_ip_from_subnet(source_subnet)
-    dst_ip = generate_random_ip_from_subnet(destination_subnet)
-
-    src_ip_bytes = socket.inet_aton(src_ip)
-    dst_ip_bytes = socket.inet_aton(dst_ip)
-    next_hop = socket.inet_aton("0.0.0.0")
-
-    packets = random.randint(1, 1000)
-    bytes_count = random.randint(1, 100000)
-
-    start_time = int(time.time() * 1000) & 0xFFFFFFFF
-    end_time = (start_time + random.randint(1, 1000)) & 0xFFFFFFFF
-
-    src_port = get_src_port()  # ✅ Call function to get port
-    dst_port = get_dst_port()  # ✅ Call function to get port
-    tcp_flags = random.randint(0, 255)
-    protocol = random.choice([6, 17])  
-    tos = random.randint(0, 255)
-    src_as = random.randint(0, 65535)
-    dst_as = random.randint(0, 65535)
-    src_mask = random.randint(0, 32)
-    dst_mask = random.randint(0, 32)
-
-    input_iface = random.randint(17000, 17100)
-    output_iface = random.randint(17000, 17100)
-
-    while output_iface == input_iface:
-        output_iface = random.randint(17000, 17100)
-
-    return struct.pack(
-        "!4s4s4sHHIIIIHHxBBBHHBBxx",
-        src_ip_bytes, dst_ip_bytes, next_hop, 
-        input_iface, output_iface,
-        packets, bytes_count, start_time, end_time,
-        src_port, dst_port, tcp_flags, protocol, tos,  
-        src_as, dst_as, src_mask, dst_mask
-    )
-
-def main():
-    global processes  
-
-    config = load_config("config.json")
+def calibrate(config, exporter_table, cpu):
+    """Measures the FPS one pinned, unpaced worker reaches in calibration_seconds.
+
+    The calibration traffic goes to calibration_collector_ip/port, a discard sink, never to the collectors: the
+    calibration worker has its own exporter state, so a collector would see every exporter's sequence and
+    sys_uptime restart when the workers take over (see calibration_endpoint).
+    """
+    seconds = config.get("calibration_seconds", 2)
+    ip, port = calibration_endpoint(config)
+    print(f"Calibrating per-process capacity for {seconds}s on CPU {cpu} against {ip}:{port}...")
+    calibration_config = dict(config, backfill={}, start_at=None, collectors=None, collector_ip=ip, collector_port=port)
+    capacity = measure_capacity(worker, lambda worker_metrics: (calibration_config, None, exporter_table, 0, 1,
+                                                                worker_metrics, cpu, seconds))
+    if not capacity:
+        raise RuntimeError("Calibration worker did not send any flows; check calibration_collector_ip and permissions")
+    print(f"Calibrated {capacity:.0f} FPS per process.")
+    return capacity
+
+def run(config, stop=None, report=None, report_interval=1):
+    """Calibrates, spawns and monitors the workers until they exit or stop (a threading.Event) is set.
+
+    The workers share exporter_count exporters starting exporter_offset addresses into source_packet_subnet (by default
+    all number_of_exporters of them). report(worker_metrics), if given, is called every report_interval seconds;
+    cluster.py uses it to stream each agent's stats to the controller.
+    """
     flows_per_second = config["flows_per_second"]
-    number_of_exporters = config.get("number_of_exporters", 10000)
+    number_of_exporters = config.get("exporter_count", config.get("number_of_exporters", 10000))
     source_packet_subnet = config["source_packet_subnet"]
-
-    num_processes = max(1, (flows_per_second + FLOWS_PER_PROCESS - 1) // FLOWS_PER_PROCESS)
-
-    base_network = ipaddress.IPv4Network(source_packet_subnet)
-    ip_list = list(base_network.hosts())[:number_of_exporters]
-
-    print(f"Spawning {num_processes} processes to handle {flows_per_second} flows per second.")
-    print(f"Using {number_of_exporters} source IPs from {source_packet_subnet} for NetFlow packets.")
-
-    signal.signal(signal.SIGINT, signal_handler)  
-
+    stats_interval = config.get("stats_interval", 10)
+    if config.get("churn") and config.get("transmit_mode") == "asyncio":
+        raise ValueError("churn needs the sendmmsg or sendto transmit_mode; asyncio binds a fixed socket per exporter")
+    if config.get("export_source_port") and config.get("transmit_mode") == "asyncio":
+        raise ValueError("export_source_port needs the sendmmsg or sendto transmit_mode; asyncio mode takes its source "
+                         "ports from async_bind")
+
+    profile = load_profile(config)
+    if profile and config.get("backfill"):
+        print("[WARN] load_profile is ignored in backfill mode; flows_per_second sets the density of the backfill.")
+        profile = None
+
+    collectors = configured_collectors(config)
+    exporter_table = ExporterTable.create(source_packet_subnet, number_of_exporters, config.get("exporter_offset", 0))
+    worker_metrics = None
     try:
-        for i in range(num_processes):
-            flows_for_this_process = min(FLOWS_PER_PROCESS, flows_per_second - i * FLOWS_PER_PROCESS)
-            p = multiprocessing.Process(target=worker, args=(config, flows_for_this_process, ip_list))
+        cpus = available_cpus()
+        capacity = config.get("flows_per_process") or calibrate(config, exporter_table, cpus[0])
+        # With a load profile enough processes are started for its peak, and the rate is then split between them.
+        rates = plan_workers(profile.peak() if profile else flows_per_second, capacity, cpus,
+                             config.get("calibration_headroom", 0.8))
+        num_processes = len(rates)
+        if profile:
+            profile_start = config.get("start_at") or time.time()
+            rates = [profile.rate(0) / num_processes] * num_processes
+
+        if len(exporter_table) < num_processes:
+            raise ValueError(f"number_of_exporters ({len(exporter_table)}) must be at least the number of processes ({num_processes})")
+
+        worker_metrics = WorkerMetrics.create(num_processes, collectors.labels() if len(collectors) > 1 else ())
+        if config.get("metrics_port"):
+            worker_metrics.serve(config["metrics_port"])
+        rebalancer = None
+        if config.get("rebalance", True) and not config.get("backfill"):
+            rebalancer = Rebalancer(worker_metrics, capacity)
+
+        if profile:
+            print(f"Spawning {num_processes} processes to follow the load profile: {profile.describe()}.")
+        else:
+            print(f"Spawning {num_processes} processes to handle {flows_per_second} flows per second.")
+        print(f"Using {len(exporter_table)} source IPs from {source_packet_subnet} for NetFlow packets.")
+        enrichment = enrichment_profile(config)
+        if enrichment:
+            print(f"Enrichment profile: {enrichment.describe()}.")
+        destinations = collectors.assign(exporter_table.addresses)
+        if len(collectors) > 1:
+            shares = np.bincount(destinations, minlength=len(collectors))
+            print(f"Distributing exporters over {len(collectors)} collectors by {collectors.distribution}: "
+                  + ", ".join(f"{label} {count}" for label, count in zip(collectors.labels(), shares.tolist())) + ".")
+        report_readers = (config.get("export_source_port") or {}).get("report_readers")
+        if report_readers:
+            for i, (collector_ip, collector_port) in enumerate(collectors.endpoints):
+                for line in reuseport_report(export_source_ports(config), exporter_table.addresses[destinations == i],
+                                             collector_ip, collector_port, report_readers):
+                    print(f"SO_REUSEPORT model: {line}")
+
+        for i, rate in enumerate(rates):
+            worker_metrics.assign(i, rate)
+            cpu = cpus[i % len(cpus)] if config.get("cpu_pinning", True) else None
+            # Each worker owns a disjoint slice of the exporters so per-exporter sequences stay gap-free.
+            p = multiprocessing.Process(target=worker, args=(config, rate, exporter_table, i, num_processes,
+                                                               worker_metrics, cpu))
             processes.append(p)
             p.start()
 
+        last_stats = time.monotonic()
+        destination_records = worker_metrics.destination_records()
+        sent_records = 0
+        profile_stats = 0.0
+        timeout = min([stats_interval] + ([report_interval] if report else []) +
+                      ([profile.update_seconds] if profile else []))
+        while any(p.is_alive() for p in processes):
+            multiprocessing.connection.wait([p.sentinel for p in processes], timeout=timeout)
+            if profile:
+                assign_total(worker_metrics, profile.rate(max(0.0, time.time() - profile_start)))
+            if report:
+                report(worker_metrics)
+            if stop and stop.is_set():
+                stop_processes()
+                break
+            if time.monotonic() - last_stats < stats_interval:
+                continue
+            if len(collectors) > 1:
+                records = worker_metrics.destination_records()
+                report_destinations(collectors.labels(), records, destination_records, time.monotonic() - last_stats)
+                destination_records = records
+            if profile:
+                records, now = worker_metrics.totals()[1], max(0.0, time.time() - profile_start)
+                if now > profile_stats:
+                    report_profile(profile, profile_stats, now, records, sent_records)
+                sent_records, profile_stats = records, now
+            last_stats = time.monotonic()
+            if rebalancer:
+                unplaced = rebalancer.step()
+                if unplaced:
+                    print(f"[WARN] {unplaced:.0f} FPS could not be placed on any worker.")
+
         for p in processes:
             p.join()
+        if report:
+            report(worker_metrics)
 
     except KeyboardInterrupt:
         signal_handler(None, None)  
+    finally:
+        exporter_table.close()
+        if worker_metrics:
+            worker_metrics.close()
+
+def main():
+    signal.signal(signal.SIGINT, signal_handler)  
+    run(load_config("config.json"))
 
 if __name__ == "__main__":
-    main()%  
\ No newline at end of file
+    main()
@@ -1,37 +1,122 @@
-import yaml
+import argparse
 import ipaddress
+import json
+import multiprocessing
+import os
 import random
+import shutil
+import time
 
-def generate_netif_yaml(filename="netif.yml", num_ips=10000, entries_per_ip=100):
-    base_network = ipaddress.IPv4Network("10.10.0.0/16")
+BASE_ENTRY = {
+    "ifAlias": "Peer_link_PortChannel",
+    "ifSpeed": 80000,
+    "ifType": 167,
+}
+FIRST_IFINDEX = 17000  # same default as enrichment.py
+WRITE_BUFFER = 1 << 20
+
+
+def exporter_addresses(subnet, num_ips):
+    """Returns the integer range of the first num_ips usable addresses of subnet, without materialising them."""
+    network = ipaddress.IPv4Network(subnet)
+    first = int(network.network_address) + (1 if network.prefixlen < 31 else 0)
+    last = int(network.broadcast_address) - (1 if network.prefixlen < 31 else 0)
+    if num_ips > last - first + 1:
+        raise ValueError(f"{subnet} has only {last - first + 1} usable addresses, {num_ips} requested")
+    return range(first, first + num_ips)
+
+
+def entry_templates(entries_per_ip, first_ifindex):
+    """Returns one (head, middle, tail) format triple per interface index; the interface name goes between them.
+
+    Every scalar is generated here and is plain YAML, so the block can be
+    written as formatted text instead of going through a YAML emitter. Keys
+    are in the order yaml.dump used to sort them.
+    """
+    templates = []
+    for j in range(entries_per_ip):
+        head = f"  {first_ifindex + j}:\n    ifAlias: {BASE_ENTRY['ifAlias']}\n    ifDescr: "
+        middle = "\n    ifName: "
+        tail = f"\n    ifSpeed: {BASE_ENTRY['ifSpeed']}\n    ifType: {BASE_ENTRY['ifType']}\n"
+        templates.append((head, middle, tail))
+    return templates
+
+
+def write_exporters(filename, addresses, entries_per_ip, first_ifindex, seed=None):
+    """Streams the YAML block of every exporter in addresses to filename, one exporter at a time."""
+    rng = random.Random(seed)
     if_names = [f"Port-Channel{100 + i}" for i in range(entries_per_ip)]  # Ensure enough unique names per IP
+    templates = entry_templates(entries_per_ip, first_ifindex)
+
+    with open(filename, "w", buffering=WRITE_BUFFER) as file:
+        for address in addresses:
+            shuffled_if_names = rng.sample(if_names, entries_per_ip)  # Shuffle for uniqueness within IP
+            file.write(f"{ipaddress.IPv4Address(address)}:\n")
+            file.write("".join(head + name + middle + name + tail
+                               for (head, middle, tail), name in zip(templates, shuffled_if_names)))
+
+
+def _write_shard(args):
+    write_exporters(*args)
+    return args[0]
+
+
+def generate_netif_yaml(filename="netif.yml", num_ips=10000, entries_per_ip=100, subnet="10.10.0.0/16",
+                        first_ifindex=FIRST_IFINDEX, workers=1, seed=None):
+    """Writes netif.yml with entries_per_ip interfaces for each of the first num_ips addresses of subnet.
+
+    Memory stays constant however many exporters are written. With workers > 1
+    the addresses are split into contiguous shards generated in parallel to
+    part files, which are then appended to filename in order.
+    """
+    started = time.time()
+    addresses = exporter_addresses(subnet, num_ips)
+    workers = max(1, min(workers, num_ips))
+    if workers == 1:
+        write_exporters(filename, addresses, entries_per_ip, first_ifindex, seed)
+    else:
+        shard_size = -(-num_ips // workers)
+        shards = [(f"{filename}.part{i}", addresses[i * shard_size:(i + 1) * shard_size], entries_per_ip, first_ifindex,
+                   None if seed is None else seed + i)
+                  for i in range(workers)]
+        with multiprocessing.Pool(workers) as pool:
+            parts = pool.map(_write_shard, shards)
+        with open(filename, "wb") as output:
+            for part in parts:
+                with open(part, "rb") as shard:
+                    shutil.copyfileobj(shard, output, WRITE_BUFFER)
+                os.remove(part)
+
+    print(f"Generated {filename} with {num_ips} IP addresses and {entries_per_ip} unique entries per IP "
+          f"in {time.time() - started:.1f}s.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a netif.yml interface metadata file for the emulated exporters")
+    parser.add_argument("--config", help="Generator config.json to take the exporters and enrichment profile from; "
+                                         "the options below override it")
+    parser.add_argument("--output", default="netif.yml", help="File to write (default netif.yml)")
+    parser.add_argument("--exporters", type=int, help="Number of exporter addresses (default 10000)")
+    parser.add_argument("--interfaces", type=int, help="Interfaces per exporter (default 100)")
+    parser.add_argument("--subnet", help="Subnet the exporter addresses are taken from (default 10.10.0.0/16)")
+    parser.add_argument("--first-ifindex", type=int, help="First interface index (default 17000)")
+    parser.add_argument("--workers", type=int, default=1, help="Processes generating shards in parallel (default 1)")
+    parser.add_argument("--seed", type=int, help="Seed for the interface name shuffle, for reproducible files")
+    args = parser.parse_args()
+
+    config = {}
+    if args.config:
+        with open(args.config, "r") as file:
+            config = json.load(file)
+    profile = config.get("enrichment") or {}
+
+    generate_netif_yaml(args.output,
+                        args.exporters or config.get("number_of_exporters", 10000),
+                        args.interfaces or profile.get("interfaces_per_exporter", 100),
+                        args.subnet or config.get("source_packet_subnet", "10.10.0.0/16"),
+                        args.first_ifindex or profile.get("first_ifindex", FIRST_IFINDEX),
+                        args.workers, args.seed)
 
-    base_entry = {
-        "ifAlias": "Peer_link_PortChannel",
-        "ifSpeed": 80000,
-        "ifType": 167,
-    }
-    
-    netif_data = {}
-    ip_list = list(base_network.hosts())[:num_ips]  # Get the first num_ips usable addresses
-
-    for i in range(num_ips):
-        ip_address = str(ip_list[i])
-        shuffled_if_names = random.sample(if_names, len(if_names))  # Shuffle for uniqueness within IP
-
-        netif_data[ip_address] = {
-            17000 + j: {
-                **base_entry,
-                "ifName": shuffled_if_names[j],  # Assign unique ifName per index within this IP
-                "ifDescr": shuffled_if_names[j]  # Sync ifDescr with ifName
-            }
-            for j in range(entries_per_ip)
-        }
-    
-    with open(filename, "w") as file:
-        yaml.dump(netif_data, file, default_flow_style=False, default_style=None)
-    
-    print(f"Generated {filename} with {num_ips} IP addresses and {entries_per_ip} unique entries per IP.")
 
 if __name__ == "__main__":
-    generate_netif_yaml()
\ No newline at end of file
+    main()
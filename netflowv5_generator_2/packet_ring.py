@@ -0,0 +1,164 @@
+import socket
+
+import numpy as np
+
+from collectors import Collectors
+from record_engine import V5_RECORD_DTYPE
+from sendmmsg import MmsgSender, sendmmsg_available
+from source_ports import SourcePorts
+
+IP_UDP_HEADER_DTYPE = [
+    ("ver_ihl", "u1"),
+    ("ip_tos", "u1"),
+    ("total_length", ">u2"),
+    ("ip_id", ">u2"),
+    ("frag_offset", ">u2"),
+    ("ttl", "u1"),
+    ("ip_proto", "u1"),
+    ("ip_checksum", ">u2"),
+    ("src_addr", ">u4"),
+    ("dst_addr", ">u4"),
+    ("src_port", ">u2"),
+    ("dst_port", ">u2"),
+    ("udp_length", ">u2"),
+    ("udp_checksum", ">u2"),
+]
+
+V5_HEADER_DTYPE = [
+    ("version", ">u2"),
+    ("count", ">u2"),
+    ("sys_uptime", ">u4"),
+    ("unix_secs", ">u4"),
+    ("unix_nsecs", ">u4"),
+    ("flow_sequence", ">u4"),
+    ("engine_type", "u1"),
+    ("engine_id", "u1"),
+    ("sampling_interval", ">u2"),
+]
+
+
+def v5_packet_dtype(records_per_packet):
+    """Returns the dtype of a complete IP/UDP/NetFlow v5 packet with a fixed record count."""
+    return np.dtype(IP_UDP_HEADER_DTYPE + V5_HEADER_DTYPE + [("records", V5_RECORD_DTYPE, (records_per_packet,))])
+
+
+class PacketRing:
+    """A ring of prebuilt IP/UDP/NetFlow v5 packets sent through a raw IP_HDRINCL socket.
+
+    Only the exporter address, source port, collector, engine id, sequence
+    and timestamps are patched per send; the flow records are regenerated by refresh().
+    Subclasses for other export formats override packet_dtype(),
+    init_payload(), refresh(), patch() and records().
+    """
+
+    def __init__(self, sock, collectors, records_per_packet, ring_size, transmit_mode="sendmmsg", source_ports=None):
+        self.sock = sock
+        self.collectors = collectors if isinstance(collectors, Collectors) else Collectors([collectors])
+        self.source_ports = source_ports or SourcePorts()
+        self.destinations = np.zeros(ring_size, dtype=np.intp)  # collector index of every slot
+        self.records_per_packet = records_per_packet
+        self.ring_size = ring_size
+        self.packets = np.zeros(ring_size, dtype=self.packet_dtype(records_per_packet))
+        self.packet_size = self.packets.dtype.itemsize
+
+        self.packets["ver_ihl"] = 0x45
+        self.packets["total_length"] = self.packet_size
+        self.packets["ttl"] = 64
+        self.packets["ip_proto"] = socket.IPPROTO_UDP
+        self.packets["dst_addr"] = self.collectors.addresses[0]
+        self.packets["src_port"] = self.source_ports.base
+        self.packets["dst_port"] = self.collectors.ports[0]
+        self.packets["udp_length"] = self.packet_size - 20
+        self.init_payload()
+
+        self.view = memoryview(self.packets.view(np.uint8).reshape(-1))
+        self.sender = None
+        if transmit_mode == "sendmmsg" and sendmmsg_available():
+            self.sender = MmsgSender(sock, self.collectors.endpoints, self.packets.ctypes.data, self.packet_size,
+                                     ring_size)
+
+    @staticmethod
+    def packet_dtype(records_per_packet):
+        return v5_packet_dtype(records_per_packet)
+
+    def init_payload(self):
+        """Fills in the payload fields that never change."""
+        self.packets["version"] = 5
+        self.packets["count"] = self.records_per_packet
+        self.durations = np.zeros((self.ring_size, self.records_per_packet), dtype=np.uint64)
+
+    def records(self, start, count):
+        """Returns the records of slots [start, start + count), shaped (count, records_per_packet)."""
+        return self.packets["records"][start:start + count]
+
+    def refresh(self, engine, uptime_ms):
+        """Regenerates every record in the ring in one vectorized batch."""
+        records = engine.generate(self.ring_size * self.records_per_packet, uptime_ms)
+        records = records.reshape(self.ring_size, self.records_per_packet)
+        self.packets["records"] = records
+        self.durations[:] = (records["last"].astype(np.int64) - records["first"].astype(np.int64)) & 0xFFFFFFFF
+
+    def route(self, batch, start, addresses):
+        """Stamps the source port and collector of each packet of batch, the slots from start sent by addresses."""
+        batch["src_port"] = self.source_ports.ports(addresses)
+        if len(self.collectors) > 1:
+            destinations = self.collectors.assign(addresses)
+            batch["dst_addr"] = self.collectors.addresses[destinations]
+            batch["dst_port"] = self.collectors.ports[destinations]
+            self.destinations[start:start + len(addresses)] = destinations
+            if self.sender is not None:
+                self.sender.route(start, destinations)
+
+    def destination_counts(self, start, count):
+        """Returns how many of slots [start, start + count) go to each collector."""
+        return np.bincount(self.destinations[start:start + count], minlength=len(self.collectors))
+
+    def patch(self, start, count, exporters, idx, now):
+        """Stamps exporter identity, sequence numbers and timestamps into slots [start, start + count).
+
+        idx selects the sending exporter of each packet from an ExporterState;
+        each record ends at its exporter's current sys_uptime.
+        """
+        now_ms = int(now * 1000)
+        uptime = exporters.uptime(idx, now_ms).astype(np.uint64)
+
+        batch = self.packets[start:start + count]
+        batch["src_addr"] = exporters.addresses[idx]
+        self.route(batch, start, exporters.addresses[idx])
+        batch["engine_id"] = exporters.engine_id[idx]
+        batch["flow_sequence"] = exporters.advance(idx, self.records_per_packet)
+        batch["sys_uptime"] = uptime
+        batch["unix_secs"] = now_ms // 1000
+        batch["unix_nsecs"] = int((now % 1) * 1e9) & 0xFFFFFFFF
+
+        records = batch["records"]
+        records["last"] = uptime[:, None]
+        records["first"] = (uptime[:, None] - self.durations[start:start + count]) & 0xFFFFFFFF
+
+    def rewind(self, exporters, idx):
+        """Winds the sequences patch() assigned back over packets that were not sent; idx is the unsent tail."""
+        exporters.rewind(idx, self.records_per_packet)
+
+    def payload(self, slot):
+        """Returns the UDP payload (NetFlow header and records) of one slot, for datagram sockets."""
+        return self.view[slot * self.packet_size + 28:(slot + 1) * self.packet_size]
+
+    def send(self, start, count):
+        """Transmits slots [start, start + count) and returns the number of packets sent.
+
+        A send error after some packets went out ends the batch early and returns how many did; an error on the
+        first packet is raised.
+        """
+        if self.sender is not None:
+            return self.sender.send(start, count)
+
+        size = self.packet_size
+        endpoints = self.collectors.endpoints
+        for i in range(start, start + count):
+            try:
+                self.sock.sendto(self.view[i * size:(i + 1) * size], endpoints[self.destinations[i]])
+            except OSError:
+                if i == start:
+                    raise
+                return i - start
+        return count
@@ -0,0 +1,172 @@
+import numpy as np
+
+from distributions import UniformSampler, WeightedChoiceSampler, count_sampler, key_sampler
+from flow_common.addresses import subnet_host_range
+
+# NetFlow v5 record layout, "!4s4s4sHHIIIIHHxBBBHHBBxx", as a big-endian numpy dtype.
+V5_RECORD_DTYPE = np.dtype([
+    ("srcaddr", ">u4"),
+    ("dstaddr", ">u4"),
+    ("nexthop", ">u4"),
+    ("input", ">u2"),
+    ("output", ">u2"),
+    ("d_pkts", ">u4"),
+    ("d_octets", ">u4"),
+    ("first", ">u4"),
+    ("last", ">u4"),
+    ("srcport", ">u2"),
+    ("dstport", ">u2"),
+    ("pad1", "u1"),
+    ("tcp_flags", "u1"),
+    ("prot", "u1"),
+    ("tos", "u1"),
+    ("src_as", ">u2"),
+    ("dst_as", ">u2"),
+    ("src_mask", "u1"),
+    ("dst_mask", "u1"),
+    ("pad2", ">u2"),
+])
+V5_RECORD_SIZE = V5_RECORD_DTYPE.itemsize  # 48 bytes
+
+IFINDEX_BASE = 17000
+IFINDEX_COUNT = 101  # randint(17000, 17100) is inclusive
+
+
+class SubnetSampler:
+    """Samples IPv4 addresses as integers from one or more weighted subnets.
+
+    The config value may be a single subnet string, a list of subnet strings,
+    or a list of {"subnet": ..., "weight": ...} objects.
+    """
+
+    def __init__(self, subnet_config, rng):
+        if isinstance(subnet_config, str):
+            subnet_config = [subnet_config]
+
+        bases, counts, weights = [], [], []
+        for entry in subnet_config:
+            if isinstance(entry, dict):
+                subnet, weight = entry["subnet"], entry.get("weight", 1)
+            else:
+                subnet, weight = entry, 1
+            base, count = subnet_host_range(subnet)
+            bases.append(base)
+            counts.append(count)
+            weights.append(weight)
+
+        if not bases:
+            raise ValueError("At least one subnet must be configured")
+
+        self.rng = rng
+        self.bases = np.array(bases, dtype=np.uint64)
+        self.counts = np.array(counts, dtype=np.uint64)
+        weights = np.array(weights, dtype=np.float64)
+        self.weights = weights / weights.sum()
+
+    def sample(self, n):
+        """Returns n addresses as a uint32 array."""
+        if len(self.bases) == 1:
+            offsets = self.rng.integers(0, self.counts[0], size=n, dtype=np.uint64)
+            return (self.bases[0] + offsets).astype(np.uint32)
+
+        idx = self.rng.choice(len(self.bases), size=n, p=self.weights)
+        offsets = (self.rng.random(n) * self.counts[idx]).astype(np.uint64)
+        return (self.bases[idx] + offsets).astype(np.uint32)
+
+
+class PortSampler:
+    """Vectorized equivalent of parse_port_config(): "random", "a-b", "a,b,c" or a single port."""
+
+    def __init__(self, port_config, rng):
+        self.rng = rng
+        self.ports = None
+        self.low = self.high = None
+
+        port_config = str(port_config)
+        if port_config.lower() == "random":
+            self.low, self.high = 1024, 65535
+        elif "-" in port_config:
+            self.low, self.high = map(int, port_config.split("-"))
+        elif "," in port_config:
+            self.ports = np.array(list(map(int, port_config.split(","))), dtype=np.uint16)
+        else:
+            try:
+                self.low = self.high = int(port_config)
+            except ValueError:
+                raise ValueError(f"Invalid port configuration: {port_config}")
+
+    def sample(self, n):
+        """Returns n ports as a uint16 array."""
+        if self.ports is not None:
+            return self.ports[self.rng.integers(0, len(self.ports), size=n)]
+        return self.rng.integers(self.low, self.high, size=n, endpoint=True, dtype=np.uint16)
+
+
+class RecordEngine:
+    """Generates batches of NetFlow v5 records from a config loaded once.
+
+    The optional "distributions" config object shapes individual fields:
+    source_ip, destination_ip, source_port, destination_port, src_as and
+    dst_as accept {"model": "uniform" | "zipf", "exponent", "cardinality"};
+    packets accepts {"model": "lognormal" | "pareto", ...}; packet_size
+    accepts {"sizes": [...], "weights": [...]} and makes bytes the packet
+    count times a sampled packet size.
+    """
+
+    def __init__(self, config, seed=None):
+        self.rng = rng = np.random.default_rng(seed)
+        dist = config.get("distributions", {})
+
+        self.src_addrs = key_sampler(SubnetSampler(config["source_ip_subnet"], rng), dist.get("source_ip"), rng)
+        self.dst_addrs = key_sampler(SubnetSampler(config["destination_ip_subnet"], rng), dist.get("destination_ip"), rng)
+        self.src_ports = key_sampler(PortSampler(config.get("source_ports", "random"), rng), dist.get("source_port"), rng)
+        self.dst_ports = key_sampler(PortSampler(config.get("destination_ports", "random"), rng), dist.get("destination_port"), rng)
+        self.src_as = key_sampler(UniformSampler(0, 65535, rng, np.uint16), dist.get("src_as"), rng)
+        self.dst_as = key_sampler(UniformSampler(0, 65535, rng, np.uint16), dist.get("dst_as"), rng)
+        self.packets = count_sampler(dist.get("packets"), UniformSampler(1, 1000, rng), rng)
+
+        packet_size = dist.get("packet_size")
+        self.packet_sizes = None
+        if packet_size:
+            self.packet_sizes = WeightedChoiceSampler(packet_size["sizes"], packet_size.get("weights"), rng)
+        self.protocols = np.array([6, 17], dtype=np.uint8)
+
+    def generate(self, n, uptime_ms):
+        """Returns a structured array of n records; first/last are relative to uptime_ms."""
+        rng = self.rng
+        records = np.zeros(n, dtype=V5_RECORD_DTYPE)
+
+        records["srcaddr"] = self.src_addrs.sample(n)
+        records["dstaddr"] = self.dst_addrs.sample(n)
+
+        # Output interface is drawn from the same range but never equals the input interface.
+        input_offset = rng.integers(0, IFINDEX_COUNT, size=n)
+        output_offset = (input_offset + rng.integers(1, IFINDEX_COUNT, size=n)) % IFINDEX_COUNT
+        records["input"] = IFINDEX_BASE + input_offset
+        records["output"] = IFINDEX_BASE + output_offset
+
+        packets = self.packets.sample(n)
+        records["d_pkts"] = packets
+        if self.packet_sizes is None:
+            records["d_octets"] = rng.integers(1, 100000, size=n, endpoint=True, dtype=np.uint32)
+        else:
+            records["d_octets"] = np.minimum(packets.astype(np.uint64) * self.packet_sizes.sample(n), 0xFFFFFFFF)
+
+        start_time = np.full(n, uptime_ms & 0xFFFFFFFF, dtype=np.uint64)
+        records["first"] = start_time
+        records["last"] = (start_time + rng.integers(1, 1000, size=n, endpoint=True, dtype=np.uint64)) & 0xFFFFFFFF
+
+        records["srcport"] = self.src_ports.sample(n)
+        records["dstport"] = self.dst_ports.sample(n)
+        records["tcp_flags"] = rng.integers(0, 256, size=n, dtype=np.uint8)
+        records["prot"] = self.protocols[rng.integers(0, len(self.protocols), size=n)]
+        records["tos"] = rng.integers(0, 256, size=n, dtype=np.uint8)
+        records["src_as"] = self.src_as.sample(n)
+        records["dst_as"] = self.dst_as.sample(n)
+        records["src_mask"] = rng.integers(0, 33, size=n, dtype=np.uint8)
+        records["dst_mask"] = rng.integers(0, 33, size=n, dtype=np.uint8)
+        return records
+
+    def generate_bytes(self, n, uptime_ms):
+        """Returns n packed 48-byte records as one bytes object."""
+        return self.generate(n, uptime_ms).tobytes()
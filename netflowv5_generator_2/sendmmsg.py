@@ -0,0 +1,106 @@
+import ctypes
+import ctypes.util
+import os
+import socket
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+_sendmmsg = getattr(_libc, "sendmmsg", None)
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+class _SockAddrIn(ctypes.Structure):
+    _fields_ = [
+        ("sin_family", ctypes.c_ushort),
+        ("sin_port", ctypes.c_uint16),
+        ("sin_addr", ctypes.c_char * 4),
+        ("sin_zero", ctypes.c_char * 8),
+    ]
+
+
+if _sendmmsg is not None:
+    _sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+    _sendmmsg.restype = ctypes.c_int
+
+
+def sendmmsg_available():
+    """Returns True when the C library exposes sendmmsg(2) (Linux)."""
+    return _sendmmsg is not None
+
+
+class MmsgSender:
+    """Sends slots of a fixed-size packet buffer, many per system call.
+
+    The buffer is addressed as slot_count slots of slot_size bytes starting at
+    base_address; message headers are built once and reused for every send.
+    Every slot goes to the first of addresses until route() points it at
+    another one.
+    """
+
+    def __init__(self, sock, addresses, base_address, slot_size, slot_count):
+        if _sendmmsg is None:
+            raise OSError("sendmmsg is not available on this platform")
+
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.sockaddrs = (_SockAddrIn * len(addresses))(
+            *[_SockAddrIn(socket.AF_INET, socket.htons(port), socket.inet_aton(ip)) for ip, port in addresses])
+        self.names = [ctypes.addressof(self.sockaddrs) + i * ctypes.sizeof(_SockAddrIn) for i in range(len(addresses))]
+        self.iovecs = (_IOVec * slot_count)()
+        self.msgs = (_MMsgHdr * slot_count)()
+
+        for i in range(slot_count):
+            iov = self.iovecs[i]
+            iov.iov_base = base_address + i * slot_size
+            iov.iov_len = slot_size
+
+            hdr = self.msgs[i].msg_hdr
+            hdr.msg_name = self.names[0]
+            hdr.msg_namelen = ctypes.sizeof(_SockAddrIn)
+            hdr.msg_iov = ctypes.pointer(iov)
+            hdr.msg_iovlen = 1
+
+    def route(self, start, destinations):
+        """Points the slots from start onwards at destinations, indexes into the addresses the sender was built with."""
+        msgs = self.msgs
+        names = self.names
+        for slot, destination in enumerate(destinations.tolist(), start):
+            msgs[slot].msg_hdr.msg_name = names[destination]
+
+    def send(self, start, count):
+        """Sends slots [start, start + count) and returns the number of packets sent.
+
+        Like sendmmsg(2) itself, an error after part of the batch went out
+        returns the partial count; only an error before any packet was sent
+        raises OSError.
+        """
+        sent = 0
+        while sent < count:
+            msgs = ctypes.cast(ctypes.byref(self.msgs, (start + sent) * ctypes.sizeof(_MMsgHdr)),
+                               ctypes.POINTER(_MMsgHdr))
+            result = _sendmmsg(self.fd, msgs, count - sent, 0)
+            if result < 0:
+                if sent:
+                    return sent
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err))
+            sent += result
+        return sent
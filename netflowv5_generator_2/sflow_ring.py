@@ -0,0 +1,250 @@
+import numpy as np
+
+from packet_ring import IP_UDP_HEADER_DTYPE, PacketRing
+from record_engine import IFINDEX_BASE
+
+# sFlow v5 datagram header with an IPv4 agent address.
+SFLOW_HEADER_DTYPE = [
+    ("version", ">u4"),
+    ("agent_address_type", ">u4"),
+    ("agent_address", ">u4"),
+    ("sub_agent_id", ">u4"),
+    ("datagram_sequence", ">u4"),
+    ("sys_uptime", ">u4"),
+    ("num_samples", ">u4"),
+]
+
+# Synthetic Ethernet/IPv4/TCP header carried by each raw packet header record, padded to 56 bytes.
+# UDP flows use the same layout: the UDP length and checksum sit in the first half of l4_word1.
+SAMPLED_HEADER_DTYPE = np.dtype([
+    ("dst_mac_hi", ">u2"),
+    ("dst_mac_lo", ">u4"),
+    ("src_mac_hi", ">u2"),
+    ("src_mac_lo", ">u4"),
+    ("ethertype", ">u2"),
+    ("ver_ihl", "u1"),
+    ("tos", "u1"),
+    ("total_length", ">u2"),
+    ("ip_id", ">u2"),
+    ("frag_offset", ">u2"),
+    ("ttl", "u1"),
+    ("protocol", "u1"),
+    ("ip_checksum", ">u2"),
+    ("src_addr", ">u4"),
+    ("dst_addr", ">u4"),
+    ("src_port", ">u2"),
+    ("dst_port", ">u2"),
+    ("l4_word1", ">u4"),
+    ("l4_word2", ">u4"),
+    ("tcp_offset_flags", ">u2"),
+    ("tcp_window", ">u2"),
+    ("l4_checksum", ">u2"),
+    ("tcp_urgent", ">u2"),
+    ("pad", ">u2"),
+])
+SAMPLED_HEADER_LENGTH = 54
+
+# Flow sample (enterprise 0, format 1) with one raw packet header record (format 1).
+FLOW_SAMPLE_DTYPE = np.dtype([
+    ("sample_tag", ">u4"),
+    ("sample_length", ">u4"),
+    ("sample_sequence", ">u4"),
+    ("source_id", ">u4"),
+    ("sampling_rate", ">u4"),
+    ("sample_pool", ">u4"),
+    ("drops", ">u4"),
+    ("input", ">u4"),
+    ("output", ">u4"),
+    ("num_records", ">u4"),
+    ("record_tag", ">u4"),
+    ("record_length", ">u4"),
+    ("header_protocol", ">u4"),
+    ("frame_length", ">u4"),
+    ("stripped", ">u4"),
+    ("header_length", ">u4"),
+    ("header", SAMPLED_HEADER_DTYPE),
+])
+
+# Counter sample (enterprise 0, format 2) with one generic interface counters record (format 1).
+COUNTER_SAMPLE_DTYPE = np.dtype([
+    ("sample_tag", ">u4"),
+    ("sample_length", ">u4"),
+    ("sample_sequence", ">u4"),
+    ("source_id", ">u4"),
+    ("num_records", ">u4"),
+    ("record_tag", ">u4"),
+    ("record_length", ">u4"),
+    ("if_index", ">u4"),
+    ("if_type", ">u4"),
+    ("if_speed", ">u8"),
+    ("if_direction", ">u4"),
+    ("if_status", ">u4"),
+    ("in_octets", ">u8"),
+    ("in_ucast_pkts", ">u4"),
+    ("in_multicast_pkts", ">u4"),
+    ("in_broadcast_pkts", ">u4"),
+    ("in_discards", ">u4"),
+    ("in_errors", ">u4"),
+    ("in_unknown_protos", ">u4"),
+    ("out_octets", ">u8"),
+    ("out_ucast_pkts", ">u4"),
+    ("out_multicast_pkts", ">u4"),
+    ("out_broadcast_pkts", ">u4"),
+    ("out_discards", ">u4"),
+    ("out_errors", ">u4"),
+    ("promiscuous_mode", ">u4"),
+])
+
+MAX_FRAME_SIZE = 1514  # without the 4-byte FCS, which is reported as stripped
+UPLINK_SPEED = 10_000_000_000
+UPLINK_OCTETS_PER_MS = 12_500  # counters grow as if the uplink carried 100 Mbit/s in each direction
+UPLINK_PACKETS_PER_MS = 10
+
+
+def sflow_packet_dtype(samples_per_datagram):
+    """Returns the dtype of a complete IP/UDP/sFlow v5 datagram: flow samples followed by one counter sample."""
+    return np.dtype(IP_UDP_HEADER_DTYPE + SFLOW_HEADER_DTYPE + [
+        ("samples", FLOW_SAMPLE_DTYPE, (samples_per_datagram,)),
+        ("counters", COUNTER_SAMPLE_DTYPE),
+    ])
+
+
+def ip_checksum(header):
+    """Returns the IPv4 header checksum of the sampled headers, computed from their fields."""
+    words = (
+        header["ver_ihl"].astype(np.uint64) << 8 | header["tos"],
+        header["total_length"].astype(np.uint64),
+        header["ip_id"].astype(np.uint64),
+        header["frag_offset"].astype(np.uint64),
+        header["ttl"].astype(np.uint64) << 8 | header["protocol"],
+        header["src_addr"].astype(np.uint64) >> 16,
+        header["src_addr"].astype(np.uint64) & 0xFFFF,
+        header["dst_addr"].astype(np.uint64) >> 16,
+        header["dst_addr"].astype(np.uint64) & 0xFFFF,
+    )
+    total = sum(words)
+    total = (total & 0xFFFF) + (total >> 16)
+    total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+class SflowRing(PacketRing):
+    """A ring of prebuilt IP/UDP/sFlow v5 datagrams, sent like the NetFlow v5 packet ring.
+
+    Every datagram carries records_per_packet flow samples, each with a raw
+    Ethernet/IPv4/TCP or UDP header built from a generated flow record, and
+    one generic interface counter sample for the agent's uplink. Each agent
+    has a single flow data source, so flow sample sequence numbers advance by
+    one per sample and datagram sequence numbers by one per datagram.
+    """
+
+    def __init__(self, sock, collectors, records_per_packet, ring_size, transmit_mode="sendmmsg", sampling_rate=1000,
+                 source_ports=None):
+        self.sampling_rate = sampling_rate
+        super().__init__(sock, collectors, records_per_packet, ring_size, transmit_mode, source_ports)
+
+    @staticmethod
+    def packet_dtype(records_per_packet):
+        return sflow_packet_dtype(records_per_packet)
+
+    def init_payload(self):
+        packets = self.packets
+        packets["version"] = 5
+        packets["agent_address_type"] = 1
+        packets["num_samples"] = self.records_per_packet + 1
+
+        samples = packets["samples"]
+        samples["sample_tag"] = 1
+        samples["sample_length"] = FLOW_SAMPLE_DTYPE.itemsize - 8
+        samples["sampling_rate"] = self.sampling_rate
+        samples["num_records"] = 1
+        samples["record_tag"] = 1
+        samples["record_length"] = FLOW_SAMPLE_DTYPE.itemsize - FLOW_SAMPLE_DTYPE.fields["header_protocol"][1]
+        samples["header_protocol"] = 1  # ETHERNET-ISO88023
+        samples["stripped"] = 4
+        samples["header_length"] = SAMPLED_HEADER_LENGTH
+        header = samples["header"]
+        header["dst_mac_hi"] = 0x0200
+        header["src_mac_hi"] = 0x0200
+        header["ethertype"] = 0x0800
+        header["ver_ihl"] = 0x45
+        header["ttl"] = 64
+
+        counters = packets["counters"]
+        counters["sample_tag"] = 2
+        counters["sample_length"] = COUNTER_SAMPLE_DTYPE.itemsize - 8
+        counters["source_id"] = IFINDEX_BASE
+        counters["num_records"] = 1
+        counters["record_tag"] = 1
+        counters["record_length"] = COUNTER_SAMPLE_DTYPE.itemsize - COUNTER_SAMPLE_DTYPE.fields["if_index"][1]
+        counters["if_index"] = IFINDEX_BASE
+        counters["if_type"] = 6  # ethernetCsmacd
+        counters["if_speed"] = UPLINK_SPEED
+        counters["if_direction"] = 1  # full duplex
+        counters["if_status"] = 3  # admin and operational status up
+
+    def records(self, start, count):
+        return self.packets["samples"][start:start + count]
+
+    def refresh(self, engine, uptime_ms):
+        """Regenerates the sampled headers of every flow sample from one vectorized batch of flow records."""
+        n = (self.ring_size, self.records_per_packet)
+        records = engine.generate(self.ring_size * self.records_per_packet, uptime_ms).reshape(n)
+        rng = engine.rng
+        # Field views of the ring are strided by the packet size, so they are assigned in their 2-D shape.
+        samples = self.packets["samples"]
+        header = samples["header"]
+
+        frame_size = np.clip(records["d_octets"] // np.maximum(records["d_pkts"], 1), 64, MAX_FRAME_SIZE)
+        samples["frame_length"] = frame_size + 4
+        samples["input"] = records["input"]
+        samples["output"] = records["output"]
+
+        header["dst_mac_lo"] = records["dstaddr"]
+        header["src_mac_lo"] = records["srcaddr"]
+        header["tos"] = records["tos"]
+        header["total_length"] = frame_size - 14
+        header["ip_id"] = rng.integers(0, 65536, size=n, dtype=np.uint16)
+        header["protocol"] = records["prot"]
+        header["src_addr"] = records["srcaddr"]
+        header["dst_addr"] = records["dstaddr"]
+        header["ip_checksum"] = ip_checksum(header)
+        header["src_port"] = records["srcport"]
+        header["dst_port"] = records["dstport"]
+        header["l4_word1"] = rng.integers(0, 2**32, size=n, dtype=np.uint32)
+        header["l4_word2"] = rng.integers(0, 2**32, size=n, dtype=np.uint32)
+        header["tcp_offset_flags"] = 0x5000 | records["tcp_flags"].astype(np.uint16)
+        header["tcp_window"] = rng.integers(1024, 65536, size=n, dtype=np.uint16)
+        header["l4_checksum"] = rng.integers(0, 65536, size=n, dtype=np.uint16)
+
+        udp = records["prot"] == 17
+        header["l4_word1"][udp] = (header["total_length"][udp].astype(np.uint32) - 20) << 16
+
+    def rewind(self, exporters, idx):
+        exporters.rewind(idx, self.records_per_packet, packets=True)
+
+    def patch(self, start, count, exporters, idx, now):
+        """Stamps agent identity, sequence numbers, sample pools and uplink counters into slots [start, start + count)."""
+        now_ms = int(now * 1000)
+        uptime = exporters.uptime(idx, now_ms).astype(np.uint64)
+        datagram_sequence = exporters.advance_packets(idx)
+        first_sample = exporters.advance(idx, self.records_per_packet)
+
+        batch = self.packets[start:start + count]
+        batch["src_addr"] = exporters.addresses[idx]
+        self.route(batch, start, exporters.addresses[idx])
+        batch["agent_address"] = exporters.addresses[idx]
+        batch["datagram_sequence"] = datagram_sequence
+        batch["sys_uptime"] = uptime
+
+        sample_sequence = (first_sample[:, None] + np.arange(self.records_per_packet, dtype=np.uint64)) & 0xFFFFFFFF
+        samples = batch["samples"]
+        samples["sample_sequence"] = sample_sequence
+        samples["sample_pool"] = (sample_sequence * self.sampling_rate) & 0xFFFFFFFF
+
+        counters = batch["counters"]
+        counters["sample_sequence"] = datagram_sequence
+        counters["in_octets"] = uptime * UPLINK_OCTETS_PER_MS
+        counters["out_octets"] = uptime * UPLINK_OCTETS_PER_MS
+        counters["in_ucast_pkts"] = (uptime * UPLINK_PACKETS_PER_MS) & 0xFFFFFFFF
+        counters["out_ucast_pkts"] = (uptime * UPLINK_PACKETS_PER_MS) & 0xFFFFFFFF
@@ -0,0 +1,153 @@
+import argparse
+import ipaddress
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))  # for flow_common
+
+from flow_common.addresses import subnet_host_range
+
+STRATEGIES = ("fixed", "per_exporter", "round_robin")
+JHASH_INITVAL = 0xDEADBEEF
+MASK32 = 0xFFFFFFFF
+REPORT_TRIALS = 8  # random hash secrets each report line is averaged over
+REPORT_SAMPLE = 1 << 20  # largest number of 4-tuples hashed per trial
+
+
+class SourcePorts:
+    """Chooses the UDP source port of each packet sent through the raw socket.
+
+    "fixed" sends everything from base, so every exporter is a single 4-tuple
+    and the collector's SO_REUSEPORT hash pins it to one reader. "per_exporter"
+    gives every exporter its own port out of pool_size ports starting at base,
+    like the export socket of a real device. "round_robin" moves each worker
+    on to the next port of the pool with every packet, so an exporter's
+    packets are spread over up to pool_size 4-tuples and readers.
+    """
+
+    def __init__(self, strategy="fixed", base=2055, pool_size=1024):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown export_source_port strategy: {strategy}")
+        self.strategy = strategy
+        self.base = base
+        self.pool_size = 1 if strategy == "fixed" else pool_size
+        if not 0 < base <= base + self.pool_size - 1 <= 65535:
+            raise ValueError(f"export_source_port base {base} and pool_size {pool_size} must stay within 1-65535")
+        self.next = 0
+
+    def describe(self):
+        if self.strategy == "fixed":
+            return f"fixed source port {self.base}"
+        return f"{self.strategy.replace('_', '-')} source ports {self.base}-{self.base + self.pool_size - 1}"
+
+    def ports(self, addresses):
+        """Returns the source port of each packet sent by addresses, in send order."""
+        if self.strategy == "fixed":
+            return self.base
+        if self.strategy == "per_exporter":
+            return self.base + addresses % self.pool_size
+        ports = self.base + (self.next + np.arange(len(addresses))) % self.pool_size
+        self.next = (self.next + len(addresses)) % self.pool_size
+        return ports
+
+    def tuples(self, addresses, rng):
+        """Returns the (source address, source port) arrays of the 4-tuples the exporters send from, all equally busy.
+
+        With round_robin every exporter uses every port of the pool; above
+        REPORT_SAMPLE tuples a random sample of them is returned.
+        """
+        addresses = np.asarray(addresses, dtype=np.uint64)
+        if self.strategy != "round_robin":
+            return addresses, np.broadcast_to(np.asarray(self.ports(addresses), dtype=np.uint64), addresses.shape)
+        total = len(addresses) * self.pool_size
+        pick = rng.choice(total, REPORT_SAMPLE, replace=False) if total > REPORT_SAMPLE else np.arange(total)
+        return addresses[pick // self.pool_size], (self.base + pick % self.pool_size).astype(np.uint64)
+
+
+def export_source_ports(config):
+    """Returns the SourcePorts of the "export_source_port" config object; fixed port 2055 when it is not configured."""
+    ports = config.get("export_source_port") or {}
+    return SourcePorts(ports.get("strategy", "fixed"), ports.get("base", 2055), ports.get("pool_size", 1024))
+
+
+def _rol32(value, shift):
+    return ((value << shift) | (value >> (32 - shift))) & MASK32
+
+
+def jhash_3words(a, b, c, initval):
+    """The Linux kernel's jhash_3words() on uint64 arrays holding 32-bit values."""
+    initval = (initval + JHASH_INITVAL + (3 << 2)) & MASK32
+    a, b, c = (a + initval) & MASK32, (b + initval) & MASK32, (c + initval) & MASK32
+    c = ((c ^ b) - _rol32(b, 14)) & MASK32
+    a = ((a ^ c) - _rol32(c, 11)) & MASK32
+    b = ((b ^ a) - _rol32(a, 25)) & MASK32
+    c = ((c ^ b) - _rol32(b, 16)) & MASK32
+    a = ((a ^ c) - _rol32(c, 4)) & MASK32
+    b = ((b ^ a) - _rol32(a, 14)) & MASK32
+    c = ((c ^ b) - _rol32(b, 24)) & MASK32
+    return c
+
+
+def _swap32(value):
+    # The kernel hashes addresses in network byte order as raw 32-bit words of a little-endian host.
+    return value.astype(">u4").view("<u4").astype(np.uint64)
+
+
+def reuseport_readers(src_addr, src_port, dst_addr, dst_port, readers, secret):
+    """Returns the SO_REUSEPORT socket the Linux UDP receive path picks for each 4-tuple.
+
+    This follows udp_ehashfn() and reciprocal_scale() for a group of readers
+    sockets without a BPF steering program; secret stands in for the kernel's
+    random per-boot hash seed.
+    """
+    src_port_be = ((src_port & 0xFF) << 8) | (src_port >> 8)
+    ports = (np.uint64(dst_port) << np.uint64(16)) | src_port_be
+    hashes = jhash_3words(_swap32(np.full(len(src_addr), dst_addr, dtype=np.uint64)), _swap32(src_addr), ports,
+                          np.uint64(secret))
+    return (hashes * np.uint64(readers)) >> np.uint64(32)
+
+
+def reuseport_report(source_ports, addresses, collector_ip, collector_port, reader_counts, trials=REPORT_TRIALS):
+    """Returns report lines on how evenly a collector with each of reader_counts SO_REUSEPORT readers would receive
+    the generated packets, averaged over random hash secrets."""
+    rng = np.random.default_rng()
+    src_addr, src_port = source_ports.tuples(addresses, rng)
+    dst_addr = int(ipaddress.IPv4Address(collector_ip))
+    lines = [f"{len(addresses) * source_ports.pool_size if source_ports.strategy == 'round_robin' else len(addresses)} "
+             f"source 4-tuples towards {collector_ip}:{collector_port} ({source_ports.describe()})"]
+    for readers in reader_counts:
+        busiest = idle = 0.0
+        for _ in range(trials):
+            counts = np.bincount(reuseport_readers(src_addr, src_port, dst_addr, collector_port, readers,
+                                                   rng.integers(0, 2**32)), minlength=readers)
+            busiest += counts.max() / counts.sum()
+            idle += np.count_nonzero(counts == 0)
+        lines.append(f"{readers} readers: busiest reader takes {busiest / trials:.1%} of the packets "
+                     f"(even share {1 / readers:.1%}), {idle / trials:.1f} readers idle")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report how the generator's source 4-tuples spread over a collector's "
+                                                 "SO_REUSEPORT readers")
+    parser.add_argument("--config", default="config.json", help="Generator config.json (default config.json)")
+    parser.add_argument("--readers", type=int, nargs="+", help="Reader counts to report on (default "
+                                                              "export_source_port.report_readers, or 1 2 4 8 16 32)")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as file:
+        config = json.load(file)
+    first_host, host_count = subnet_host_range(config["source_packet_subnet"])
+    addresses = np.arange(first_host, first_host + min(config.get("number_of_exporters", 10000), host_count),
+                          dtype=np.uint64)
+    reader_counts = args.readers or (config.get("export_source_port") or {}).get("report_readers") or [1, 2, 4, 8, 16, 32]
+    for line in reuseport_report(export_source_ports(config), addresses, config["collector_ip"],
+                                 config["collector_port"], reader_counts):
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
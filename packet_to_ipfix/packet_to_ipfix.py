@@ -2,7 +2,12 @@ import socket
 import struct
 import time
 import json
-from scapy.all import sniff, IP, TCP, UDP
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))  # for flow_common
+
+from flow_common.afpacket import open_capture, parse_frame, report_capture
 
 # Load configuration from external file
 with open("config.json", "r") as config_file:
@@ -17,6 +22,8 @@ ACTIVE_TIMEOUT = config.get("ACTIVE_TIMEOUT", 60)
 INACTIVE_TIMEOUT = config.get("INACTIVE_TIMEOUT", 30)
 EXPORTER_PORT = config.get("EXPORTER_PORT", 4739)  # fixed source port for uniform behavior
 TEMPLATE_INTERVAL = config.get("TEMPLATE_INTERVAL", 300)  # seconds
+CAPTURE_BACKEND = config.get("CAPTURE_BACKEND", "auto")  # "auto", "ring", "socket" or "scapy", see open_capture
+RECEIVE_BUFFER_BYTES = config.get("RECEIVE_BUFFER_BYTES", 64 << 20)  # size of the ring or of the socket's queue
 
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 sock.bind(("0.0.0.0", EXPORTER_PORT))
@@ -104,50 +111,70 @@ def send_data_records(sequence_number):
 
     flows.clear()
 
-def packet_handler(packet):
-    global flows
-    current_time = int(time.monotonic() * 1000) & 0xFFFFFFFF
-
-    if IP in packet:
-        src_ip = packet[IP].src
-        dst_ip = packet[IP].dst
-        proto = packet[IP].proto
-        src_port = dst_port = 0
-        tcp_flags = 0
-
-        if TCP in packet:
-            src_port = packet[TCP].sport
-            dst_port = packet[TCP].dport
-            tcp_flags = int(packet[TCP].flags)
-        elif UDP in packet:
-            src_port = packet[UDP].sport
-            dst_port = packet[UDP].dport
-
-        key = (src_ip, dst_ip, src_port, dst_port, proto)
-
-        if key in flows:
-            flows[key]['packets'] += 1
-            flows[key]['bytes'] += len(packet)
-        else:
-            flows[key] = {
-                'src_ip': src_ip,
-                'dst_ip': dst_ip,
-                'src_port': src_port,
-                'dst_port': dst_port,
-                'proto': proto,
-                'tcp_flags': tcp_flags,
-                'packets': 1,
-                'bytes': len(packet)
-            }
+def account(src_ip, dst_ip, src_port, dst_port, proto, tcp_flags, length):
+    """Adds one packet of length bytes to its flow. Addresses are ints, converted to strings only for a new flow."""
+    key = (src_ip, dst_ip, src_port, dst_port, proto)
+    flow = flows.get(key)
+    if flow:
+        flow['packets'] += 1
+        flow['bytes'] += length
+    else:
+        flows[key] = {
+            'src_ip': socket.inet_ntoa(struct.pack("!I", src_ip)),
+            'dst_ip': socket.inet_ntoa(struct.pack("!I", dst_ip)),
+            'src_port': src_port,
+            'dst_port': dst_port,
+            'proto': proto,
+            'tcp_flags': tcp_flags,
+            'packets': 1,
+            'bytes': length
+        }
+
+def frame_handler(frame, length):
+    """Accounts one captured Ethernet frame. The template only holds IPv4 addresses."""
+    try:
+        parsed = parse_frame(frame)
+    except (struct.error, IndexError):
+        return  # truncated headers
+    if parsed and parsed[0] == 4:
+        account(*parsed[1:7], length)
+
+def scapy_capture():
+    """Returns a capture(timeout) function that sniffs with scapy, imported only when this backend is used."""
+    from scapy.all import sniff, IP, TCP, UDP
+
+    def packet_handler(packet):
+        if IP in packet:
+            src_port = dst_port = 0
+            tcp_flags = 0
+
+            if TCP in packet:
+                src_port = packet[TCP].sport
+                dst_port = packet[TCP].dport
+                tcp_flags = int(packet[TCP].flags)
+            elif UDP in packet:
+                src_port = packet[UDP].sport
+                dst_port = packet[UDP].dport
+
+            account(struct.unpack("!I", socket.inet_aton(packet[IP].src))[0],
+                    struct.unpack("!I", socket.inet_aton(packet[IP].dst))[0],
+                    src_port, dst_port, packet[IP].proto, tcp_flags, len(packet))
+
+    return lambda timeout: sniff(iface=INTERFACE, filter="ip", prn=packet_handler, store=0, timeout=timeout)
 
 def main():
     global flow_sequence
     print(f"[+] Starting IPFIX exporter on interface: {INTERFACE} from source port {EXPORTER_PORT}")
+    capture, statistics = open_capture(CAPTURE_BACKEND, INTERFACE, frame_handler, scapy_capture,
+                                       receive_buffer=RECEIVE_BUFFER_BYTES)
+    kernel_counts = (0, 0)
     send_template(flow_sequence)
     flow_sequence += 1
     try:
         while True:
-            sniff(iface=INTERFACE, filter="ip", prn=packet_handler, store=0, timeout=ACTIVE_TIMEOUT)
+            capture(ACTIVE_TIMEOUT)
+            if statistics:
+                kernel_counts = report_capture(statistics, kernel_counts, "[i] ")
             if time.time() - last_template_time > TEMPLATE_INTERVAL:
                 send_template(flow_sequence)
                 flow_sequence += 1
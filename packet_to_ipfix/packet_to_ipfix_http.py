@@ -2,7 +2,12 @@ import socket
 import struct
 import time
 import json
-from scapy.all import sniff, IP, TCP, UDP, Raw
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))  # for flow_common
+
+from flow_common.afpacket import open_capture, parse_frame, report_capture
 
 # Load configuration from external file
 with open("config.json", "r") as config_file:
@@ -17,6 +22,9 @@ ACTIVE_TIMEOUT = config.get("ACTIVE_TIMEOUT", 60)
 INACTIVE_TIMEOUT = config.get("INACTIVE_TIMEOUT", 30)
 EXPORTER_PORT = config.get("EXPORTER_PORT", 4739)
 TEMPLATE_INTERVAL = config.get("TEMPLATE_INTERVAL", 300)
+CAPTURE_BACKEND = config.get("CAPTURE_BACKEND", "auto")  # "auto", "ring", "socket" or "scapy", see open_capture
+RECEIVE_BUFFER_BYTES = config.get("RECEIVE_BUFFER_BYTES", 64 << 20)  # size of the ring or of the socket's queue
+HTTP_SNAPLEN = 2048  # bytes captured of each frame: the headers plus the start of an HTTP request
 
 ENTERPRISE_FIELDS_CFG = config.get("ENTERPRISE_FIELDS", {})
 PEN = ENTERPRISE_FIELDS_CFG.get("PEN", 35632)
@@ -143,56 +151,85 @@ def extract_http_headers(payload):
     except Exception:
         return "", "", ""
 
-def packet_handler(packet):
-    global flows
-    current_time = int(time.monotonic() * 1000) & 0xFFFFFFFF
-
-    if IP in packet:
-        src_ip = packet[IP].src
-        dst_ip = packet[IP].dst
-        proto = packet[IP].proto
-        src_port = dst_port = 0
-        tcp_flags = 0
-        http_url = http_ua = http_site = ""
-
-        if TCP in packet:
-            src_port = packet[TCP].sport
-            dst_port = packet[TCP].dport
-            tcp_flags = int(packet[TCP].flags)
-            if dst_port == 80 and packet.haslayer(Raw):
-                http_url, http_ua, http_site = extract_http_headers(bytes(packet[Raw].load))
-        elif UDP in packet:
-            src_port = packet[UDP].sport
-            dst_port = packet[UDP].dport
-
-        key = (src_ip, dst_ip, src_port, dst_port, proto)
-
-        if key in flows:
-            flows[key]['packets'] += 1
-            flows[key]['bytes'] += len(packet)
-        else:
-            flows[key] = {
-                'src_ip': src_ip,
-                'dst_ip': dst_ip,
-                'src_port': src_port,
-                'dst_port': dst_port,
-                'proto': proto,
-                'tcp_flags': tcp_flags,
-                'packets': 1,
-                'bytes': len(packet),
-                'http_url': http_url,
-                'http_ua': http_ua,
-                'http_site': http_site
-            }
+def account(src_ip, dst_ip, src_port, dst_port, proto, tcp_flags, length, http=("", "", "")):
+    """Adds one packet of length bytes to its flow. Addresses are ints, converted to strings only for a new flow,
+    which also takes the (url, user agent, site) of http."""
+    key = (src_ip, dst_ip, src_port, dst_port, proto)
+    flow = flows.get(key)
+    if flow:
+        flow['packets'] += 1
+        flow['bytes'] += length
+    else:
+        http_url, http_ua, http_site = http
+        flows[key] = {
+            'src_ip': socket.inet_ntoa(struct.pack("!I", src_ip)),
+            'dst_ip': socket.inet_ntoa(struct.pack("!I", dst_ip)),
+            'src_port': src_port,
+            'dst_port': dst_port,
+            'proto': proto,
+            'tcp_flags': tcp_flags,
+            'packets': 1,
+            'bytes': length,
+            'http_url': http_url,
+            'http_ua': http_ua,
+            'http_site': http_site
+        }
+
+def frame_handler(frame, length):
+    """Accounts one captured Ethernet frame. The template only holds IPv4 addresses."""
+    try:
+        parsed = parse_frame(frame)
+    except (struct.error, IndexError):
+        return  # truncated headers
+    if not parsed or parsed[0] != 4:
+        return
+    _, src_ip, dst_ip, src_port, dst_port, proto, tcp_flags, payload_offset = parsed
+    http = ("", "", "")
+    # Only a new flow keeps the headers, so the payload of an existing flow's packets is not decoded.
+    if proto == 6 and dst_port == 80 and payload_offset < len(frame) \
+            and (src_ip, dst_ip, src_port, dst_port, proto) not in flows:
+        http = extract_http_headers(bytes(frame[payload_offset:]))
+    account(src_ip, dst_ip, src_port, dst_port, proto, tcp_flags, length, http)
+
+def scapy_capture():
+    """Returns a capture(timeout) function that sniffs with scapy, imported only when this backend is used."""
+    from scapy.all import sniff, IP, TCP, UDP, Raw
+
+    def packet_handler(packet):
+        if IP in packet:
+            src_port = dst_port = 0
+            tcp_flags = 0
+            http = ("", "", "")
+
+            if TCP in packet:
+                src_port = packet[TCP].sport
+                dst_port = packet[TCP].dport
+                tcp_flags = int(packet[TCP].flags)
+                if dst_port == 80 and packet.haslayer(Raw):
+                    http = extract_http_headers(bytes(packet[Raw].load))
+            elif UDP in packet:
+                src_port = packet[UDP].sport
+                dst_port = packet[UDP].dport
+
+            account(struct.unpack("!I", socket.inet_aton(packet[IP].src))[0],
+                    struct.unpack("!I", socket.inet_aton(packet[IP].dst))[0],
+                    src_port, dst_port, packet[IP].proto, tcp_flags, len(packet), http)
+
+    return lambda timeout: sniff(iface=INTERFACE, filter="ip", prn=packet_handler, store=0, timeout=timeout)
 
 def main():
     global flow_sequence
     print(f"[+] Starting IPFIX exporter on interface: {INTERFACE} from source port {EXPORTER_PORT}")
+    capture, statistics = open_capture(CAPTURE_BACKEND, INTERFACE, frame_handler, scapy_capture,
+                                       receive_buffer=RECEIVE_BUFFER_BYTES, snaplen=HTTP_SNAPLEN)
+    kernel_counts = (0, 0)
     send_template(flow_sequence)
     flow_sequence += 1
     try:
         while True:
-            sniff(iface=INTERFACE, filter="ip", prn=packet_handler, store=0, timeout=ACTIVE_TIMEOUT)
+            capture(ACTIVE_TIMEOUT)
+            if statistics:
+                kernel_counts = report_capture(statistics, kernel_counts, "[i] ")
             if time.time() - last_template_time > TEMPLATE_INTERVAL:
                 send_template(flow_sequence)
                 flow_sequence += 1
@@ -2,7 +2,12 @@ import time
 import struct
 import socket
 import json
-from scapy.all import sniff, IP, UDP, TCP
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))  # for flow_common
+
+from flow_common.afpacket import open_capture, parse_frame, report_capture
 
 # Load configuration
 with open("config.json", "r") as config_file:
@@ -13,6 +18,9 @@ COLLECTOR_PORT = config.get("COLLECTOR_PORT", 2055)
 INTERFACE = config.get("INTERFACE", "eth0")
 ACTIVE_TIMEOUT = config.get("ACTIVE_TIMEOUT", 60)
 INACTIVE_TIMEOUT = config.get("INACTIVE_TIMEOUT", 30)
+CAPTURE_BACKEND = config.get("CAPTURE_BACKEND", "auto")  # "auto", "ring", "socket" or "scapy", see open_capture
+RECEIVE_BUFFER_BYTES = config.get("RECEIVE_BUFFER_BYTES", 64 << 20)  # size of the ring or of the socket's queue
+MAX_RECORDS_PER_PACKET = 30  # NetFlow v5 limit
 
 flows = {}
 flow_sequence = 1
@@ -68,42 +76,67 @@ def send_netflow():
         print("No flows to export.")
         return
     print(f"Exporting {len(flows)} NetFlow records to {COLLECTOR_IP}:{COLLECTOR_PORT}")
-    netflow_packet = create_netflow_packet(flows)
-    sock.sendto(netflow_packet, (COLLECTOR_IP, COLLECTOR_PORT))
+    # A v5 packet holds at most 30 records, so a busy interface's flows are split over several packets.
+    items = list(flows.items())
+    for start in range(0, len(items), MAX_RECORDS_PER_PACKET):
+        netflow_packet = create_netflow_packet(dict(items[start:start + MAX_RECORDS_PER_PACKET]))
+        sock.sendto(netflow_packet, (COLLECTOR_IP, COLLECTOR_PORT))
     flows.clear()
 
-def packet_handler(packet):
-    global flows
+def account(key, length):
+    """Adds one packet of length bytes to the flow of key (src_ip, dst_ip, src_port, dst_port, proto)."""
     current_time = int(time.monotonic() * 1000) & 0xFFFFFFFF
 
-    if IP in packet:
-        src_ip = struct.unpack("!I", socket.inet_aton(packet[IP].src))[0]
-        dst_ip = struct.unpack("!I", socket.inet_aton(packet[IP].dst))[0]
-        proto = packet[IP].proto
-        src_port = dst_port = 0
-
-        if UDP in packet or TCP in packet:
-            src_port = packet.sport
-            dst_port = packet.dport
-
-        key = (src_ip, dst_ip, src_port, dst_port, proto)
-
-        if key in flows:
-            flows[key][0] += 1
-            flows[key][1] += len(packet)
-            flows[key][3] = current_time
-        else:
-            flows[key] = [1, len(packet), current_time, current_time]
+    flow = flows.get(key)
+    if flow:
+        flow[0] += 1
+        flow[1] += length
+        flow[3] = current_time
+    else:
+        flows[key] = [1, length, current_time, current_time]
 
     expired_keys = [k for k, v in flows.items() if current_time - v[3] > INACTIVE_TIMEOUT * 1000]
     for key in expired_keys:
         del flows[key]
 
+def frame_handler(frame, length):
+    """Accounts one captured Ethernet frame. NetFlow v5 records only hold IPv4 addresses."""
+    try:
+        parsed = parse_frame(frame)
+    except (struct.error, IndexError):
+        return  # truncated headers
+    if parsed and parsed[0] == 4:
+        account(parsed[1:6], length)
+
+def scapy_capture():
+    """Returns a capture(timeout) function that sniffs with scapy, imported only when this backend is used."""
+    from scapy.all import sniff, IP, UDP, TCP
+
+    def packet_handler(packet):
+        if IP in packet:
+            src_ip = struct.unpack("!I", socket.inet_aton(packet[IP].src))[0]
+            dst_ip = struct.unpack("!I", socket.inet_aton(packet[IP].dst))[0]
+            proto = packet[IP].proto
+            src_port = dst_port = 0
+
+            if UDP in packet or TCP in packet:
+                src_port = packet.sport
+                dst_port = packet.dport
+
+            account((src_ip, dst_ip, src_port, dst_port, proto), len(packet))
+
+    return lambda timeout: sniff(iface=INTERFACE, filter="ip", prn=packet_handler, store=0, timeout=timeout)
+
 def main():
     print(f"Starting NetFlow v5 exporter on interface: {INTERFACE}")
+    capture, statistics = open_capture(CAPTURE_BACKEND, INTERFACE, frame_handler, scapy_capture,
+                                       receive_buffer=RECEIVE_BUFFER_BYTES)
+    kernel_counts = (0, 0)
     try:
         while True:
-            sniff(iface=INTERFACE, filter="ip", prn=packet_handler, store=0, timeout=ACTIVE_TIMEOUT)
+            capture(ACTIVE_TIMEOUT)
+            if statistics:
+                kernel_counts = report_capture(statistics, kernel_counts)
             send_netflow()
     except KeyboardInterrupt:
         print("Shutting down...")